@@ -188,22 +188,25 @@ class AddressBookAPI:
         sender_data = self.integration.get_default_sender_data()
         return self.integration.ship_sales_order(order_id, sender_data, package_data)
     
-    def ship_to_location(self, location_id: int, package_data: Dict) -> Dict:
+    def ship_to_location(self, location_id: int, package_data: Dict,
+                         idempotency_key: str = None) -> Dict:
         """
         Create shipment directly to a location
         
         Args:
             location_id: Shipping location ID
             package_data: Package details (weight, dimensions, service, reference)
+            idempotency_key: Optional key that makes retries return the first shipment
             
         Returns:
             Result dictionary with shipment_pin and status
         """
         sender_data = self.integration.get_default_sender_data()
-        return self.integration.ship_to_location(location_id, sender_data, package_data)
+        return self.integration.ship_to_location(location_id, sender_data, package_data,
+                                                 idempotency_key)
     
     def ship_to_customer(self, customer_id: int, package_data: Dict, 
-                        location_id: int = None) -> Dict:
+                        location_id: int = None, idempotency_key: str = None) -> Dict:
         """
         Create shipment to a customer (uses default location if not specified)
         
@@ -211,6 +214,7 @@ class AddressBookAPI:
             customer_id: Customer ID
             package_data: Package details
             location_id: Optional specific location ID (uses default if None)
+            idempotency_key: Optional key that makes retries return the first shipment
             
         Returns:
             Result dictionary with shipment_pin and status
@@ -227,20 +231,23 @@ class AddressBookAPI:
                 'message': f'No location found for customer {customer_id}'
             }
         
-        return self.ship_to_location(location['location_id'], package_data)
+        return self.ship_to_location(location['location_id'], package_data, idempotency_key)
     
-    def batch_ship_orders(self, order_ids: List[str]) -> List[Dict]:
+    def batch_ship_orders(self, order_ids: List[str], max_in_flight: int = None,
+                          use_async: bool = None) -> List[Dict]:
         """
         Create shipments for multiple orders
         
         Args:
             order_ids: List of order IDs
+            max_in_flight: Maximum concurrent shipments (default: SHIPPING_MAX_IN_FLIGHT)
+            use_async: Drive the shipments from one event loop (default: SHIPPING_ASYNC)
             
         Returns:
             List of result dictionaries
         """
         sender_data = self.integration.get_default_sender_data()
-        return self.integration.batch_ship_orders(order_ids, sender_data)
+        return self.integration.batch_ship_orders(order_ids, sender_data, max_in_flight, use_async)
     
     # ========== CONVENIENCE FUNCTIONS ==========
     
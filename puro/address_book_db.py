@@ -5,30 +5,195 @@ Manages customer addresses, shipping locations, and sales orders for Purolator s
 
 import sqlite3
 import os
+import json
+import time
+import queue
+import threading
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Callable
 from contextlib import contextmanager
 from purolator_utils import validate_postal_code, format_postal_code
 
+# Bump when adding a migration to AddressBookDB._migrations()
+SCHEMA_VERSION = 3
+
+# shipment_requests.status for each shipment result status (anything else is 'failed')
+SHIPMENT_REQUEST_STATUSES = {'Success': 'succeeded', 'In Doubt': 'in_doubt'}
+
+
+def fts5_trigram_available(conn: sqlite3.Connection) -> bool:
+    """
+    Check whether this SQLite build supports FTS5 with the trigram tokenizer
+    
+    Args:
+        conn: Open database connection
+        
+    Returns:
+        True if full-text search can be used
+    """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def fts_phrase(search_term: str) -> str:
+    """Quote a search term as a single FTS5 phrase (substring match with trigrams)"""
+    return '"' + search_term.strip().replace('"', '""') + '"'
+
+
+class ConnectionPool:
+    """Thread-safe pool of reusable SQLite connections"""
+    
+    def __init__(self, db_path: str, size: int = 4, journal_mode: str = 'WAL',
+                 mmap_size: int = 64 * 1024 * 1024, cached_statements: int = 256,
+                 timeout: float = 10.0):
+        """
+        Initialize the pool (connections are opened lazily)
+        
+        Args:
+            db_path: Path to SQLite database file
+            size: Maximum number of open connections
+            journal_mode: SQLite journal mode (WAL lets readers run alongside a writer)
+            mmap_size: Bytes of the database file to memory-map (0 disables)
+            cached_statements: Prepared statements kept per connection
+            timeout: Seconds to wait for a locked database or a free connection
+        """
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.journal_mode = journal_mode
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._reset()
+    
+    def _reset(self):
+        """Start with an empty pool owned by the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open and configure a new connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row  # Enable column access by name
+        if self.journal_mode:
+            conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Borrow a connection, opening a new one if the pool is not full
+        
+        Returns:
+            sqlite3.Connection
+        """
+        # SQLite connections must not be shared across fork(); start over in a child process
+        if self._pid != os.getpid():
+            self._reset()
+        
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"No database connection available after {self.timeout}s (pool size {self.size})"
+            )
+    
+    def release(self, conn: sqlite3.Connection):
+        """
+        Return a borrowed connection to the pool
+        
+        Args:
+            conn: Connection obtained from acquire()
+        """
+        if self._pid != os.getpid():
+            return
+        self._idle.put(conn)
+    
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
 
 class AddressBookDB:
     """Database manager for customer addresses and shipping locations"""
     
-    def __init__(self, db_path: str = "customer_addresses.db"):
+    def __init__(self, db_path: str = "customer_addresses.db", pool_size: int = 4,
+                 mmap_size: int = 64 * 1024 * 1024, cached_statements: int = 256,
+                 journal_mode: str = 'WAL'):
         """
         Initialize database connection
         
         Args:
             db_path: Path to SQLite database file
+            pool_size: Maximum number of pooled connections
+            mmap_size: Bytes of the database file to memory-map (0 disables)
+            cached_statements: Prepared statements kept per connection
+            journal_mode: SQLite journal mode
         """
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            size=pool_size,
+            journal_mode=journal_mode,
+            mmap_size=mmap_size,
+            cached_statements=cached_statements
+        )
+        self._local = threading.local()
         self.init_database()
+        self.fts_enabled = self._has_search_index()
     
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Enable column access by name
+        """
+        Context manager for database connections
+        
+        Connections are borrowed from the pool and returned afterwards.
+        Nested use in the same thread shares the outer connection and
+        transaction; only the outermost block commits or rolls back.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        conn = self.pool.acquire()
+        self._local.conn = conn
         try:
             yield conn
             conn.commit()
@@ -36,76 +201,276 @@ class AddressBookDB:
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            self._local.conn = None
+            self.pool.release(conn)
+    
+    def close(self):
+        """Close pooled database connections"""
+        self.pool.close()
     
     def init_database(self):
-        """Initialize database schema"""
+        """
+        Bring the database schema up to date
+        
+        The schema version is stored in PRAGMA user_version, so on an
+        up-to-date database this is a single cheap read and no DDL runs.
+        """
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Customers table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS customers (
-                    customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_name TEXT NOT NULL,
-                    purolator_account_number TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Shipping locations table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS shipping_locations (
-                    location_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER NOT NULL,
-                    location_name TEXT NOT NULL,
-                    address_street TEXT NOT NULL,
-                    address_city TEXT NOT NULL,
-                    address_province TEXT NOT NULL,
-                    address_postal TEXT NOT NULL,
-                    address_country TEXT NOT NULL DEFAULT 'CA',
-                    phone_number TEXT NOT NULL,
-                    is_default INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
-                )
-            ''')
-            
-            # Sales orders table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sales_orders (
-                    order_id TEXT PRIMARY KEY,
-                    customer_id INTEGER NOT NULL,
-                    location_id INTEGER NOT NULL,
-                    shipment_pin TEXT,
-                    status TEXT DEFAULT 'pending',
-                    weight TEXT,
-                    service_id TEXT,
-                    reference TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    shipped_at TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
-                    FOREIGN KEY (location_id) REFERENCES shipping_locations (location_id)
-                )
-            ''')
-            
-            # Create indexes for better performance
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_customer_name 
-                ON customers(customer_name)
-            ''')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
             
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_location_customer 
-                ON shipping_locations(customer_id)
-            ''')
+            # Take the write lock before re-checking, so concurrent processes migrate once
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
             
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_order_status 
-                ON sales_orders(status)
-            ''')
+            cursor = conn.cursor()
+            for target_version, description, migration in self._migrations():
+                if target_version <= version:
+                    continue
+                migration(cursor)
+                cursor.execute('''
+                    INSERT OR REPLACE INTO schema_version (version, description)
+                    VALUES (?, ?)
+                ''', (target_version, description))
+                cursor.execute(f'PRAGMA user_version = {int(target_version)}')
+    
+    def _migrations(self) -> List[Tuple[int, str, Callable]]:
+        """
+        Ordered list of schema migrations
+        
+        Returns:
+            List of (version, description, migration function) tuples
+        """
+        return [
+            (1, 'Initial schema', self._migrate_initial_schema),
+            (2, 'Full-text search index', self._migrate_search_index),
+            (3, 'Shipment request idempotency keys', self._migrate_shipment_requests),
+        ]
+    
+    def _migrate_initial_schema(self, cursor: sqlite3.Cursor):
+        """Migration 1: customers, shipping locations and sales orders"""
+        # Schema version history
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Customers table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customers (
+                customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_name TEXT NOT NULL,
+                purolator_account_number TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Shipping locations table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shipping_locations (
+                location_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                location_name TEXT NOT NULL,
+                address_street TEXT NOT NULL,
+                address_city TEXT NOT NULL,
+                address_province TEXT NOT NULL,
+                address_postal TEXT NOT NULL,
+                address_country TEXT NOT NULL DEFAULT 'CA',
+                phone_number TEXT NOT NULL,
+                is_default INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
+            )
+        ''')
+        
+        # Sales orders table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales_orders (
+                order_id TEXT PRIMARY KEY,
+                customer_id INTEGER NOT NULL,
+                location_id INTEGER NOT NULL,
+                shipment_pin TEXT,
+                status TEXT DEFAULT 'pending',
+                weight TEXT,
+                service_id TEXT,
+                reference TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                shipped_at TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
+                FOREIGN KEY (location_id) REFERENCES shipping_locations (location_id)
+            )
+        ''')
+        
+        # Create indexes for better performance
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_customer_name 
+            ON customers(customer_name)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_location_customer 
+            ON shipping_locations(customer_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_order_status 
+            ON sales_orders(status)
+        ''')
+    
+    def _migrate_search_index(self, cursor: sqlite3.Cursor):
+        """
+        Migration 2: full-text search index for customers and locations
+        
+        Uses FTS5 with the trigram tokenizer so substring matches ("acm" finds
+        "Acme Ltd") come from the index. Triggers keep it in sync with the base
+        tables. Skipped when SQLite lacks FTS5/trigram; searches then fall back to LIKE.
+        """
+        if not fts5_trigram_available(cursor.connection):
+            return
+        
+        # Customer names (external content - reads customer_name from customers)
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS customer_search USING fts5(
+                customer_name,
+                content='customers',
+                content_rowid='customer_id',
+                tokenize='trigram'
+            )
+        ''')
+        
+        # Location fields plus the owning customer's name (rowid = location_id)
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS location_search USING fts5(
+                location_name,
+                address_city,
+                address_postal,
+                customer_name,
+                tokenize='trigram'
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_search_insert
+            AFTER INSERT ON customers BEGIN
+                INSERT INTO customer_search (rowid, customer_name)
+                VALUES (new.customer_id, new.customer_name);
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_search_delete
+            AFTER DELETE ON customers BEGIN
+                INSERT INTO customer_search (customer_search, rowid, customer_name)
+                VALUES ('delete', old.customer_id, old.customer_name);
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_search_update
+            AFTER UPDATE OF customer_name ON customers BEGIN
+                INSERT INTO customer_search (customer_search, rowid, customer_name)
+                VALUES ('delete', old.customer_id, old.customer_name);
+                INSERT INTO customer_search (rowid, customer_name)
+                VALUES (new.customer_id, new.customer_name);
+                UPDATE location_search SET customer_name = new.customer_name
+                WHERE rowid IN (
+                    SELECT location_id FROM shipping_locations WHERE customer_id = new.customer_id
+                );
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_search_insert
+            AFTER INSERT ON shipping_locations BEGIN
+                INSERT INTO location_search
+                    (rowid, location_name, address_city, address_postal, customer_name)
+                VALUES (
+                    new.location_id, new.location_name, new.address_city, new.address_postal,
+                    (SELECT customer_name FROM customers WHERE customer_id = new.customer_id)
+                );
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_search_delete
+            AFTER DELETE ON shipping_locations BEGIN
+                DELETE FROM location_search WHERE rowid = old.location_id;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_search_update
+            AFTER UPDATE ON shipping_locations BEGIN
+                DELETE FROM location_search WHERE rowid = old.location_id;
+                INSERT INTO location_search
+                    (rowid, location_name, address_city, address_postal, customer_name)
+                VALUES (
+                    new.location_id, new.location_name, new.address_city, new.address_postal,
+                    (SELECT customer_name FROM customers WHERE customer_id = new.customer_id)
+                );
+            END
+        ''')
+        
+        # Index existing rows
+        cursor.execute("INSERT INTO customer_search (customer_search) VALUES ('rebuild')")
+        cursor.execute('DELETE FROM location_search')
+        cursor.execute('''
+            INSERT INTO location_search
+                (rowid, location_name, address_city, address_postal, customer_name)
+            SELECT sl.location_id, sl.location_name, sl.address_city, sl.address_postal,
+                   c.customer_name
+            FROM shipping_locations sl
+            LEFT JOIN customers c ON sl.customer_id = c.customer_id
+        ''')
+    
+    def _migrate_shipment_requests(self, cursor: sqlite3.Cursor):
+        """
+        Migration 3: idempotency keys for shipment creation
+        
+        One row per shipment request (e.g. one per sales order). A request is
+        claimed as 'in_flight' before the SOAP call and finished as
+        'succeeded' (with its PIN and result), 'failed' (Purolator answered
+        without a PIN) or 'in_doubt' (sent, no answer), so retried or
+        concurrent requests coalesce onto a single Purolator shipment.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shipment_requests (
+                idempotency_key TEXT PRIMARY KEY,
+                order_id TEXT,
+                payload_hash TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'in_flight',
+                shipment_pin TEXT,
+                result TEXT,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                claimed_at REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_shipment_request_order 
+            ON shipment_requests(order_id)
+        ''')
+    
+    def _has_search_index(self) -> bool:
+        """Check whether the full-text search tables exist in this database"""
+        with self.get_connection() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*) FROM sqlite_master
+                WHERE type = 'table' AND name IN ('customer_search', 'location_search')
+            ''').fetchone()
+            return row[0] == 2
+    
+    def _use_search_index(self, search_term: str) -> bool:
+        """Trigram matching needs at least 3 characters; shorter terms use LIKE"""
+        return self.fts_enabled and bool(search_term) and len(search_term.strip()) >= 3
     
     # ========== CUSTOMER OPERATIONS ==========
     
@@ -220,7 +585,15 @@ class AddressBookDB:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            if search_term:
+            if search_term and self._use_search_index(search_term):
+                # Indexed substring match, best matches first
+                cursor.execute('''
+                    SELECT c.* FROM customer_search s
+                    JOIN customers c ON c.customer_id = s.rowid
+                    WHERE customer_search MATCH ?
+                    ORDER BY bm25(customer_search), c.customer_name
+                ''', (fts_phrase(search_term),))
+            elif search_term:
                 cursor.execute('''
                     SELECT * FROM customers 
                     WHERE customer_name LIKE ? 
@@ -531,6 +904,128 @@ class AddressBookDB:
             
             return [dict(row) for row in cursor.fetchall()]
     
+    # ========== SHIPMENT REQUEST OPERATIONS ==========
+    
+    def claim_shipment_request(self, idempotency_key: str, payload_hash: str,
+                               order_id: str = None,
+                               lease_seconds: float = 300.0) -> Tuple[bool, Optional[Dict]]:
+        """
+        Atomically take ownership of a shipment request before creating it
+        
+        A new key can be claimed, as can a failed attempt (with the same or
+        corrected shipment data, e.g. after Purolator rejected the order) or
+        an in-flight claim older than lease_seconds with the same payload (its
+        owner died mid-request). A request in doubt is never reclaimed until
+        release_shipment_request() is called for it.
+        
+        Args:
+            idempotency_key: Request key (e.g. 'sales_order:SO-1001')
+            payload_hash: Hash of the shipment data being sent
+            order_id: Sales order the shipment is for (optional)
+            lease_seconds: How long an in-flight claim blocks other requests
+            
+        Returns:
+            Tuple of (claimed, existing request or None); when not claimed the
+            existing request shows whether it succeeded, is still in flight or
+            was made with a different payload
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            existing = self._shipment_request(conn, idempotency_key)
+            
+            if existing:
+                reclaimable = existing['status'] == 'failed' or (
+                    existing['status'] == 'in_flight' and
+                    existing['payload_hash'] == payload_hash and
+                    now - existing['claimed_at'] > lease_seconds
+                )
+                if not reclaimable:
+                    return False, existing
+            
+            conn.execute('''
+                INSERT INTO shipment_requests 
+                (idempotency_key, order_id, payload_hash, status, claimed_at)
+                VALUES (?, ?, ?, 'in_flight', ?)
+                ON CONFLICT(idempotency_key) DO UPDATE SET
+                    status = 'in_flight',
+                    payload_hash = excluded.payload_hash,
+                    attempts = attempts + 1,
+                    claimed_at = excluded.claimed_at,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (idempotency_key, order_id, payload_hash, now))
+            return True, existing
+    
+    def complete_shipment_request(self, idempotency_key: str, result: Dict) -> bool:
+        """
+        Record the outcome of a claimed shipment request
+        
+        Args:
+            idempotency_key: Request key
+            result: Shipment result dictionary ('Success' marks it succeeded,
+                'In Doubt' in doubt, anything else failed)
+            
+        Returns:
+            True if the request was found
+        """
+        status = SHIPMENT_REQUEST_STATUSES.get(result.get('status'), 'failed')
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE shipment_requests 
+                SET status = ?, shipment_pin = ?, result = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE idempotency_key = ?
+            ''', (status, result.get('shipment_pin'), json.dumps(result, default=str), idempotency_key))
+            return cursor.rowcount > 0
+    
+    def release_shipment_request(self, idempotency_key: str, in_flight: bool = False) -> bool:
+        """
+        Let a request in doubt be sent again
+        
+        Call this once Purolator has been checked and the shipment was not
+        created; the next request with the key claims it as a failed attempt.
+        
+        Args:
+            idempotency_key: Request key
+            in_flight: Also release a claim that is still in flight (only when
+                the caller knows its request was never sent)
+            
+        Returns:
+            True if the request was released
+        """
+        statuses = ('in_doubt', 'in_flight') if in_flight else ('in_doubt',)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE shipment_requests 
+                SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+                WHERE idempotency_key = ? AND status IN ({','.join('?' * len(statuses))})
+            ''', (idempotency_key, *statuses))
+            return cursor.rowcount > 0
+    
+    def get_shipment_request(self, idempotency_key: str) -> Optional[Dict]:
+        """
+        Get a shipment request by key
+        
+        Args:
+            idempotency_key: Request key
+            
+        Returns:
+            Dictionary with request data (result decoded) or None
+        """
+        with self.get_connection() as conn:
+            return self._shipment_request(conn, idempotency_key)
+    
+    def _shipment_request(self, conn: sqlite3.Connection, idempotency_key: str) -> Optional[Dict]:
+        row = conn.execute('SELECT * FROM shipment_requests WHERE idempotency_key = ?',
+                           (idempotency_key,)).fetchone()
+        if not row:
+            return None
+        request = dict(row)
+        request['result'] = json.loads(request['result']) if request['result'] else None
+        return request
+    
     # ========== COMBINED QUERIES ==========
     
     def get_order_with_details(self, order_id: str) -> Optional[Dict]:
@@ -572,6 +1067,19 @@ class AddressBookDB:
         """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            
+            if self._use_search_index(search_term):
+                # Indexed substring match across all location fields, best matches first
+                cursor.execute('''
+                    SELECT sl.*, c.customer_name
+                    FROM location_search s
+                    JOIN shipping_locations sl ON sl.location_id = s.rowid
+                    JOIN customers c ON sl.customer_id = c.customer_id
+                    WHERE location_search MATCH ?
+                    ORDER BY bm25(location_search), c.customer_name, sl.location_name
+                ''', (fts_phrase(search_term),))
+                return [dict(row) for row in cursor.fetchall()]
+            
             cursor.execute('''
                 SELECT sl.*, c.customer_name
                 FROM shipping_locations sl
@@ -587,98 +1095,307 @@ class AddressBookDB:
     
     # ========== EXPORT OPERATIONS ==========
     
-    def export_customers_to_csv(self, filepath: str):
+    def export_query_to_csv(self, filepath: str, query: str, params: tuple = (),
+                            compress: bool = None, batch_size: int = 1000) -> int:
         """
-        Export all customers to CSV file
+        Stream the results of a query into a CSV file
+        
+        Rows are fetched in batches of batch_size and written straight to the
+        file, so memory use does not grow with the size of the table.
         
         Args:
             filepath: Path to output CSV file
+            query: SELECT statement
+            params: Query parameters
+            compress: Write gzip output (default: True if filepath ends with .gz)
+            batch_size: Rows fetched per batch
+            
+        Returns:
+            Number of rows written
         """
         import csv
+        import gzip
         
-        customers = self.get_all_customers()
+        if compress is None:
+            compress = str(filepath).endswith('.gz')
         
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            if customers:
-                writer = csv.DictWriter(f, fieldnames=customers[0].keys())
-                writer.writeheader()
-                writer.writerows(customers)
+        rows_written = 0
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            fieldnames = [column[0] for column in cursor.description]
+            
+            if compress:
+                f = gzip.open(filepath, 'wt', newline='', encoding='utf-8')
+            else:
+                f = open(filepath, 'w', newline='', encoding='utf-8')
+            
+            with f:
+                writer = csv.writer(f)
+                writer.writerow(fieldnames)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+                    rows_written += len(rows)
+        
+        return rows_written
+    
+    def export_customers_to_csv(self, filepath: str, compress: bool = None) -> int:
+        """
+        Export all customers to CSV file
+        
+        Args:
+            filepath: Path to output CSV file
+            compress: Write gzip output (default: True if filepath ends with .gz)
+            
+        Returns:
+            Number of customers exported
+        """
+        return self.export_query_to_csv(
+            filepath,
+            'SELECT * FROM customers ORDER BY customer_name',
+            compress=compress
+        )
     
-    def export_locations_to_csv(self, filepath: str):
+    def export_locations_to_csv(self, filepath: str, compress: bool = None) -> int:
         """
         Export all shipping locations to CSV file
         
         Args:
             filepath: Path to output CSV file
+            compress: Write gzip output (default: True if filepath ends with .gz)
+            
+        Returns:
+            Number of locations exported
         """
-        import csv
+        return self.export_query_to_csv(filepath, '''
+            SELECT sl.*, c.customer_name
+            FROM shipping_locations sl
+            JOIN customers c ON sl.customer_id = c.customer_id
+            ORDER BY c.customer_name, sl.location_name
+        ''', compress=compress)
+    
+    def export_orders_to_csv(self, filepath: str, status: str = None,
+                             compress: bool = None) -> int:
+        """
+        Export sales orders with customer and location details to CSV file
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT sl.*, c.customer_name
-                FROM shipping_locations sl
-                JOIN customers c ON sl.customer_id = c.customer_id
-                ORDER BY c.customer_name, sl.location_name
-            ''')
-            locations = [dict(row) for row in cursor.fetchall()]
+        Args:
+            filepath: Path to output CSV file
+            status: Optional status filter (pending, shipped, cancelled)
+            compress: Write gzip output (default: True if filepath ends with .gz)
+            
+        Returns:
+            Number of orders exported
+        """
+        query = '''
+            SELECT 
+                so.*,
+                c.customer_name, c.purolator_account_number,
+                sl.location_name, sl.address_street, sl.address_city,
+                sl.address_province, sl.address_postal, sl.address_country,
+                sl.phone_number
+            FROM sales_orders so
+            JOIN customers c ON so.customer_id = c.customer_id
+            JOIN shipping_locations sl ON so.location_id = sl.location_id
+        '''
+        params = ()
+        if status:
+            query += ' WHERE so.status = ?'
+            params = (status,)
+        query += ' ORDER BY so.created_at'
         
-        if locations:
-            with open(filepath, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=locations[0].keys())
-                writer.writeheader()
-                writer.writerows(locations)
+        return self.export_query_to_csv(filepath, query, params, compress=compress)
     
-    def import_from_csv(self, filepath: str, import_type: str = 'locations'):
+    def import_from_csv(self, filepath: str, import_type: str = 'locations',
+                        batch_size: int = 1000) -> Dict:
         """
         Import customers or locations from CSV
         
+        The file is streamed and rows are written with executemany inside a
+        single connection, committing every batch_size rows. Invalid rows are
+        reported and skipped instead of aborting the import.
+        
+        Locations are attached to a customer by exact (case-insensitive)
+        customer_name; a name that does not exist creates a new customer.
+        
         Args:
             filepath: Path to CSV file
             import_type: 'customers' or 'locations'
+            batch_size: Rows written per batch/commit
+            
+        Returns:
+            Dictionary with 'imported', 'customers_created' and 'errors'
+            (list of {'row': line number, 'message': reason})
         """
         import csv
         
-        with open(filepath, 'r', encoding='utf-8') as f:
+        if import_type not in ('customers', 'locations'):
+            raise ValueError(f"Unknown import type: {import_type}")
+        
+        summary = {'imported': 0, 'customers_created': 0, 'errors': []}
+        
+        with open(filepath, 'r', encoding='utf-8', newline='') as f, \
+                self.get_connection() as conn:
             reader = csv.DictReader(f)
+            cursor = conn.cursor()
             
             if import_type == 'customers':
-                for row in reader:
-                    self.add_customer(
-                        customer_name=row['customer_name'],
-                        purolator_account=row.get('purolator_account_number')
-                    )
+                sql = '''
+                    INSERT INTO customers (customer_name, purolator_account_number)
+                    VALUES (?, ?)
+                '''
+                pending = []
+                for line, row in enumerate(reader, start=2):  # Header is line 1
+                    customer_name = (row.get('customer_name') or '').strip()
+                    if not customer_name:
+                        summary['errors'].append({'row': line, 'message': 'Missing customer_name'})
+                        continue
+                    
+                    pending.append((line, (customer_name, row.get('purolator_account_number') or None)))
+                    if len(pending) >= batch_size:
+                        self._write_import_batch(conn, sql, pending, summary)
+                        pending = []
+                
+                self._write_import_batch(conn, sql, pending, summary)
             
-            elif import_type == 'locations':
-                for row in reader:
-                    # Look up or create customer
-                    customer_name = row.get('customer_name')
-                    if customer_name:
-                        customers = self.search_customers(customer_name)
-                        if customers:
-                            customer_id = customers[0]['customer_id']
+            else:
+                sql = '''
+                    INSERT INTO shipping_locations 
+                    (customer_id, location_name, address_street, address_city, 
+                     address_province, address_postal, address_country, phone_number, is_default)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                '''
+                
+                # Resolve customer names in memory (lowest customer_id wins on duplicates)
+                customer_ids = {}
+                known_ids = set()
+                for customer_id, customer_name in cursor.execute(
+                        'SELECT customer_id, customer_name FROM customers ORDER BY customer_id'):
+                    customer_ids.setdefault(customer_name.strip().casefold(), customer_id)
+                    known_ids.add(customer_id)
+                
+                required = ('location_name', 'address_street', 'address_city',
+                            'address_province', 'address_postal', 'phone_number')
+                
+                pending = []
+                for line, row in enumerate(reader, start=2):  # Header is line 1
+                    try:
+                        missing = [col for col in required if not (row.get(col) or '').strip()]
+                        if missing:
+                            raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+                        try:
+                            is_default = 1 if int(row.get('is_default') or 0) else 0
+                        except ValueError:
+                            raise ValueError(f"Invalid is_default value: {row.get('is_default')}")
+                        
+                        customer_name = (row.get('customer_name') or '').strip()
+                        if customer_name:
+                            key = customer_name.casefold()
+                            customer_id = customer_ids.get(key)
+                            if customer_id is None:
+                                cursor.execute(
+                                    'INSERT INTO customers (customer_name) VALUES (?)',
+                                    (customer_name,)
+                                )
+                                customer_id = cursor.lastrowid
+                                customer_ids[key] = customer_id
+                                known_ids.add(customer_id)
+                                summary['customers_created'] += 1
                         else:
-                            customer_id = self.add_customer(customer_name)
-                    else:
-                        customer_id = int(row['customer_id'])
+                            customer_id = int(row.get('customer_id') or 0)
+                            if customer_id not in known_ids:
+                                raise ValueError(f"Unknown customer_id: {row.get('customer_id')}")
+                    except ValueError as e:
+                        summary['errors'].append({'row': line, 'message': str(e)})
+                        continue
                     
-                    self.add_shipping_location(
-                        customer_id=customer_id,
-                        location_name=row['location_name'],
-                        street=row['address_street'],
-                        city=row['address_city'],
-                        province=row['address_province'],
-                        postal=row['address_postal'],
-                        phone=row['phone_number'],
-                        country=row.get('address_country', 'CA'),
-                        is_default=bool(int(row.get('is_default', 0)))
+                    params = (
+                        customer_id,
+                        row['location_name'],
+                        row['address_street'],
+                        row['address_city'],
+                        row['address_province'],
+                        format_postal_code(row['address_postal']),
+                        row.get('address_country') or 'CA',
+                        row['phone_number'],
+                        is_default
                     )
+                    
+                    if is_default:
+                        # A new default replaces the customer's previous one, in file order;
+                        # if the row is rejected, the previous default stays
+                        self._write_import_batch(conn, sql, pending, summary)
+                        pending = []
+                        reset = ('''
+                            UPDATE shipping_locations 
+                            SET is_default = 0 
+                            WHERE customer_id = ?
+                        ''', (customer_id,))
+                        self._write_import_batch(conn, sql, [(line, params)], summary, before=reset)
+                        continue
+                    
+                    pending.append((line, params))
+                    if len(pending) >= batch_size:
+                        self._write_import_batch(conn, sql, pending, summary)
+                        pending = []
+                
+                self._write_import_batch(conn, sql, pending, summary)
+        
+        return summary
+    
+    def _write_import_batch(self, conn: sqlite3.Connection, sql: str,
+                            rows: List[Tuple[int, tuple]], summary: Dict,
+                            before: Tuple[str, tuple] = None):
+        """
+        Write one batch of import rows and commit
+        
+        If the batch fails as a whole, it is retried row by row so only the
+        offending rows are reported.
+        
+        Args:
+            conn: Open connection
+            sql: INSERT statement
+            rows: List of (line number, parameters) tuples
+            summary: Import summary to update
+            before: Optional (sql, parameters) statement that only stands if
+                the rows are written; with it, a failed batch is not retried
+        """
+        if not rows:
+            conn.commit()
+            return
+        
+        cursor = conn.cursor()
+        cursor.execute('SAVEPOINT import_batch')
+        try:
+            if before:
+                cursor.execute(*before)
+            cursor.executemany(sql, [params for _, params in rows])
+            summary['imported'] += len(rows)
+        except sqlite3.Error as e:
+            cursor.execute('ROLLBACK TO import_batch')
+            if before:
+                summary['errors'].extend({'row': line, 'message': str(e)} for line, _ in rows)
+            else:
+                for line, params in rows:
+                    try:
+                        cursor.execute(sql, params)
+                        summary['imported'] += 1
+                    except sqlite3.Error as row_error:
+                        summary['errors'].append({'row': line, 'message': str(row_error)})
+        cursor.execute('RELEASE import_batch')
+        conn.commit()
 
 
 # Convenience functions for quick access
+_db_instances: Dict[str, AddressBookDB] = {}
+_db_instances_lock = threading.Lock()
+
 def get_db(db_path: str = None) -> AddressBookDB:
     """
-    Get database instance
+    Get database instance (one shared instance per database file)
     
     Args:
         db_path: Optional custom database path
@@ -688,7 +1405,18 @@ def get_db(db_path: str = None) -> AddressBookDB:
     """
     if db_path is None:
         db_path = os.getenv('ADDRESS_BOOK_DB', 'customer_addresses.db')
-    return AddressBookDB(db_path)
+    
+    key = os.path.abspath(db_path)
+    with _db_instances_lock:
+        db = _db_instances.get(key)
+        if db is None:
+            db = AddressBookDB(
+                db_path,
+                pool_size=int(os.getenv('ADDRESS_BOOK_POOL_SIZE', '4')),
+                mmap_size=int(os.getenv('ADDRESS_BOOK_MMAP_SIZE', str(64 * 1024 * 1024)))
+            )
+            _db_instances[key] = db
+        return db
 
 
 if __name__ == '__main__':
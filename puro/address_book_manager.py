@@ -638,10 +638,10 @@ Use the "Download Template" button to get a properly formatted CSV template.
         )
         if filepath:
             try:
-                self.db.import_from_csv(filepath, 'customers')
+                summary = self.db.import_from_csv(filepath, 'customers')
                 self.refresh_customer_list()
                 self.refresh_customer_combo()
-                messagebox.showinfo("Success", "Customers imported successfully")
+                self.show_import_summary("Customers", summary)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to import: {str(e)}")
     
@@ -653,12 +653,33 @@ Use the "Download Template" button to get a properly formatted CSV template.
         )
         if filepath:
             try:
-                self.db.import_from_csv(filepath, 'locations')
+                summary = self.db.import_from_csv(filepath, 'locations')
                 self.refresh_location_list()
-                messagebox.showinfo("Success", "Locations imported successfully")
+                self.refresh_customer_list()
+                self.refresh_customer_combo()
+                self.show_import_summary("Locations", summary)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to import: {str(e)}")
     
+    def show_import_summary(self, label: str, summary: dict):
+        """Show import counts and the first few row errors"""
+        message = f"{label} imported: {summary['imported']}"
+        if summary.get('customers_created'):
+            message += f"\nNew customers created: {summary['customers_created']}"
+        
+        errors = summary.get('errors', [])
+        if not errors:
+            messagebox.showinfo("Success", message)
+            return
+        
+        error_text = "\n".join(f"Row {e['row']}: {e['message']}" for e in errors[:10])
+        if len(errors) > 10:
+            error_text += f"\n... and {len(errors) - 10} more errors"
+        messagebox.showwarning(
+            "Imported with Errors",
+            f"{message}\nSkipped rows: {len(errors)}\n\n{error_text}"
+        )
+    
     def export_customers(self):
         """Export customers to CSV"""
         filepath = filedialog.asksaveasfilename(
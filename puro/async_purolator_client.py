@@ -0,0 +1,321 @@
+"""
+Async Purolator API Client
+asyncio counterpart of PurolatorClient's network methods, for driving
+hundreds of shipments in flight from a single thread
+
+Requires aiohttp (pip install aiohttp). Envelopes, response parsing and label
+files are shared with PurolatorClient, so both clients produce identical
+requests and results.
+
+Usage:
+    async with AsyncPurolatorClient(max_in_flight=100) as client:
+        results = await client.create_shipments(shipments)
+"""
+
+import os
+import asyncio
+from typing import Dict, List, Callable, Optional
+
+# Try to import aiohttp (optional feature)
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    aiohttp = None
+
+from purolator_client import (
+    PurolatorClient, HTTP_RETRIES, HTTP_BACKOFF, RETRY_STATUS_CODES, LABEL_BATCH_SIZE
+)
+from label_io import CHUNK_SIZE as LABEL_CHUNK_SIZE
+
+# Maximum concurrent requests per client
+ASYNC_MAX_IN_FLIGHT = int(os.getenv("PUROLATOR_ASYNC_MAX_IN_FLIGHT", "50"))
+
+
+class AsyncPurolatorClient:
+    """
+    Purolator E-Ship client on aiohttp with a semaphore-bounded request limit
+    """
+    
+    def __init__(self, client: PurolatorClient = None, max_in_flight: int = None):
+        """
+        Configure the client (the HTTP session is opened by async with / open())
+        
+        Args:
+            client: PurolatorClient providing credentials, endpoints, envelopes,
+                parsing and the email sender (default: a new PurolatorClient)
+            max_in_flight: Maximum concurrent HTTP requests
+                (default: PUROLATOR_ASYNC_MAX_IN_FLIGHT from environment, or 50)
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise ImportError("aiohttp is required for AsyncPurolatorClient (pip install aiohttp)")
+        
+        self.client = client or PurolatorClient()
+        self.max_in_flight = max(1, max_in_flight or ASYNC_MAX_IN_FLIGHT)
+        self.session = None
+        self._semaphore = None
+    
+    async def open(self):
+        """Open the keep-alive HTTP session"""
+        if self.session is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                auth=aiohttp.BasicAuth(self.client.username or '', self.client.password or ''),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self
+    
+    async def close(self):
+        """Close the HTTP session"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+    
+    async def __aenter__(self):
+        return await self.open()
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def _post_soap(self, url, soap_action, soap_body, retry_server_errors=False):
+        """
+        POST a SOAP envelope, holding a concurrency slot for the whole exchange
+        
+        Connection failures are always retried (nothing reached the server);
+        5xx responses and dropped connections only with retry_server_errors,
+        as in PurolatorClient._post_soap.
+        
+        Returns:
+            Tuple of (http_status, response_body bytes)
+        """
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": soap_action
+        }
+        
+        for attempt in range(1 + HTTP_RETRIES):
+            last_attempt = attempt == HTTP_RETRIES
+            try:
+                async with self._semaphore:
+                    async with self.session.post(url, data=soap_body, headers=headers) as response:
+                        status, body = response.status, await response.read()
+            except aiohttp.ClientConnectorError:
+                if last_attempt:
+                    raise
+            except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError):
+                if last_attempt or not retry_server_errors:
+                    raise
+            else:
+                if last_attempt or not retry_server_errors or status not in RETRY_STATUS_CODES:
+                    return status, body
+            await asyncio.sleep(HTTP_BACKOFF * (2 ** attempt))
+    
+    async def create_shipment(self, data):
+        """
+        Create a shipment without fetching its label
+        
+        Args:
+            data: Shipment fields (same columns as the batch CSV)
+        
+        Returns:
+            Result dictionary, as PurolatorClient.create_shipment
+        """
+        soap_body = self.client.build_shipment_request_from_data(data)
+        try:
+            status, body = await self._post_soap(
+                self.client.shipment_url,
+                "http://purolator.com/pws/service/v2/CreateShipment",
+                soap_body
+            )
+        except aiohttp.ClientConnectorError:
+            # Never connected, so nothing was sent
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Timed out or dropped after sending: Purolator may have created it
+            return self.client.in_doubt_result(data, e)
+        return self.client.shipment_result(data, status, body)
+    
+    async def create_shipment_from_data(self, data):
+        """Create shipment and fetch its label, as PurolatorClient.create_shipment_from_data"""
+        result = await self.create_shipment(data)
+        
+        # Get label if successful
+        if result['shipment_pin'] and self.client.should_fetch_label():
+            await self.get_and_save_label(result['shipment_pin'], data.get('reference', 'Unknown'))
+        
+        return result
+    
+    async def fetch_label_documents(self, shipment_pins):
+        """
+        Request the bills of lading for several shipments in one GetDocuments call
+        
+        Returns:
+            Dictionary of {pin: {'data': base64 PDF} or {'url': download link}}
+        """
+        pins = list(dict.fromkeys(pin for pin in shipment_pins if pin))
+        if not pins:
+            return {}
+        
+        status, body = await self._post_soap(
+            self.client.documents_url,
+            "http://purolator.com/pws/service/v1/GetDocuments",
+            self.client.build_documents_request(pins),
+            retry_server_errors=True
+        )
+        if status != 200:
+            return {}
+        
+        return self.client.parse_label_documents(body, pins)
+    
+    async def write_label(self, shipment_pin, reference, document):
+        """
+        Save a label PDF in the label store (base64 decoding runs in a worker thread)
+        
+        Returns:
+            Path of the saved PDF, or None if it could not be downloaded
+        """
+        store = self.client.label_store
+        
+        # Save PDF from base64 data, decoded chunk by chunk
+        if document.get('data'):
+            return await asyncio.to_thread(
+                store.put_base64, shipment_pin, reference, document['data']
+            )
+        
+        # Stream the PDF from its URL into a temp file, renamed when complete
+        if document.get('url'):
+            async with self._semaphore:
+                async with self.session.get(document['url']) as response:
+                    if response.status != 200:
+                        return None
+                    with store.writer(shipment_pin, reference) as writer:
+                        async for chunk in response.content.iter_chunked(LABEL_CHUNK_SIZE):
+                            writer.write(chunk)
+            return writer.path
+        
+        return None
+    
+    async def get_and_save_label(self, shipment_pin, reference):
+        """Get and save shipping label - handles both base64 and URL methods"""
+        try:
+            filepath = await asyncio.to_thread(self.client.label_store.get, shipment_pin)
+            if not filepath:
+                documents = await self.fetch_label_documents([shipment_pin])
+                document = documents.get(shipment_pin)
+                if not document:
+                    return None
+                filepath = await self.write_label(shipment_pin, reference, document)
+            
+            if filepath:
+                # Only queues the label; the digest thread does the SMTP work
+                self.client.email_label(filepath, shipment_pin, reference)
+            return filepath
+        
+        except Exception as e:
+            print(f"Error getting label: {e}")
+            return None
+    
+    async def get_and_save_labels(self, shipments, batch_size=None):
+        """
+        Fetch and save labels for many shipments with concurrent batched GetDocuments calls
+        
+        Args:
+            shipments: List of (shipment_pin, reference) tuples
+            batch_size: PINs per GetDocuments call (default: LABEL_BATCH_SIZE)
+        
+        Returns:
+            Dictionary of {pin: saved label path} for the labels that were saved
+        """
+        batch_size = max(1, batch_size or LABEL_BATCH_SIZE)
+        references = dict(shipments)
+        
+        # Labels already on disk skip the GetDocuments call
+        saved = await asyncio.to_thread(self.client.label_store.get_many, references)
+        for pin, filepath in saved.items():
+            self.client.email_label(filepath, pin, references[pin])
+        pins = [pin for pin in references if pin not in saved]
+        
+        async def save_chunk(chunk):
+            try:
+                documents = await self.fetch_label_documents(chunk)
+            except Exception as e:
+                print(f"Error getting labels: {e}")
+                return
+            
+            for pin, document in documents.items():
+                reference = references.get(pin, 'Unknown')
+                try:
+                    filepath = await self.write_label(pin, reference, document)
+                    if filepath:
+                        saved[pin] = filepath
+                        self.client.email_label(filepath, pin, reference)
+                except Exception as e:
+                    print(f"Error saving label for {pin}: {e}")
+        
+        await asyncio.gather(*(
+            save_chunk(pins[start:start + batch_size])
+            for start in range(0, len(pins), batch_size)
+        ))
+        return saved
+    
+    async def create_shipments(self, shipments: List[Dict],
+                               on_result: Callable[[int, Dict], None] = None,
+                               fetch_labels: Optional[bool] = None) -> List[Dict]:
+        """
+        Create many shipments concurrently (bounded by max_in_flight)
+        
+        Labels are fetched afterwards with batched GetDocuments calls.
+        
+        Args:
+            shipments: Shipment dictionaries (batch CSV rows)
+            on_result: Called with (index, result) as each shipment is created
+            fetch_labels: Download labels (default: client.should_fetch_label())
+        
+        Returns:
+            Result dictionaries in the same order as shipments
+        """
+        if fetch_labels is None:
+            fetch_labels = self.client.should_fetch_label()
+        
+        async def create(index, data):
+            try:
+                result = await self.create_shipment(data)
+            except Exception as e:
+                result = {
+                    'reference': data.get('reference', f'Row {index + 1}'),
+                    'status': 'Error',
+                    'message': str(e)
+                }
+            if on_result:
+                on_result(index, result)
+            return result
+        
+        results = await asyncio.gather(*(
+            create(index, data) for index, data in enumerate(shipments)
+        ))
+        
+        if fetch_labels:
+            await self.get_and_save_labels([
+                (result['shipment_pin'], result['reference'])
+                for result in results if result.get('shipment_pin')
+            ])
+        
+        return list(results)
+    
+    async def test_connection(self):
+        """
+        Check that the shipping service endpoint is reachable
+        
+        Returns:
+            Tuple of (is_ok, message)
+        """
+        try:
+            async with self.session.get(self.client.shipment_url,
+                                        timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    return (True, "API connection successful!")
+                return (False, f"API responded with status: {response.status}")
+        except Exception as e:
+            return (False, f"Connection failed: {str(e)}")
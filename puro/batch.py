@@ -0,0 +1,139 @@
+"""
+Headless Batch Shipping
+Ship a CSV batch from the command line, with JSON progress events on stdout
+
+Runs the same ShippingEngine as the desktop app without tkinter or a display,
+so batches can be shipped from cron on a server. The batch is journaled: if
+the run is stopped or killed, running it again on the same CSV ships only the
+rows that are left.
+
+Usage:
+    python -m puro.batch shipments.csv [--max-in-flight 8] [--no-labels]
+    python puro/batch.py shipments.csv
+    
+    # crontab: ship tonight's export at 02:00
+    0 2 * * * cd /srv/shipping && python -m puro.batch exports/orders.csv >> batch.log 2>&1
+
+stdout carries one JSON object per line and nothing else:
+    {"event": "loaded", "ts": ..., "csv": "...", "rows": 120, "valid": 118, "errors": [...]}
+    {"event": "started", "ts": ..., "total": 118, "already_done": 0, "in_doubt": 0}
+    {"event": "result", "ts": ..., "done": 1, "total": 118, "result": {...}}
+    {"event": "finished", "ts": ..., "processed": 118, "succeeded": 117, "failed": 1, ...}
+Other output from the client goes to stderr.
+
+Exit status: 0 when every row was valid and shipped, 1 when rows failed,
+were skipped, are in doubt or the run was stopped, 2 when the batch could
+not run at all.
+"""
+
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import contextlib
+from pathlib import Path
+
+# Sibling modules are imported bare, as when the scripts are run from this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from dotenv import load_dotenv
+
+from shipping_engine import ShippingEngine
+
+
+class EventWriter:
+    """Writes engine events as JSON lines; safe to call from worker threads"""
+    
+    def __init__(self, stream):
+        """
+        Args:
+            stream: Text stream the events go to (the real stdout)
+        """
+        self.stream = stream
+        self.skipped = 0
+        self.finished = None
+        self._lock = threading.Lock()
+    
+    def __call__(self, event: str, data: dict):
+        if event == 'loaded':
+            self.skipped = len(data['errors'])
+        elif event == 'finished':
+            self.finished = data
+        
+        line = json.dumps({'event': event, 'ts': round(time.time(), 3), **data}, default=str)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def exit_status(events: EventWriter) -> int:
+    """Process exit status for a finished run"""
+    summary = events.finished
+    if summary is None:
+        return 2
+    if summary['failed'] or summary['in_doubt'] or summary['stopped'] or events.skipped:
+        return 1
+    return 0
+
+
+def main():
+    """Run a batch from the command line"""
+    parser = argparse.ArgumentParser(description='Ship a CSV batch without the GUI (JSON events on stdout)')
+    parser.add_argument('csv', help='Shipment CSV in the batch template format')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='Concurrent CreateShipment calls (default: SHIPPING_MAX_IN_FLIGHT, or 1)')
+    parser.add_argument('--no-labels', action='store_true',
+                        help='Create shipments without downloading labels')
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Set this CSV's journal aside and ship every row again")
+    parser.add_argument('--retry-in-doubt', action='store_true',
+                        help='Re-send rows an earlier run was cut off on (they may already exist)')
+    parser.add_argument('--journal-dir', help='Batch journal directory (default: BATCH_JOURNAL_DIR)')
+    parser.add_argument('--results-dir', help='Where batch_results_*.csv is written (default: current directory)')
+    parser.add_argument('--no-results', action='store_true', help='Do not write a results CSV')
+    args = parser.parse_args()
+    
+    load_dotenv()
+    
+    events = EventWriter(sys.stdout)
+    if not Path(args.csv).is_file():
+        events('error', {'message': f"CSV file not found: {args.csv}"})
+        sys.exit(2)
+    
+    # Keep stdout for events only; the client's prints go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            engine = ShippingEngine(max_in_flight=args.max_in_flight, on_event=events,
+                                    journal_dir=args.journal_dir, results_dir=args.results_dir)
+        except Exception as e:
+            events('error', {'message': f"Could not start: {e}"})
+            sys.exit(2)
+        engine.client.fetch_labels = not args.no_labels
+        
+        # SIGTERM (cron timeout, shutdown) or Ctrl+C: stop taking new rows, let
+        # in-flight ones finish and close the journal; a second signal aborts
+        def request_stop(signum, frame):
+            signal.signal(signum, signal.SIG_DFL if signum == signal.SIGTERM else signal.default_int_handler)
+            events('stopping', {'signal': signal.Signals(signum).name})
+            engine.stop()
+        
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        
+        try:
+            engine.run(args.csv, resume=not args.no_resume, retry_in_doubt=args.retry_in_doubt,
+                       save_results=not args.no_results)
+        except Exception as e:
+            events('error', {'message': f"Batch failed: {e}"})
+        finally:
+            # Queued label emails go out before the process exits
+            if engine.client.email_sender:
+                engine.client.email_sender.close()
+    
+    sys.exit(exit_status(events))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Batch Journal
+Write-ahead, append-only JSONL journal for resumable CSV batches
+
+Every row is journaled as 'started' before its CreateShipment call,
+'created' once Purolator has answered ('in_doubt' if the request got no
+answer), and 'finished' when its label has been handled. Each record is flushed to the OS as soon as it is written (it
+survives the process crashing); fsync runs at most every fsync_interval
+seconds and on close.
+
+Re-running the same CSV resumes from the journal:
+    - finished rows are skipped and keep their recorded result
+    - rows whose shipment was created but whose label was not saved are
+      not shipped again, only their label is fetched
+    - rows that were started but never answered, or whose request timed
+      out or was dropped, are "in doubt" (the shipment may exist) and are
+      not re-sent unless asked to
+    - rows Purolator rejected, rows that could not be sent and
+      never-started rows are processed again
+
+Rows are identified by a hash of their contents, so inserting or reordering
+rows in the CSV does not ship the same row twice.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+JOURNAL_DIR = os.getenv("BATCH_JOURNAL_DIR", "batch_journals")
+
+# Result status of rows whose shipment may or may not exist (as purolator_client.IN_DOUBT)
+IN_DOUBT = "In Doubt"
+
+# Result reported for rows that were interrupted mid-request
+IN_DOUBT_MESSAGE = "Interrupted while creating the shipment; check Purolator before shipping it again"
+
+
+def row_keys(rows: List[Dict]) -> List[str]:
+    """
+    Stable identity for each row (content hash plus occurrence number)
+    
+    Args:
+        rows: CSV rows
+    
+    Returns:
+        One key per row
+    """
+    seen: Dict[str, int] = {}
+    keys = []
+    for row in rows:
+        digest = hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        keys.append(f"{digest[:16]}:{occurrence}")
+    return keys
+
+
+def journal_path(csv_path: Union[str, Path], directory: Union[str, Path] = None) -> Path:
+    """Journal file for a CSV (one per CSV path)"""
+    csv_path = Path(csv_path).resolve()
+    tag = hashlib.sha1(str(csv_path).encode('utf-8')).hexdigest()[:8]
+    return Path(directory or JOURNAL_DIR) / f"{csv_path.stem}-{tag}.jsonl"
+
+
+class BatchJournal:
+    """Per-row state of one CSV batch, persisted as an append-only JSONL file"""
+    
+    def __init__(self, path: Union[str, Path], rows: List[Dict], fsync_interval: float = 1.0):
+        """
+        Open (or create) a journal and replay what it already holds
+        
+        Args:
+            path: Journal file
+            rows: The batch rows, in CSV order
+            fsync_interval: Seconds between fsyncs of the journal file
+        """
+        self.path = Path(path)
+        self.rows = rows
+        self.keys = row_keys(rows)
+        self.fsync_interval = fsync_interval
+        
+        self._state: Dict[str, str] = {}
+        self._results: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        
+        self._replay()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.path.stat().st_size == 0:
+            self._append({'event': 'batch', 'rows': len(rows), 'ts': time.time()})
+    
+    @classmethod
+    def for_csv(cls, csv_path: Union[str, Path], rows: List[Dict],
+                directory: Union[str, Path] = None, resume: bool = True,
+                **kwargs) -> 'BatchJournal':
+        """
+        Journal for a CSV batch
+        
+        Args:
+            csv_path: CSV file the rows came from
+            rows: The batch rows
+            directory: Journal directory (default: BATCH_JOURNAL_DIR or batch_journals/)
+            resume: Continue the existing journal; False sets it aside and starts over
+        
+        Returns:
+            BatchJournal
+        """
+        path = journal_path(csv_path, directory)
+        if not resume and path.exists():
+            path.rename(path.with_name(f"{path.stem}.{time.strftime('%Y%m%d_%H%M%S')}.jsonl"))
+        return cls(path, rows, **kwargs)
+    
+    def _replay(self):
+        """Rebuild row state from an existing journal"""
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    continue
+                key = record.get('key')
+                if key is None:
+                    continue
+                self._apply(key, record['event'], record.get('result'))
+    
+    def _append(self, record: Dict):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._last_sync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+    
+    def _record(self, event: str, index: int, result: Dict = None):
+        key = self.keys[index]
+        record = {'event': event, 'key': key, 'row': index, 'ts': time.time()}
+        if result is not None:
+            record['result'] = result
+        self._apply(key, event, result)
+        self._append(record)
+    
+    def _apply(self, key: str, event: str, result: Optional[Dict]):
+        self._state[key] = event
+        if result is not None:
+            self._results[key] = result
+        else:
+            # A new attempt: the previous outcome no longer applies
+            self._results.pop(key, None)
+    
+    # ========== ROW EVENTS ==========
+    
+    def started(self, index: int):
+        """Row is about to be sent to Purolator (write-ahead)"""
+        self._record('started', index)
+    
+    def created(self, index: int, result: Dict):
+        """CreateShipment returned for the row (an IN_DOUBT result is journaled as in doubt)"""
+        self._record('in_doubt' if result.get('status') == IN_DOUBT else 'created', index, result)
+    
+    def finished(self, index: int, result: Dict):
+        """Row is complete (label saved or not needed)"""
+        self._record('finished', index, result)
+    
+    def mark_in_doubt(self, indexes: List[int]):
+        """Record rows whose shipment may or may not exist"""
+        for index in indexes:
+            self._record('in_doubt', index, {
+                'reference': self.rows[index].get('reference', f'Row {index + 1}'),
+                'status': IN_DOUBT,
+                'message': IN_DOUBT_MESSAGE
+            })
+    
+    # ========== RESUME ==========
+    
+    def _status(self, index: int) -> Optional[str]:
+        result = self._results.get(self.keys[index])
+        return result.get('status') if result else None
+    
+    def completed(self) -> List[int]:
+        """Rows that need no further work"""
+        return [index for index, key in enumerate(self.keys)
+                if self._state.get(key) == 'finished' and self._status(index) == 'Success']
+    
+    def unlabeled(self) -> List[int]:
+        """Rows whose shipment was created but whose label step never finished"""
+        return [index for index, key in enumerate(self.keys)
+                if self._state.get(key) == 'created' and self._status(index) == 'Success']
+    
+    def _is_in_doubt(self, index: int) -> bool:
+        return (self._state.get(self.keys[index]) in ('started', 'in_doubt')
+                or self._status(index) == IN_DOUBT)
+    
+    def in_doubt(self) -> List[int]:
+        """Rows interrupted between 'started' and Purolator's answer, or sent without an answer"""
+        return [index for index in range(len(self.keys)) if self._is_in_doubt(index)]
+    
+    def pending(self, retry_in_doubt: bool = False) -> List[int]:
+        """
+        Rows to send to Purolator
+        
+        Args:
+            retry_in_doubt: Also re-send rows that are in doubt
+        
+        Returns:
+            Row indexes: never started, failed, and (optionally) in doubt
+        """
+        pending = []
+        for index, key in enumerate(self.keys):
+            if self._state.get(key) is None:
+                pending.append(index)
+            elif self._is_in_doubt(index):
+                if retry_in_doubt:
+                    pending.append(index)
+            elif self._status(index) != 'Success':
+                pending.append(index)
+        return pending
+    
+    def result(self, index: int) -> Optional[Dict]:
+        """Last recorded result for a row"""
+        return self._results.get(self.keys[index])
+    
+    def results(self) -> List[Dict]:
+        """Recorded results for every row that has one, in CSV order"""
+        return [self._results[key] for key in self.keys if key in self._results]
+    
+    # ========== FILE ==========
+    
+    def flush(self):
+        """Force the journal to disk"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+    
+    def close(self):
+        """Flush and close the journal"""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -3,23 +3,14 @@ Purolator Batch Shipping Application
 A comprehensive tool for batch processing shipments and printing labels
 """
 
-import os
-import json
 import csv
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
 import datetime
 from dotenv import load_dotenv
-import requests
-import xml.etree.ElementTree as ET
-import base64
-from pathlib import Path
-from purolator_utils import (
-    parse_phone_number, parse_street_address, 
-    format_postal_code, extract_error_message,
-    validate_shipment_data
-)
+from purolator_client import PurolatorClient
+from shipping_engine import ShippingEngine
 
 # Try to import address book (optional feature)
 try:
@@ -28,30 +19,17 @@ try:
 except ImportError:
     ADDRESS_BOOK_AVAILABLE = False
 
-# Try to import email utilities (optional feature)
-try:
-    from email_utils import EmailSender
-    EMAIL_AVAILABLE = True
-except ImportError:
-    EMAIL_AVAILABLE = False
-    EmailSender = None
-
 # Load environment variables
 load_dotenv()
 
-class BatchShippingApp:
+class BatchShippingApp(PurolatorClient):
     """
     Comprehensive batch shipping application for Purolator E-Ship integration
     """
     
     def __init__(self):
-        self.username = os.getenv("PUROLATOR_API_USERNAME")
-        self.password = os.getenv("PUROLATOR_API_PASSWORD")
-        self.account = os.getenv("PUROLATOR_API_ACCOUNT")
-        
-        # API endpoints - PRODUCTION
-        self.shipment_url = "https://webservices.purolator.com/EWS/V2/Shipping/ShippingService.asmx"
-        self.documents_url = "https://webservices.purolator.com/EWS/V1/ShippingDocuments/ShippingDocumentsService.asmx"
+        # Credentials, endpoints and email sender
+        super().__init__()
         
         # Initialize address book if available
         self.db = None
@@ -61,15 +39,8 @@ class BatchShippingApp:
             except Exception as e:
                 print(f"Warning: Could not initialize address book: {e}")
         
-        # Initialize email sender if available
-        self.email_sender = None
-        if EMAIL_AVAILABLE:
-            try:
-                self.email_sender = EmailSender()
-                if not self.email_sender.is_configured:
-                    print("Note: Email not configured. Set EMAIL_FROM and EMAIL_PASSWORD in .env to enable email labels")
-            except Exception as e:
-                print(f"Warning: Could not initialize email sender: {e}")
+        # Batch runs go through the headless engine; its events drive the widgets
+        self.engine = ShippingEngine(self, on_event=self._on_engine_event)
         
         # Initialize GUI
         self.setup_gui()
@@ -119,6 +90,9 @@ class BatchShippingApp:
         self.save_logs_var = tk.BooleanVar(value=True)
         ttk.Checkbutton(options_frame, text="Save detailed logs", variable=self.save_logs_var).grid(row=0, column=1, sticky='w')
         
+        self.resume_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Resume interrupted batch", variable=self.resume_var).grid(row=1, column=0, sticky='w')
+        
         # Progress and status
         status_frame = ttk.LabelFrame(batch_frame, text="Status", padding=10)
         status_frame.pack(fill='both', expand=True, padx=10, pady=5)
@@ -381,364 +355,52 @@ class BatchShippingApp:
     def _process_batch_thread(self):
         """Process batch in background thread"""
         try:
-            csv_path = self.csv_path_var.get()
-            shipments = self.load_csv_shipments(csv_path)
-            
-            self.progress_bar['maximum'] = len(shipments)
-            self.progress_bar['value'] = 0
+            self.engine.run(self.csv_path_var.get(),
+                            resume=self.resume_var.get(),
+                            save_results=self.save_logs_var.get())
+        except Exception as e:
+            self.root.after(0, lambda: messagebox.showerror("Error", f"Batch processing failed: {str(e)}"))
             
-            results = []
-            for i, shipment in enumerate(shipments):
-                if hasattr(self, 'stop_processing_flag') and self.stop_processing_flag:
-                    break
-                    
-                self.progress_var.set(f"Processing shipment {i+1}/{len(shipments)}")
+    def _on_engine_event(self, event, data):
+        """Show ShippingEngine progress; called from engine threads, so widgets are updated via after()"""
+        if event == 'loaded':
+            errors = data['errors']
+            if errors:
+                error_text = "\n".join(errors[:10])  # Show first 10 errors
+                if len(errors) > 10:
+                    error_text += f"\n... and {len(errors) - 10} more errors"
                 
-                try:
-                    result = self.create_shipment_from_data(shipment)
-                    results.append(result)
-                    
-                    # Update results display
-                    self.root.after(0, self.update_results_display, result)
-                    
-                except Exception as e:
-                    error_result = {
-                        'reference': shipment.get('reference', f'Row {i+1}'),
-                        'status': 'Error',
-                        'message': str(e)
-                    }
-                    results.append(error_result)
-                    self.root.after(0, self.update_results_display, error_result)
-                
-                self.progress_bar['value'] = i + 1
-                
-            # Save results
-            if self.save_logs_var.get():
-                self.save_batch_results(results)
+                self.root.after(0, lambda: messagebox.showwarning(
+                    "Validation Errors", 
+                    f"Found {len(errors)} validation error(s):\n\n{error_text}\n\n"
+                    "These rows will be skipped."
+                ))
                 
-            self.progress_var.set(f"Completed: {len(results)} shipments processed")
+        elif event == 'started':
+            self.root.after(0, self._show_batch_started, data['total'], data['already_done'], data['in_doubt'])
             
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Batch processing failed: {str(e)}"))
+        elif event == 'result':
+            self.root.after(0, self._show_batch_progress, data['done'], data['total'], data['result'])
             
-    def load_csv_shipments(self, csv_path):
-        """Load shipments from CSV file with validation"""
-        shipments = []
-        errors = []
-        
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
-                # Validate the row
-                is_valid, error_msg = validate_shipment_data(row)
-                if is_valid:
-                    shipments.append(row)
-                else:
-                    errors.append(f"Row {i}: {error_msg}")
-        
-        if errors:
-            error_text = "\n".join(errors[:10])  # Show first 10 errors
-            if len(errors) > 10:
-                error_text += f"\n... and {len(errors) - 10} more errors"
+        elif event == 'finished':
+            self.root.after(0, self.progress_var.set, f"Completed: {data['processed']} shipments processed")
             
-            # Show warning in main thread
-            self.root.after(0, lambda: messagebox.showwarning(
-                "Validation Errors", 
-                f"Found {len(errors)} validation error(s):\n\n{error_text}\n\n"
-                "These rows will be skipped."
-            ))
-        
-        return shipments
-        
-    def create_shipment_from_data(self, data):
-        """Create shipment from CSV data"""
-        # Build SOAP request
-        soap_body = self.build_shipment_request_from_data(data)
+    def _show_batch_started(self, total, already_done, in_doubt):
+        self.progress_bar['maximum'] = total
+        self.progress_bar['value'] = already_done
+        if already_done:
+            self.results_text.insert(tk.END, f"Resuming: {already_done} row(s) already processed"
+                                             f" ({in_doubt} in doubt)\n")
+            
+    def _show_batch_progress(self, done, total, result):
+        self.progress_var.set(f"Processed {done}/{total} shipments")
+        self.progress_bar['value'] = done
+        self.update_results_display(result)
         
-        headers = {
-            "Content-Type": "text/xml; charset=utf-8",
-            "SOAPAction": "http://purolator.com/pws/service/v2/CreateShipment"
-        }
+    def should_fetch_label(self):
+        """Labels are downloaded when auto-print is enabled"""
+        return self.auto_print_var.get()
         
-        response = requests.post(
-            self.shipment_url,
-            data=soap_body,
-            headers=headers,
-            auth=(self.username, self.password),
-            timeout=30
-        )
-        
-        # Parse response
-        shipment_pin = self.extract_shipment_pin(response.text)
-        
-        # Extract error message if failed
-        error_message = None
-        if response.status_code != 200 or not shipment_pin:
-            error_message = extract_error_message(response.text)
-        
-        result = {
-            'reference': data.get('reference', 'Unknown'),
-            'status': 'Success' if (response.status_code == 200 and shipment_pin) else 'Error',
-            'http_status': response.status_code,
-            'shipment_pin': shipment_pin,
-            'message': 'Shipment created successfully' if shipment_pin else (error_message or 'Failed to create shipment')
-        }
-        
-        # Get label if successful
-        if shipment_pin and self.auto_print_var.get():
-            self.get_and_save_label(shipment_pin, data.get('reference', 'Unknown'))
-            
-        return result
-        
-    def build_shipment_request_from_data(self, data):
-        """Build SOAP request from CSV data with proper parsing"""
-        # Parse sender phone number
-        sender_phone = parse_phone_number(data.get('sender_phone', ''))
-        
-        # Parse receiver phone number
-        receiver_phone = parse_phone_number(data.get('receiver_phone', ''))
-        
-        # Parse sender street address
-        sender_street = data.get('sender_street', 'Main St')
-        sender_street_num, sender_street_name = parse_street_address(sender_street)
-        
-        # Parse receiver street address
-        receiver_street = data.get('receiver_street', 'Elm St')
-        receiver_street_num, receiver_street_name = parse_street_address(receiver_street)
-        
-        # Format postal codes
-        sender_postal = format_postal_code(data.get('sender_postal', 'L5L5X5'))
-        receiver_postal = format_postal_code(data.get('receiver_postal', 'H4T1K5'))
-        
-        # Get default values with fallbacks
-        sender_name = data.get('sender_name', 'Test Sender') or 'Test Sender'
-        receiver_name = data.get('receiver_name', 'Test Receiver') or 'Test Receiver'
-        sender_city = data.get('sender_city', 'Toronto') or 'Toronto'
-        receiver_city = data.get('receiver_city', 'Montreal') or 'Montreal'
-        sender_province = data.get('sender_province', 'ON') or 'ON'
-        receiver_province = data.get('receiver_province', 'QC') or 'QC'
-        receiver_country = data.get('receiver_country', 'CA') or 'CA'
-        service_id = data.get('service_id', 'PurolatorExpress') or 'PurolatorExpress'
-        weight = data.get('weight', '2.5') or '2.5'
-        length = data.get('length', '30') or '30'
-        width = data.get('width', '20') or '20'
-        height = data.get('height', '10') or '10'
-        payment_type = data.get('payment_type', 'Sender') or 'Sender'
-        reference = data.get('reference', 'BatchShipment') or 'BatchShipment'
-        
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:v2="http://purolator.com/pws/datatypes/v2">
-  <soapenv:Header>
-    <v2:RequestContext>
-      <v2:Version>2.0</v2:Version>
-      <v2:Language>en</v2:Language>
-      <v2:GroupID>111</v2:GroupID>
-      <v2:RequestReference>{reference}</v2:RequestReference>
-      <v2:UserToken></v2:UserToken>
-    </v2:RequestContext>
-  </soapenv:Header>
-  <soapenv:Body>
-    <v2:CreateShipmentRequest>
-      <v2:Shipment>
-        <v2:SenderInformation>
-          <v2:Address>
-            <v2:Name>{sender_name}</v2:Name>
-            <v2:StreetNumber>{sender_street_num}</v2:StreetNumber>
-            <v2:StreetName>{sender_street_name}</v2:StreetName>
-            <v2:City>{sender_city}</v2:City>
-            <v2:Province>{sender_province}</v2:Province>
-            <v2:Country>CA</v2:Country>
-            <v2:PostalCode>{sender_postal}</v2:PostalCode>
-            <v2:PhoneNumber>
-              <v2:CountryCode>{sender_phone['CountryCode']}</v2:CountryCode>
-              <v2:AreaCode>{sender_phone['AreaCode']}</v2:AreaCode>
-              <v2:Phone>{sender_phone['Phone']}</v2:Phone>
-            </v2:PhoneNumber>
-          </v2:Address>
-        </v2:SenderInformation>
-        <v2:ReceiverInformation>
-          <v2:Address>
-            <v2:Name>{receiver_name}</v2:Name>
-            <v2:StreetNumber>{receiver_street_num}</v2:StreetNumber>
-            <v2:StreetName>{receiver_street_name}</v2:StreetName>
-            <v2:City>{receiver_city}</v2:City>
-            <v2:Province>{receiver_province}</v2:Province>
-            <v2:Country>{receiver_country}</v2:Country>
-            <v2:PostalCode>{receiver_postal}</v2:PostalCode>
-            <v2:PhoneNumber>
-              <v2:CountryCode>{receiver_phone['CountryCode']}</v2:CountryCode>
-              <v2:AreaCode>{receiver_phone['AreaCode']}</v2:AreaCode>
-              <v2:Phone>{receiver_phone['Phone']}</v2:Phone>
-            </v2:PhoneNumber>
-          </v2:Address>
-        </v2:ReceiverInformation>
-        <v2:PackageInformation>
-          <v2:ServiceID>{service_id}</v2:ServiceID>
-          <v2:TotalWeight>
-            <v2:Value>{weight}</v2:Value>
-            <v2:WeightUnit>kg</v2:WeightUnit>
-          </v2:TotalWeight>
-          <v2:Dimensions>
-            <v2:Length>{length}</v2:Length>
-            <v2:Width>{width}</v2:Width>
-            <v2:Height>{height}</v2:Height>
-            <v2:DimensionUnit>cm</v2:DimensionUnit>
-          </v2:Dimensions>
-          <v2:TotalPieces>1</v2:TotalPieces>
-        </v2:PackageInformation>
-        <v2:PaymentInformation>
-          <v2:PaymentType>{payment_type}</v2:PaymentType>
-          <v2:RegisteredAccountNumber>{self.account}</v2:RegisteredAccountNumber>
-        </v2:PaymentInformation>
-        <v2:PickupInformation>
-          <v2:PickupType>DropOff</v2:PickupType>
-        </v2:PickupInformation>
-      </v2:Shipment>
-      <v2:PrinterType>Regular</v2:PrinterType>
-    </v2:CreateShipmentRequest>
-  </soapenv:Body>
-</soapenv:Envelope>"""
-        
-    def extract_shipment_pin(self, response_text):
-        """Extract shipment PIN from response"""
-        try:
-            root = ET.fromstring(response_text)
-            # Find ShipmentPIN element
-            pin_elem = root.find('.//{http://purolator.com/pws/datatypes/v2}ShipmentPIN')
-            if pin_elem is not None:
-                # Find the Value child element
-                value_elem = pin_elem.find('{http://purolator.com/pws/datatypes/v2}Value')
-                if value_elem is not None and value_elem.text:
-                    return value_elem.text
-            return None
-        except Exception as e:
-            print(f"Error extracting PIN: {e}")
-            return None
-            
-    def get_and_save_label(self, shipment_pin, reference):
-        """Get and save shipping label - handles both base64 and URL methods"""
-        try:
-            # Get label
-            soap_body = f"""<?xml version='1.0' encoding='UTF-8'?>
-<soapenv:Envelope xmlns:soapenv='http://schemas.xmlsoap.org/soap/envelope/' xmlns:v1='http://purolator.com/pws/datatypes/v1'>
-  <soapenv:Header>
-    <v1:RequestContext>
-      <v1:Version>1.2</v1:Version>
-      <v1:Language>en</v1:Language>
-      <v1:GroupID>11</v1:GroupID>
-      <v1:RequestReference>GetLabel</v1:RequestReference>
-      <v1:UserToken></v1:UserToken>
-    </v1:RequestContext>
-  </soapenv:Header>
-  <soapenv:Body>
-    <v1:GetDocumentsRequest>
-      <v1:DocumentCriterium>
-        <v1:DocumentCriteria>
-          <v1:PIN>
-            <v1:Value>{shipment_pin}</v1:Value>
-          </v1:PIN>
-          <v1:DocumentTypes>
-            <v1:DocumentType>DomesticBillOfLading</v1:DocumentType>
-          </v1:DocumentTypes>
-        </v1:DocumentCriteria>
-      </v1:DocumentCriterium>
-    </v1:GetDocumentsRequest>
-  </soapenv:Body>
-</soapenv:Envelope>"""
-
-            headers = {
-                "Content-Type": "text/xml; charset=utf-8",
-                "SOAPAction": "http://purolator.com/pws/service/v1/GetDocuments"
-            }
-
-            response = requests.post(
-                self.documents_url,
-                data=soap_body,
-                headers=headers,
-                auth=(self.username, self.password),
-                timeout=30
-            )
-
-            if response.status_code != 200:
-                return None
-
-            # Parse and save label - handle both base64 and URL methods
-            root = ET.fromstring(response.text)
-            ns = {'v1': 'http://purolator.com/pws/datatypes/v1'}
-
-            pdf_data = None
-            label_url = None
-
-            for doc in root.findall('.//v1:Document', ns):
-                # Check for base64 PDF data (preferred method)
-                doc_data = doc.find('v1:Data', ns)
-                if doc_data is not None and doc_data.text:
-                    pdf_data = doc_data.text
-                    break
-                
-                # Check for DocumentDetails/DocumentDetail/URL (alternative method)
-                details = doc.find('v1:DocumentDetails', ns)
-                if details is not None:
-                    for detail in details.findall('v1:DocumentDetail', ns):
-                        doc_type = detail.find('v1:DocumentType', ns)
-                        url_elem = detail.find('v1:URL', ns)
-                        if (doc_type is not None and 
-                            doc_type.text == 'DomesticBillOfLading' and
-                            url_elem is not None and url_elem.text):
-                            label_url = url_elem.text
-                            break
-
-            # Save PDF from base64 data
-            if pdf_data:
-                labels_dir = Path("labels")
-                labels_dir.mkdir(exist_ok=True)
-                
-                filename = f"label_{reference}_{shipment_pin}.pdf"
-                filepath = labels_dir / filename
-                
-                with open(filepath, 'wb') as f:
-                    f.write(base64.b64decode(pdf_data))
-                
-                # Send email if configured
-                if self.email_sender and self.email_sender.is_configured:
-                    self.email_sender.send_label_email(
-                        str(filepath), 
-                        shipment_pin, 
-                        reference
-                    )
-                
-                return str(filepath)
-            
-            # Download PDF from URL
-            elif label_url:
-                labels_dir = Path("labels")
-                labels_dir.mkdir(exist_ok=True)
-                
-                filename = f"label_{reference}_{shipment_pin}.pdf"
-                filepath = labels_dir / filename
-                
-                # Download from URL
-                label_response = requests.get(label_url, timeout=30)
-                if label_response.status_code == 200:
-                    with open(filepath, 'wb') as f:
-                        f.write(label_response.content)
-                    
-                    # Send email if configured
-                    if self.email_sender and self.email_sender.is_configured:
-                        self.email_sender.send_label_email(
-                            str(filepath), 
-                            shipment_pin, 
-                            reference
-                        )
-                    
-                    return str(filepath)
-
-            return None
-
-        except Exception as e:
-            print(f"Error getting label: {e}")
-            return None
-            
     def update_results_display(self, result):
         """Update results display with new result"""
         timestamp = datetime.datetime.now().strftime('%H:%M:%S')
@@ -752,19 +414,9 @@ class BatchShippingApp:
         self.results_text.insert(tk.END, display_text)
         self.results_text.see(tk.END)
         
-    def save_batch_results(self, results):
-        """Save batch processing results"""
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"batch_results_{timestamp}.csv"
-        
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['reference', 'status', 'http_status', 'shipment_pin', 'message'])
-            writer.writeheader()
-            writer.writerows(results)
-            
     def stop_processing(self):
         """Stop batch processing"""
-        self.stop_processing_flag = True
+        self.engine.stop()
         
     def create_single_shipment(self):
         """Create single shipment from form data"""
@@ -833,15 +485,13 @@ class BatchShippingApp:
         
     def test_connection(self):
         """Test API connection"""
-        try:
-            # Simple connection test
-            response = requests.get(self.shipment_url, timeout=10)
-            if response.status_code == 200:
-                messagebox.showinfo("Success", "API connection successful!")
-            else:
-                messagebox.showwarning("Warning", f"API responded with status: {response.status_code}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Connection failed: {str(e)}")
+        is_ok, message = super().test_connection()
+        if is_ok:
+            messagebox.showinfo("Success", message)
+        elif message.startswith("API responded"):
+            messagebox.showwarning("Warning", message)
+        else:
+            messagebox.showerror("Error", message)
             
     def save_settings(self):
         """Save application settings"""
@@ -0,0 +1,178 @@
+"""
+Address Normalization Benchmark
+Compares memoized, precompiled address parsing (normalization.py) against the
+previous per-call re.sub / re.match helpers, over batches built from the
+sample CSVs
+
+Every batch row ships from the same sender (the first sample location) to
+one of the sample locations, like a CSV batch out of one warehouse.
+
+Usage:
+    python benchmark_normalization.py [--rows 10000] [--repeat 5]
+"""
+
+import re
+import sys
+import csv
+import timeit
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import normalization
+from normalization import normalize_address, normalize_phone, normalize_postal, normalize_street
+
+SAMPLE_LOCATIONS = Path(__file__).parent / 'sample_locations.csv'
+
+
+# ========== LEGACY HELPERS ==========
+
+def legacy_parse_phone_number(phone_str):
+    """purolator_utils.parse_phone_number before normalization.py"""
+    if not phone_str:
+        return {"CountryCode": "1", "AreaCode": "416", "Phone": "1234567"}
+    digits = re.sub(r'\D', '', phone_str)
+    if len(digits) == 10:
+        return {"CountryCode": "1", "AreaCode": digits[0:3], "Phone": digits[3:]}
+    elif len(digits) == 11 and digits[0] == '1':
+        return {"CountryCode": "1", "AreaCode": digits[1:4], "Phone": digits[4:]}
+    elif len(digits) == 7:
+        return {"CountryCode": "1", "AreaCode": "416", "Phone": digits}
+    return {"CountryCode": "1", "AreaCode": "416", "Phone": "1234567"}
+
+
+def legacy_parse_street_address(street_str):
+    """purolator_utils.parse_street_address before normalization.py"""
+    if not street_str:
+        return ("123", "Main St")
+    street_str = street_str.strip()
+    match = re.match(r'^(\d+[A-Za-z]?)(?:\s*[-–]\s*\d+[A-Za-z]?)?\s+(.+)$', street_str)
+    if match:
+        return (match.group(1), match.group(2).strip())
+    match = re.match(r'^(\d+)\s*(.+)$', street_str)
+    if match:
+        return (match.group(1), match.group(2).strip())
+    parts = street_str.split(None, 1)
+    if len(parts) == 2:
+        return (parts[0], parts[1])
+    return ("123", street_str)
+
+
+def legacy_format_postal_code(postal_code):
+    """purolator_utils.format_postal_code before normalization.py"""
+    if not postal_code:
+        return ""
+    formatted = postal_code.replace(" ", "").upper()
+    if len(formatted) == 6 and re.match(r'^[A-Z]\d[A-Z]\d[A-Z]\d$', formatted):
+        return f"{formatted[0:3]} {formatted[3:6]}"
+    return formatted
+
+
+# ========== PARSERS UNDER TEST ==========
+
+def legacy_parse(row: Dict) -> tuple:
+    """Sender and receiver parsed the old way, as shipment_fields used to"""
+    results = []
+    for side in ('sender', 'receiver'):
+        phone = legacy_parse_phone_number(row[f'{side}_phone'])
+        street_number, street_name = legacy_parse_street_address(row[f'{side}_street'])
+        results.append((street_number, street_name, legacy_format_postal_code(row[f'{side}_postal']),
+                        phone['CountryCode'], phone['AreaCode'], phone['Phone']))
+    return tuple(results)
+
+
+def compiled_parse(row: Dict) -> tuple:
+    """Precompiled patterns only (caches bypassed)"""
+    results = []
+    for side in ('sender', 'receiver'):
+        phone = normalize_phone.__wrapped__(row[f'{side}_phone'])
+        street_number, street_name = normalize_street.__wrapped__(row[f'{side}_street'])
+        results.append((street_number, street_name, normalize_postal.__wrapped__(row[f'{side}_postal']),
+                        *phone))
+    return tuple(results)
+
+
+def memoized_parse(row: Dict) -> tuple:
+    """normalize_address, as shipment_fields uses it now"""
+    results = []
+    for side in ('sender', 'receiver'):
+        address = normalize_address(row[f'{side}_street'], row[f'{side}_city'], row[f'{side}_province'],
+                                    row[f'{side}_postal'], row[f'{side}_country'], row[f'{side}_phone'])
+        results.append((address.street_number, address.street_name, address.postal_code, *address.phone))
+    return tuple(results)
+
+
+# ========== BENCHMARK ==========
+
+def load_locations(path: Path = SAMPLE_LOCATIONS) -> List[Dict]:
+    """Rows of the sample locations CSV"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def make_rows(locations: List[Dict], count: int) -> List[Dict]:
+    """Batch rows from one sender to the sample locations in turn"""
+    def side(prefix: str, location: Dict) -> Dict:
+        return {
+            f'{prefix}_street': location['address_street'],
+            f'{prefix}_city': location['address_city'],
+            f'{prefix}_province': location['address_province'],
+            f'{prefix}_postal': location['address_postal'],
+            f'{prefix}_country': location['address_country'],
+            f'{prefix}_phone': location['phone_number'],
+        }
+    
+    sender = side('sender', locations[0])
+    return [dict(sender, **side('receiver', locations[i % len(locations)])) for i in range(count)]
+
+
+def time_parser(name: str, parse: Callable, rows: List[Dict], repeat: int,
+                baseline: float = None, setup: Callable = None) -> float:
+    """Parse every row (best of repeat runs) and print the per-row cost"""
+    def run():
+        if setup:
+            setup()
+        for row in rows:
+            parse(row)
+    
+    elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+    per_row_us = elapsed / len(rows) * 1e6
+    speedup = f"  ({baseline / elapsed:.2f}x)" if baseline else ""
+    print(f"  {name:<34} {elapsed * 1000:8.1f} ms  {per_row_us:6.2f} us/row{speedup}")
+    return elapsed
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description='Address normalization benchmark')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='Batch rows to parse (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timed runs, best is reported (default: 5)')
+    args = parser.parse_args()
+    
+    locations = load_locations()
+    rows = make_rows(locations, args.rows)
+    
+    # The new parsers must agree with the old helpers
+    for row in rows[:len(locations)]:
+        if not (legacy_parse(row) == compiled_parse(row) == memoized_parse(row)):
+            print(f"FAIL: Normalized output differs for {row['receiver_street']!r}")
+            sys.exit(1)
+    
+    print(f"Sender + receiver parsing for {args.rows} rows over "
+          f"{len(locations)} sample locations (best of {args.repeat})")
+    baseline = time_parser('legacy re.sub / re.match', legacy_parse, rows, args.repeat)
+    time_parser('precompiled patterns', compiled_parse, rows, args.repeat, baseline)
+    # Caches start empty on every run, as for a fresh batch
+    time_parser('normalize_address (memoized)', memoized_parse, rows, args.repeat, baseline,
+                setup=normalization.clear_caches)
+    
+    info = normalize_address.cache_info()
+    print(f"  normalize_address cache: {info.currsize} addresses, {info.hits} hits, {info.misses} misses")
+
+
+if __name__ == '__main__':
+    main()
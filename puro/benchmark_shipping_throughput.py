@@ -0,0 +1,137 @@
+"""
+Shipping Throughput Benchmark
+Creates shipments and downloads labels against fake_purolator_server.py and
+compares the sequential client, the threaded pipeline and the asyncio client
+
+Usage:
+    python benchmark_shipping_throughput.py [--shipments 200] [--latency-ms 100] [--max-in-flight 50]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Dict
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fake_purolator_server import start_fake_server
+from purolator_client import PurolatorClient
+from shipment_pipeline import ShipmentPipeline
+from async_purolator_client import AsyncPurolatorClient, AIOHTTP_AVAILABLE
+
+
+def make_shipments(count: int) -> List[Dict]:
+    """Build benchmark shipments"""
+    return [
+        {
+            'reference': f'BENCH{i:05d}',
+            'sender_name': 'Bench Warehouse',
+            'sender_street': '123 Main St',
+            'sender_city': 'Toronto',
+            'sender_province': 'ON',
+            'sender_postal': 'M5J2R8',
+            'sender_phone': '416-555-1234',
+            'receiver_name': f'Customer {i}',
+            'receiver_street': '456 Elm St',
+            'receiver_city': 'Montreal',
+            'receiver_province': 'QC',
+            'receiver_postal': 'H4T1K5',
+            'receiver_phone': '514-555-9876',
+            'weight': '2.5'
+        }
+        for i in range(count)
+    ]
+
+
+def make_client(base_url: str) -> PurolatorClient:
+    """PurolatorClient pointed at the fake server, with email disabled"""
+    client = PurolatorClient()
+    client.shipment_url = f"{base_url}/Shipping"
+    client.documents_url = f"{base_url}/ShippingDocuments"
+    client.email_sender = None
+    return client
+
+
+def run_sequential(base_url: str, shipments: List[Dict], max_in_flight: int) -> List[Dict]:
+    """One shipment at a time, label fetched inline"""
+    client = make_client(base_url)
+    return [client.create_shipment_from_data(shipment) for shipment in shipments]
+
+
+def run_pipeline(base_url: str, shipments: List[Dict], max_in_flight: int) -> List[Dict]:
+    """Threaded pipeline with batched label fetches"""
+    client = make_client(base_url)
+    return ShipmentPipeline(client, create_workers=max_in_flight).run(shipments)
+
+
+def run_async(base_url: str, shipments: List[Dict], max_in_flight: int) -> List[Dict]:
+    """asyncio client from a single thread"""
+    async def run():
+        async with AsyncPurolatorClient(make_client(base_url), max_in_flight) as client:
+            return await client.create_shipments(shipments)
+    return asyncio.run(run())
+
+
+def measure(name: str, runner: Callable, base_url: str, shipments: List[Dict],
+            max_in_flight: int):
+    """Time one runner and print shipments per second"""
+    start = time.perf_counter()
+    results = runner(base_url, shipments, max_in_flight)
+    elapsed = time.perf_counter() - start
+    
+    succeeded = sum(1 for r in results if r.get('status') == 'Success')
+    labels = len(list(Path('labels').glob('*.pdf')))
+    print(f"  {name:<12} {elapsed:7.2f} s  {len(shipments) / elapsed:8.1f} shipments/s  "
+          f"({succeeded}/{len(shipments)} created, {labels} labels)")
+    
+    for label in Path('labels').glob('*.pdf'):
+        label.unlink()
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description='Shipping throughput benchmark (offline)')
+    parser.add_argument('--shipments', type=int, default=200, help='Shipments per run (default: 200)')
+    parser.add_argument('--latency-ms', type=float, default=100.0,
+                        help='Fake server latency per SOAP call (default: 100)')
+    parser.add_argument('--max-in-flight', type=int, default=50,
+                        help='Concurrent shipments for pipeline/async runs (default: 50)')
+    parser.add_argument('--skip-sequential', action='store_true',
+                        help='Skip the sequential baseline (slow at high latency)')
+    args = parser.parse_args()
+    
+    server, base_url = start_fake_server(latency_ms=args.latency_ms)
+    shipments = make_shipments(args.shipments)
+    
+    runners = []
+    if not args.skip_sequential:
+        runners.append(('sequential', run_sequential))
+    runners.append(('pipeline', run_pipeline))
+    if AIOHTTP_AVAILABLE:
+        runners.append(('async', run_async))
+    else:
+        print("Note: aiohttp not installed, skipping the async client")
+    
+    print(f"{args.shipments} shipments, {args.latency_ms:.0f} ms latency, "
+          f"max in flight {args.max_in_flight}")
+    
+    # Labels are written to ./labels; keep them out of the working tree
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name, runner in runners:
+                measure(name, runner, base_url, shipments, args.max_in_flight)
+        finally:
+            os.chdir(cwd)
+    
+    print(f"  Fake server handled {server.requests} SOAP requests")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+SOAP Template Benchmark
+Compares the precompiled, escaping envelope templates (soap_templates.py)
+against the previous f-string CreateShipment builder
+
+The baseline is the builder as it was before soap_templates and
+normalization.py: an f-string filled by the per-call re.sub / re.match
+helpers. The same f-string with today's memoized parsing is timed too, to
+separate the cost of the template from the cost of parsing. Address caches
+are cleared before every timed run, as for a fresh batch.
+
+Usage:
+    python benchmark_soap_templates.py [--shipments 10000] [--repeat 5]
+"""
+
+import sys
+import timeit
+import argparse
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import normalization
+import purolator_utils
+from benchmark_normalization import (
+    legacy_parse_phone_number, legacy_parse_street_address, legacy_format_postal_code
+)
+from purolator_client import PurolatorClient
+from soap_templates import SHIPMENT_REQUEST, SoapTemplate, _needs_escaping, xml_escape
+
+ACCOUNT = '9999999999'
+
+
+def legacy_build_shipment_request(account, data,
+                                  parse_phone_number=legacy_parse_phone_number,
+                                  parse_street_address=legacy_parse_street_address,
+                                  format_postal_code=legacy_format_postal_code):
+    """The f-string builder PurolatorClient used before soap_templates (no escaping)"""
+    # Parse sender phone number
+    sender_phone = parse_phone_number(data.get('sender_phone', ''))
+    
+    # Parse receiver phone number
+    receiver_phone = parse_phone_number(data.get('receiver_phone', ''))
+    
+    # Parse sender street address
+    sender_street = data.get('sender_street', 'Main St')
+    sender_street_num, sender_street_name = parse_street_address(sender_street)
+    
+    # Parse receiver street address
+    receiver_street = data.get('receiver_street', 'Elm St')
+    receiver_street_num, receiver_street_name = parse_street_address(receiver_street)
+    
+    # Format postal codes
+    sender_postal = format_postal_code(data.get('sender_postal', 'L5L5X5'))
+    receiver_postal = format_postal_code(data.get('receiver_postal', 'H4T1K5'))
+    
+    # Get default values with fallbacks
+    sender_name = data.get('sender_name', 'Test Sender') or 'Test Sender'
+    receiver_name = data.get('receiver_name', 'Test Receiver') or 'Test Receiver'
+    sender_city = data.get('sender_city', 'Toronto') or 'Toronto'
+    receiver_city = data.get('receiver_city', 'Montreal') or 'Montreal'
+    sender_province = data.get('sender_province', 'ON') or 'ON'
+    receiver_province = data.get('receiver_province', 'QC') or 'QC'
+    receiver_country = data.get('receiver_country', 'CA') or 'CA'
+    service_id = data.get('service_id', 'PurolatorExpress') or 'PurolatorExpress'
+    weight = data.get('weight', '2.5') or '2.5'
+    length = data.get('length', '30') or '30'
+    width = data.get('width', '20') or '20'
+    height = data.get('height', '10') or '10'
+    payment_type = data.get('payment_type', 'Sender') or 'Sender'
+    reference = data.get('reference', 'BatchShipment') or 'BatchShipment'
+    
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:v2="http://purolator.com/pws/datatypes/v2">
+  <soapenv:Header>
+    <v2:RequestContext>
+      <v2:Version>2.0</v2:Version>
+      <v2:Language>en</v2:Language>
+      <v2:GroupID>111</v2:GroupID>
+      <v2:RequestReference>{reference}</v2:RequestReference>
+      <v2:UserToken></v2:UserToken>
+    </v2:RequestContext>
+  </soapenv:Header>
+  <soapenv:Body>
+    <v2:CreateShipmentRequest>
+      <v2:Shipment>
+        <v2:SenderInformation>
+          <v2:Address>
+            <v2:Name>{sender_name}</v2:Name>
+            <v2:StreetNumber>{sender_street_num}</v2:StreetNumber>
+            <v2:StreetName>{sender_street_name}</v2:StreetName>
+            <v2:City>{sender_city}</v2:City>
+            <v2:Province>{sender_province}</v2:Province>
+            <v2:Country>CA</v2:Country>
+            <v2:PostalCode>{sender_postal}</v2:PostalCode>
+            <v2:PhoneNumber>
+              <v2:CountryCode>{sender_phone['CountryCode']}</v2:CountryCode>
+              <v2:AreaCode>{sender_phone['AreaCode']}</v2:AreaCode>
+              <v2:Phone>{sender_phone['Phone']}</v2:Phone>
+            </v2:PhoneNumber>
+          </v2:Address>
+        </v2:SenderInformation>
+        <v2:ReceiverInformation>
+          <v2:Address>
+            <v2:Name>{receiver_name}</v2:Name>
+            <v2:StreetNumber>{receiver_street_num}</v2:StreetNumber>
+            <v2:StreetName>{receiver_street_name}</v2:StreetName>
+            <v2:City>{receiver_city}</v2:City>
+            <v2:Province>{receiver_province}</v2:Province>
+            <v2:Country>{receiver_country}</v2:Country>
+            <v2:PostalCode>{receiver_postal}</v2:PostalCode>
+            <v2:PhoneNumber>
+              <v2:CountryCode>{receiver_phone['CountryCode']}</v2:CountryCode>
+              <v2:AreaCode>{receiver_phone['AreaCode']}</v2:AreaCode>
+              <v2:Phone>{receiver_phone['Phone']}</v2:Phone>
+            </v2:PhoneNumber>
+          </v2:Address>
+        </v2:ReceiverInformation>
+        <v2:PackageInformation>
+          <v2:ServiceID>{service_id}</v2:ServiceID>
+          <v2:TotalWeight>
+            <v2:Value>{weight}</v2:Value>
+            <v2:WeightUnit>kg</v2:WeightUnit>
+          </v2:TotalWeight>
+          <v2:Dimensions>
+            <v2:Length>{length}</v2:Length>
+            <v2:Width>{width}</v2:Width>
+            <v2:Height>{height}</v2:Height>
+            <v2:DimensionUnit>cm</v2:DimensionUnit>
+          </v2:Dimensions>
+          <v2:TotalPieces>1</v2:TotalPieces>
+        </v2:PackageInformation>
+        <v2:PaymentInformation>
+          <v2:PaymentType>{payment_type}</v2:PaymentType>
+          <v2:RegisteredAccountNumber>{account}</v2:RegisteredAccountNumber>
+        </v2:PaymentInformation>
+        <v2:PickupInformation>
+          <v2:PickupType>DropOff</v2:PickupType>
+        </v2:PickupInformation>
+      </v2:Shipment>
+      <v2:PrinterType>Regular</v2:PrinterType>
+    </v2:CreateShipmentRequest>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+def memoized_build_shipment_request(account, data):
+    """The same f-string builder on today's memoized purolator_utils parsers"""
+    return legacy_build_shipment_request(
+        account, data,
+        purolator_utils.parse_phone_number,
+        purolator_utils.parse_street_address,
+        purolator_utils.format_postal_code
+    )
+
+
+class ByteSegmentTemplate:
+    """SoapTemplate variant with static segments pre-encoded to bytes, joined with b''.join"""
+    
+    def __init__(self, template: SoapTemplate):
+        self._values = template._values
+        self._parts = [b''] * (2 * len(template.fields) + 1)
+        self._parts[0::2] = [segment.encode('utf-8') for segment in template.segments]
+    
+    def render(self, values: Dict) -> bytes:
+        fields = self._values(values)
+        if _needs_escaping(''.join(fields)):
+            fields = [xml_escape(value) for value in fields]
+        parts = self._parts.copy()
+        # Every field needs its own encode, where str segments encode once
+        parts[1::2] = [field.encode('utf-8') for field in fields]
+        return b''.join(parts)
+
+
+def make_shipments(count: int) -> List[Dict]:
+    """Build benchmark shipments with varied receivers"""
+    return [
+        {
+            'reference': f'ORD-{i:06d}',
+            'sender_name': 'Main Warehouse',
+            'sender_street': '123 Main St',
+            'sender_city': 'Toronto',
+            'sender_province': 'ON',
+            'sender_postal': 'M5J 2R8',
+            'sender_phone': '(416) 555-1234',
+            'receiver_name': f'Customer {i} Inc',
+            'receiver_street': f'{100 + i % 900} Rue Principale',
+            'receiver_city': 'Montreal',
+            'receiver_province': 'QC',
+            'receiver_postal': 'h4t1k5',
+            'receiver_phone': '1-514-555-9876',
+            'weight': str(1 + i % 20),
+            'service_id': 'PurolatorExpress'
+        }
+        for i in range(count)
+    ]
+
+
+def time_builder(name: str, build: Callable, items: List, repeat: int,
+                 baseline: float = None) -> float:
+    """Build every envelope (best of repeat runs) and print the per-shipment cost"""
+    def run():
+        # Every run parses addresses from scratch, as for a fresh batch
+        normalization.clear_caches()
+        for item in items:
+            build(item)
+    
+    elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+    
+    per_shipment_us = elapsed / len(items) * 1e6
+    speedup = f"  ({baseline / elapsed:.2f}x)" if baseline else ""
+    print(f"  {name:<34} {elapsed * 1000:8.1f} ms  {per_shipment_us:6.1f} us/shipment{speedup}")
+    return elapsed
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description='SOAP envelope builder benchmark')
+    parser.add_argument('--shipments', type=int, default=10000,
+                        help='Envelopes to build (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timed runs, best is reported (default: 5)')
+    args = parser.parse_args()
+    
+    client = PurolatorClient.__new__(PurolatorClient)
+    client.account = ACCOUNT
+    shipments = make_shipments(args.shipments)
+    fields = [client.shipment_fields(shipment) for shipment in shipments]
+    
+    byte_template = ByteSegmentTemplate(SHIPMENT_REQUEST)
+    
+    # Every builder must produce the same envelope as the old one
+    for shipment, values in zip(shipments[:100], fields):
+        legacy = legacy_build_shipment_request(ACCOUNT, shipment).encode('utf-8')
+        if not (legacy == memoized_build_shipment_request(ACCOUNT, shipment).encode('utf-8')
+                == client.build_shipment_request_from_data(shipment) == byte_template.render(values)):
+            print("FAIL: Envelope differs from the legacy builder")
+            sys.exit(1)
+    
+    print(f"CreateShipment envelopes for {args.shipments} shipments (best of {args.repeat})")
+    print("Full build (field parsing + envelope):")
+    baseline = time_builder('legacy f-string (pre-series)',
+                            lambda s: legacy_build_shipment_request(ACCOUNT, s).encode('utf-8'),
+                            shipments, args.repeat)
+    memoized = time_builder('f-string, memoized parsing',
+                            lambda s: memoized_build_shipment_request(ACCOUNT, s).encode('utf-8'),
+                            shipments, args.repeat, baseline)
+    template = time_builder('precompiled template (escaped)', client.build_shipment_request_from_data,
+                            shipments, args.repeat, baseline)
+    print(f"  Template vs f-string on the same parsing: {memoized / template:.2f}x "
+          f"({(template - memoized) / len(shipments) * 1e6:+.1f} us/shipment for the field "
+          f"dict and escaping)")
+    
+    print("Breakdown of the template build:")
+    time_builder('shipment_fields (parsing)', client.shipment_fields, shipments, args.repeat)
+    render = time_builder('render, str segments + one encode', SHIPMENT_REQUEST.render, fields, args.repeat)
+    time_builder('render, byte segments', byte_template.render, fields, args.repeat, render)
+    
+    # Special characters: the old builder produced XML the service rejects
+    tricky = dict(shipments[0], receiver_name='A&B Ltd <Receiving>')
+    print("Receiver name 'A&B Ltd <Receiving>':")
+    for name, body in [
+        ('legacy', legacy_build_shipment_request(ACCOUNT, tricky).encode('utf-8')),
+        ('template', client.build_shipment_request_from_data(tricky)),
+    ]:
+        try:
+            ET.fromstring(body)
+            print(f"  {name:<10} well-formed")
+        except ET.ParseError as e:
+            print(f"  {name:<10} INVALID XML ({e})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Startup Benchmark for the Shipping API Server
+Measures the import cost of the lookup path with `python -X importtime` and
+fails if it goes over budget or pulls in the GUI / SOAP stack
+
+Usage:
+    python benchmark_startup.py [--budget-ms 150] [--runs 5]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+PURO_DIR = Path(__file__).parent
+
+# Modules that a read-only action must never import
+FORBIDDEN_MODULES = [
+    'tkinter',
+    'requests',
+    'urllib3',
+    'smtplib',
+    'xml.etree.ElementTree',
+    'batch_shipping_app',
+    'purolator_client',
+    'email_utils',
+    'asyncio',
+    'aiohttp',
+]
+
+# Import the server and run one lookup, exactly as a one-shot Node.js call would
+LOOKUP_SCRIPT = (
+    "import shipping_api_server as s; "
+    "s.handle_command({'action': 'search_customers', 'search_term': 'bench'})"
+)
+
+
+def measure_lookup_imports(db_path: str) -> Tuple[float, Dict[str, int]]:
+    """
+    Run the lookup path once under -X importtime
+    
+    Args:
+        db_path: Address book database to use for the lookup
+    
+    Returns:
+        Tuple of (total import time in ms, {module: self time in us})
+    """
+    env = dict(os.environ, ADDRESS_BOOK_DB=db_path)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', LOOKUP_SCRIPT],
+        cwd=str(PURO_DIR),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Lookup path failed:\n{proc.stderr}")
+    
+    # Lines look like: "import time:       412 |       1034 |   address_book_db"
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    
+    total_ms = sum(modules.values()) / 1000
+    return total_ms, modules
+
+
+def main():
+    """Run the benchmark and exit non-zero if the lookup path is over budget"""
+    parser = argparse.ArgumentParser(description='Lookup-path startup benchmark')
+    parser.add_argument('--budget-ms', type=float, default=150.0,
+                        help='Maximum median import time for the lookup path (default: 150)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs (default: 5)')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'benchmark.db')
+        
+        timings: List[float] = []
+        modules: Dict[str, int] = {}
+        for _ in range(args.runs):
+            total_ms, modules = measure_lookup_imports(db_path)
+            timings.append(total_ms)
+    
+    timings.sort()
+    median_ms = timings[len(timings) // 2]
+    
+    print("Lookup path import time")
+    print(f"  Runs:   {', '.join(f'{t:.1f}' for t in timings)} ms")
+    print(f"  Median: {median_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"  Modules imported: {len(modules)}")
+    print()
+    print("Slowest modules (self time):")
+    for name, self_us in sorted(modules.items(), key=lambda m: m[1], reverse=True)[:10]:
+        print(f"  {self_us / 1000:7.2f} ms  {name}")
+    print()
+    
+    failures = []
+    leaked = [m for m in FORBIDDEN_MODULES if m in modules]
+    if leaked:
+        failures.append(f"Lookup path imported: {', '.join(leaked)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"Median import time {median_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+    
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    
+    print("PASS: Lookup path is within budget and does not load the shipping stack")
+
+
+if __name__ == '__main__':
+    main()
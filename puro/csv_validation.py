@@ -0,0 +1,247 @@
+"""
+CSV Shipment Validation
+Column-at-a-time validation of bulk shipment CSVs with a per-row error report
+
+The file is read once into columns and each rule runs over a whole column.
+Rules are evaluated once per distinct value (ERP exports repeat the same
+weights, dimensions and postal codes on thousands of rows), and row dicts
+are only built for the rows that pass. The rules themselves are the ones
+validate_shipment_data applies, so a row's first error here is the error
+validate_shipment_data reports for it.
+
+Usage:
+    python csv_validation.py shipments.csv [--report errors.csv]
+"""
+
+import gc
+import sys
+import csv
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from purolator_utils import (
+    REQUIRED_SHIPMENT_FIELDS, DIMENSION_FIELDS,
+    postal_code_error, weight_error, dimension_error
+)
+
+# Spreadsheet row number of the first data row (the header is row 1)
+FIRST_DATA_ROW = 2
+
+
+class ValidationReport:
+    """Per-row validation errors for a batch"""
+    
+    def __init__(self, row_count: int, errors: Dict[int, List[str]],
+                 row_numbers: Sequence[int] = None):
+        """
+        Args:
+            row_count: Rows validated
+            errors: Error messages by row index (0-based, rule order)
+            row_numbers: Spreadsheet row number of each row
+                (default: consecutive from FIRST_DATA_ROW)
+        """
+        self.row_count = row_count
+        self.errors = errors
+        if row_numbers is None:
+            row_numbers = range(FIRST_DATA_ROW, FIRST_DATA_ROW + row_count)
+        self.row_numbers = row_numbers
+    
+    @property
+    def valid_indexes(self) -> List[int]:
+        """Indexes of the rows that passed every rule"""
+        return [index for index in range(self.row_count) if index not in self.errors]
+    
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+    
+    def first_error(self, index: int) -> Optional[str]:
+        """The error validate_shipment_data would report for a row, or None"""
+        messages = self.errors.get(index)
+        return messages[0] if messages else None
+    
+    def messages(self) -> List[str]:
+        """One "Row N: ..." line per invalid row, listing every error it has"""
+        return [
+            f"Row {self.row_numbers[index]}: {'; '.join(self.errors[index])}"
+            for index in sorted(self.errors)
+        ]
+    
+    def write_csv(self, path: Union[str, Path], references: Sequence[str] = None):
+        """
+        Write the error report as CSV (row, reference, errors)
+        
+        Args:
+            path: Report file
+            references: Reference column of the batch, to identify rows
+        """
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'reference', 'errors'])
+            for index in sorted(self.errors):
+                reference = references[index] if references else ''
+                writer.writerow([self.row_numbers[index], reference or '', '; '.join(self.errors[index])])
+
+
+def _column(columns: Dict[str, Sequence], name: str, count: int, default=None) -> Sequence:
+    """A column, or default for every row when the CSV does not have it"""
+    column = columns.get(name)
+    return column if column is not None else [default] * count
+
+
+def _record(errors: Dict[int, List[str]], indexes: List[int], message: str):
+    for index in indexes:
+        errors.setdefault(index, []).append(message)
+
+
+def _apply(rule: Callable, values: Sequence, errors: Dict[int, List[str]]):
+    """Run rule once per distinct value; only rows holding a failing value are visited"""
+    failures = {}
+    for value in set(values):
+        error = rule(value)
+        if error:
+            failures[value] = error
+    if not failures:
+        return
+    
+    for index, value in enumerate(values):
+        error = failures.get(value)
+        if error:
+            errors.setdefault(index, []).append(error)
+
+
+def validate_columns(columns: Dict[str, Sequence], count: int,
+                     row_numbers: Sequence[int] = None) -> ValidationReport:
+    """
+    Validate a batch held as columns
+    
+    Args:
+        columns: Values by CSV field name, each with one entry per row
+        count: Number of rows
+        row_numbers: Spreadsheet row number of each row, for the report
+    
+    Returns:
+        ValidationReport
+    """
+    errors: Dict[int, List[str]] = {}
+    
+    with _gc_paused():
+        # Required fields, in validate_shipment_data's order
+        for field in REQUIRED_SHIPMENT_FIELDS:
+            column = _column(columns, field, count)
+            if not all(column):
+                _record(errors, [index for index, value in enumerate(column) if not value],
+                        f"Missing required field: {field}")
+        
+        # Unlike validate_shipment_data, later rules still run on rows that
+        # already failed, so the report lists every problem a row has
+        postal = _column(columns, 'receiver_postal', count, '')
+        country = _column(columns, 'receiver_country', count, 'CA')
+        _apply(lambda pair: postal_code_error(*pair), list(zip(postal, country)), errors)
+        
+        _apply(weight_error, _column(columns, 'weight', count, 0), errors)
+        for dim in DIMENSION_FIELDS:
+            _apply(lambda value, dim=dim: dimension_error(dim, value), _column(columns, dim, count, 0), errors)
+    
+    return ValidationReport(count, errors, row_numbers)
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Suspend the cyclic garbage collector while a file's rows are materialized
+    
+    Rows, columns and error lists hold only strings, so they cannot form
+    reference cycles, but every allocation counts towards a collection that
+    rescans all the rows built so far.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_columns(csv_path: Union[str, Path]) -> Tuple[List[str], List[List], Dict[str, Sequence], Sequence[int]]:
+    """
+    Read a CSV into rows and columns
+    
+    Args:
+        csv_path: CSV file with a header row
+    
+    Returns:
+        Tuple of (field names, rows as lists, columns by field name, spreadsheet
+        row number of each row); blank lines are skipped and short rows padded
+        with None, like csv.DictReader
+    """
+    with _gc_paused():
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            fieldnames = next(reader, [])
+            rows = list(reader)
+        
+        width = len(fieldnames)
+        if rows and min(map(len, rows)) < width:
+            # Blank lines are skipped and short rows padded, as csv.DictReader does;
+            # the rows after a blank line keep their own row numbers
+            row_numbers = [number for number, row in enumerate(rows, FIRST_DATA_ROW) if row]
+            rows = [row + [None] * (width - len(row)) for row in rows if row]
+        else:
+            row_numbers = range(FIRST_DATA_ROW, FIRST_DATA_ROW + len(rows))
+        
+        if rows:
+            columns = dict(zip(fieldnames, zip(*rows)))
+        else:
+            columns = {name: () for name in fieldnames}
+    return fieldnames, rows, columns, row_numbers
+
+
+def load_shipments_csv(csv_path: Union[str, Path]) -> Tuple[List[Dict], ValidationReport]:
+    """
+    Load and validate a shipment CSV
+    
+    Args:
+        csv_path: CSV file in the batch template format
+    
+    Returns:
+        Tuple of (valid rows as dicts, in file order; ValidationReport for every row)
+    """
+    fieldnames, rows, columns, row_numbers = read_columns(csv_path)
+    report = validate_columns(columns, len(rows), row_numbers)
+    with _gc_paused():
+        if report.is_valid:
+            shipments = [dict(zip(fieldnames, row)) for row in rows]
+        else:
+            shipments = [dict(zip(fieldnames, rows[index])) for index in report.valid_indexes]
+    return shipments, report
+
+
+def main():
+    """Validate a shipment CSV from the command line"""
+    parser = argparse.ArgumentParser(description='Validate a shipment CSV')
+    parser.add_argument('csv', help='Shipment CSV file')
+    parser.add_argument('--report', help='Write the per-row error report to this CSV')
+    args = parser.parse_args()
+    
+    fieldnames, rows, columns, row_numbers = read_columns(args.csv)
+    report = validate_columns(columns, len(rows), row_numbers)
+    
+    print(f"{len(rows)} row(s): {len(report.valid_indexes)} valid, {len(report.errors)} with errors")
+    for line in report.messages()[:20]:
+        print(f"  {line}")
+    if len(report.errors) > 20:
+        print(f"  ... and {len(report.errors) - 20} more")
+    
+    if args.report:
+        report.write_csv(args.report, columns.get('reference'))
+        print(f"Report written to {args.report}")
+    
+    sys.exit(0 if report.is_valid else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,159 @@
 """
 Email utility for sending shipping labels
+
+SMTP sessions are pooled and reused (reconnecting when the server drops
+them), and label emails can be queued: a background thread coalesces queued
+labels into one digest email per recipient, sent when EMAIL_DIGEST_MAX
+labels have accumulated or EMAIL_DIGEST_WINDOW seconds after the first one,
+retrying transient SMTP failures with exponential backoff.
 """
 
 import os
+import time
+import queue
+import atexit
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Optional, List
 from dotenv import load_dotenv
+from mime_stream import MAX_MESSAGE_BYTES, StreamingMessage, send_message, split_attachments
 
 load_dotenv()
 
+# Open SMTP sessions kept per sender, and seconds an idle one is trusted
+SMTP_POOL_SIZE = int(os.getenv('EMAIL_SMTP_POOL_SIZE', '2'))
+SMTP_IDLE_TIMEOUT = float(os.getenv('EMAIL_SMTP_IDLE_TIMEOUT', '60'))
+SMTP_TIMEOUT = float(os.getenv('EMAIL_SMTP_TIMEOUT', '30'))
+
+# Queued labels: most per digest email, and seconds to wait for more
+DIGEST_MAX = int(os.getenv('EMAIL_DIGEST_MAX', '25'))
+DIGEST_WINDOW = float(os.getenv('EMAIL_DIGEST_WINDOW', '5'))
+
+# Attempts per email and the first retry delay (doubled each time)
+RETRY_ATTEMPTS = int(os.getenv('EMAIL_RETRY_ATTEMPTS', '4'))
+RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF', '2'))
+
+_STOP = object()
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether an SMTP failure is worth retrying
+    
+    Args:
+        error: Exception raised while sending
+    
+    Returns:
+        True for dropped connections and 4xx replies, False for permanent
+        failures (bad credentials, rejected recipients, 5xx replies)
+    """
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused)):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+class SMTPPool:
+    """Reusable, authenticated SMTP sessions"""
+    
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 size: int = None, idle_timeout: float = None, timeout: float = None):
+        """
+        Args:
+            host: SMTP server
+            port: SMTP port (STARTTLS)
+            username: Login user
+            password: Login password
+            size: Most idle sessions kept open (default: EMAIL_SMTP_POOL_SIZE)
+            idle_timeout: Idle seconds after which a session is replaced
+                instead of reused (default: EMAIL_SMTP_IDLE_TIMEOUT)
+            timeout: Socket timeout in seconds (default: EMAIL_SMTP_TIMEOUT)
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, size or SMTP_POOL_SIZE)
+        self.idle_timeout = SMTP_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.timeout = timeout or SMTP_TIMEOUT
+        
+        # (connection, last used) pairs, most recently used last
+        self._idle: List = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.sessions_opened = 0
+    
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except BaseException:
+            self._discard(server)
+            raise
+        self.sessions_opened += 1
+        return server
+    
+    @staticmethod
+    def _discard(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+    
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a logged-in SMTP session
+        
+        Yields:
+            smtplib.SMTP; it goes back to the pool if the block succeeds and
+            is closed if the block raises
+        """
+        server = None
+        stale = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sessions inherited across fork belong to the parent
+                self._idle = []
+                self._pid = os.getpid()
+            now = time.monotonic()
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    server = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self._discard(candidate)
+        
+        if server is None:
+            server = self._connect()
+        try:
+            yield server
+        except BaseException:
+            self._discard(server)
+            raise
+        
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._discard(server)
+    
+    def close(self):
+        """Log out of every idle session"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._discard(server)
+
 
 class EmailSender:
-    """Simple email sender for shipping labels"""
+    """Email sender for shipping labels, with pooled SMTP sessions and a digest queue"""
     
     def __init__(self):
         """Initialize email configuration from environment"""
@@ -28,18 +165,103 @@ class EmailSender:
         
         # Check if email is configured
         self.is_configured = bool(self.email_from and self.email_password)
+        
+        self.pool = SMTPPool(self.smtp_server, self.smtp_port, self.email_from, self.email_password)
+        self.digest_max = max(1, DIGEST_MAX)
+        self.digest_window = DIGEST_WINDOW
+        self.retry_attempts = max(1, RETRY_ATTEMPTS)
+        self.retry_backoff = RETRY_BACKOFF
+        self.max_message_bytes = MAX_MESSAGE_BYTES
+        
+        # Background digest sender, started on the first queued label
+        self._queue: Optional[queue.Queue] = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._worker_pid = None
+        self._atexit_registered = False
+    
+    # ========== MESSAGES ==========
+    
+    def _label_message(self, label_filepath: str, shipment_pin: str, reference: str,
+                       recipient: str) -> StreamingMessage:
+        body = f"""
+Purolator Shipping Label
+
+Tracking PIN: {shipment_pin}
+Reference: {reference or 'N/A'}
+
+Label PDF attached.
+
+This is an automated email from the RF Scanner Shipping System.
+"""
+        return StreamingMessage(
+            self.email_from, recipient, f"Purolator Shipping Label - {shipment_pin}", body, [label_filepath]
+        )
+    
+    def _batch_messages(self, label_filepaths: List[str], shipment_info: Optional[List[dict]],
+                        recipient: str) -> List[StreamingMessage]:
+        """One message per group of labels that fits under max_message_bytes"""
+        groups = split_attachments(label_filepaths, self.max_message_bytes)
+        messages = []
+        for number, group in enumerate(groups, 1):
+            paths = [label_filepaths[index] for index in group]
+            if shipment_info and len(shipment_info) == len(label_filepaths):
+                info_text = "\n".join([
+                    f"  - PIN: {info.get('shipment_pin', 'N/A')}, Ref: {info.get('reference', 'N/A')}"
+                    for info in (shipment_info[index] for index in group)
+                ])
+            else:
+                info_text = f"{len(paths)} shipment(s)"
+            
+            subject = f"Purolator Shipping Labels - {len(paths)} Shipment(s)"
+            if len(groups) > 1:
+                subject += f" (part {number} of {len(groups)})"
+            
+            body = f"""
+Purolator Shipping Labels - Batch
+
+Shipments:
+{info_text}
+
+Label PDFs attached.
+
+This is an automated email from the RF Scanner Shipping System.
+"""
+            messages.append(StreamingMessage(self.email_from, recipient, subject, body, paths))
+        return messages
     
-    def send_label_email(self, label_filepath: str, shipment_pin: str, 
+    def _send(self, message: StreamingMessage):
+        """
+        Stream a message over a pooled session, retrying transient failures
+        
+        Raises:
+            The last SMTP error once attempts run out or the error is permanent
+        """
+        for attempt in range(self.retry_attempts):
+            try:
+                with self.pool.connection() as server:
+                    send_message(server, message)
+                return
+            except Exception as e:
+                if attempt + 1 >= self.retry_attempts or not is_transient(e):
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"⚠ Email send failed ({e}); retrying in {delay:.0f}s")
+                time.sleep(delay)
+    
+    # ========== IMMEDIATE SENDS ==========
+    
+    def send_label_email(self, label_filepath: str, shipment_pin: str,
                         reference: str = None, recipient_email: str = None) -> bool:
         """
-        Send shipping label PDF via email
+        Send shipping label PDF via email now (blocks until sent)
         
         Args:
             label_filepath: Path to the PDF label file
             shipment_pin: Purolator tracking PIN
             reference: Order reference number
             recipient_email: Optional override for recipient email
-            
+        
         Returns:
             True if email sent successfully, False otherwise
         """
@@ -51,67 +273,30 @@ class EmailSender:
             print(f"⚠ Label file not found: {label_filepath}")
             return False
         
+        recipient = recipient_email or self.email_to
         try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.email_from
-            msg['To'] = recipient_email or self.email_to
-            msg['Subject'] = f"Purolator Shipping Label - {shipment_pin}"
-            
-            # Email body
-            body = f"""
-Purolator Shipping Label
-
-Tracking PIN: {shipment_pin}
-Reference: {reference or 'N/A'}
-
-Label PDF attached.
-
-This is an automated email from the RF Scanner Shipping System.
-"""
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Attach PDF
-            with open(label_filepath, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-            
-            encoders.encode_base64(part)
-            
-            filename = Path(label_filepath).name
-            part.add_header(
-                'Content-Disposition',
-                f'attachment; filename= {filename}'
-            )
-            
-            msg.attach(part)
-            
-            # Send email
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email_from, self.email_password)
-            text = msg.as_string()
-            server.sendmail(self.email_from, recipient_email or self.email_to, text)
-            server.quit()
-            
-            print(f"✓ Label emailed to {recipient_email or self.email_to}")
+            self._send(self._label_message(label_filepath, shipment_pin, reference, recipient))
+            print(f"✓ Label emailed to {recipient}")
             return True
-            
+        
         except Exception as e:
             print(f"✗ Error sending email: {str(e)}")
             return False
     
-    def send_batch_labels_email(self, label_filepaths: List[str], 
-                                shipment_info: List[dict] = None) -> bool:
+    def send_batch_labels_email(self, label_filepaths: List[str],
+                                shipment_info: List[dict] = None,
+                                recipient_email: str = None) -> bool:
         """
-        Send multiple labels in one email
+        Send multiple labels now (blocks until sent), split into several
+        emails if they would exceed max_message_bytes
         
         Args:
             label_filepaths: List of PDF label file paths
             shipment_info: Optional list of dicts with shipment_pin and reference
-            
+            recipient_email: Optional override for recipient email
+        
         Returns:
-            True if email sent successfully
+            True if every email was sent successfully
         """
         if not self.is_configured:
             print("⚠ Email not configured. Set EMAIL_FROM and EMAIL_PASSWORD in .env")
@@ -120,71 +305,145 @@ This is an automated email from the RF Scanner Shipping System.
         if not label_filepaths:
             return False
         
-        try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.email_from
-            msg['To'] = self.email_to
-            msg['Subject'] = f"Purolator Shipping Labels - {len(label_filepaths)} Shipment(s)"
-            
-            # Email body
-            if shipment_info:
-                info_text = "\n".join([
-                    f"  - PIN: {info.get('shipment_pin', 'N/A')}, Ref: {info.get('reference', 'N/A')}"
-                    for info in shipment_info
-                ])
-            else:
-                info_text = f"{len(label_filepaths)} shipment(s)"
-            
-            body = f"""
-Purolator Shipping Labels - Batch
-
-Shipments:
-{info_text}
-
-Label PDFs attached.
-
-This is an automated email from the RF Scanner Shipping System.
-"""
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Attach all PDFs
-            for label_filepath in label_filepaths:
-                if not Path(label_filepath).exists():
-                    continue
-                
-                with open(label_filepath, 'rb') as attachment:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
-                
-                encoders.encode_base64(part)
-                
-                filename = Path(label_filepath).name
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {filename}'
-                )
-                
-                msg.attach(part)
+        recipient = recipient_email or self.email_to
+        messages = self._batch_messages(label_filepaths, shipment_info, recipient)
+        sent = 0
+        for message in messages:
+            try:
+                self._send(message)
+                sent += 1
+            except Exception as e:
+                print(f"✗ Error sending batch email: {str(e)}")
+        
+        if sent:
+            labels = sum(len(message.attachments) for message in messages)
+            print(f"✓ {labels} label(s) emailed to {recipient} in {sent} message(s)")
+        return bool(messages) and sent == len(messages)
+    
+    # ========== QUEUED DIGESTS ==========
+    
+    def queue_label_email(self, label_filepath: str, shipment_pin: str,
+                          reference: str = None, recipient_email: str = None) -> bool:
+        """
+        Queue a label for the next digest email and return immediately
+        
+        Args:
+            label_filepath: Path to the PDF label file
+            shipment_pin: Purolator tracking PIN
+            reference: Order reference number
+            recipient_email: Optional override for recipient email
+        
+        Returns:
+            True if the label was queued
+        """
+        if not self.is_configured:
+            return False
+        
+        self._ensure_worker().put({
+            'label_filepath': str(label_filepath),
+            'shipment_pin': shipment_pin,
+            'reference': reference,
+            'recipient': recipient_email or self.email_to
+        })
+        return True
+    
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Send every queued label now and wait for the digests to go out
+        
+        Args:
+            timeout: Most seconds to wait (None waits until done, 0 only
+                triggers the send)
+        
+        Returns:
+            True if the queue was drained in time
+        """
+        if self._queue is None or self._worker_pid != os.getpid():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = None):
+        """Flush queued labels, stop the sender thread and log out of SMTP"""
+        with self._worker_lock:
+            worker = self._worker if self._worker_pid == os.getpid() else None
+            self._worker = None
+        if worker is not None and worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join(timeout)
+        self.pool.close()
+    
+    def _ensure_worker(self) -> queue.Queue:
+        with self._worker_lock:
+            if self._worker is None or self._worker_pid != os.getpid() or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker_pid = os.getpid()
+                self._worker = threading.Thread(target=self._digest_loop, name='email-digest', daemon=True)
+                self._worker.start()
+                if not self._atexit_registered:
+                    # Daemon thread: send what is still queued when the process exits
+                    atexit.register(self.close)
+                    self._atexit_registered = True
+            return self._queue
+    
+    def _digest_loop(self):
+        """Collect queued labels per recipient and send them as digests"""
+        pending: Dict[str, List[dict]] = {}
+        deadlines: Dict[str, float] = {}
+        
+        while True:
+            timeout = None
+            if deadlines:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
             
-            # Send email
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email_from, self.email_password)
-            text = msg.as_string()
-            server.sendmail(self.email_from, self.email_to, text)
-            server.quit()
+            if item is _STOP or isinstance(item, threading.Event):
+                for recipient in list(pending):
+                    self._send_digest(recipient, pending.pop(recipient))
+                deadlines.clear()
+                if item is _STOP:
+                    return
+                item.set()
+                continue
             
-            print(f"✓ {len(label_filepaths)} label(s) emailed to {self.email_to}")
-            return True
+            if item is not None:
+                recipient = item['recipient']
+                pending.setdefault(recipient, []).append(item)
+                deadlines.setdefault(recipient, time.monotonic() + self.digest_window)
+                if len(pending[recipient]) >= self.digest_max:
+                    deadlines.pop(recipient)
+                    self._send_digest(recipient, pending.pop(recipient))
             
-        except Exception as e:
-            print(f"✗ Error sending batch email: {str(e)}")
-            return False
+            now = time.monotonic()
+            for recipient, deadline in list(deadlines.items()):
+                if deadline <= now:
+                    del deadlines[recipient]
+                    self._send_digest(recipient, pending.pop(recipient))
+    
+    def _send_digest(self, recipient: str, items: List[dict]):
+        """Send queued labels as digest emails (a single label keeps the single-label format)"""
+        if len(items) == 1:
+            item = items[0]
+            messages = [self._label_message(item['label_filepath'], item['shipment_pin'], item['reference'], recipient)]
+        else:
+            messages = self._batch_messages([item['label_filepath'] for item in items], items, recipient)
+        
+        for message in messages:
+            try:
+                self._send(message)
+                print(f"✓ {len(message.attachments)} label(s) emailed to {recipient}")
+            except Exception as e:
+                pins = ', '.join(str(item['shipment_pin']) for item in items
+                                 if Path(item['label_filepath']) in message.attachments)
+                print(f"✗ Error sending label email for {pins}: {str(e)}")
 
 
 # Convenience function
-def send_label_email(label_filepath: str, shipment_pin: str, 
+def send_label_email(label_filepath: str, shipment_pin: str,
                     reference: str = None, recipient_email: str = None) -> bool:
     """
     Quick function to send a label email
@@ -194,12 +453,15 @@ def send_label_email(label_filepath: str, shipment_pin: str,
         shipment_pin: Tracking PIN
         reference: Order reference
         recipient_email: Optional recipient override
-        
+    
     Returns:
         True if sent successfully
     """
     sender = EmailSender()
-    return sender.send_label_email(label_filepath, shipment_pin, reference, recipient_email)
+    try:
+        return sender.send_label_email(label_filepath, shipment_pin, reference, recipient_email)
+    finally:
+        sender.close()
 
 
 if __name__ == '__main__':
@@ -219,4 +481,3 @@ if __name__ == '__main__':
         print("  EMAIL_TO=recipient@example.com")
         print("  EMAIL_SMTP_SERVER=smtp.gmail.com")
         print("  EMAIL_SMTP_PORT=587")
-
@@ -237,14 +237,14 @@ def example_6_batch_import():
     # Import customers
     if os.path.exists('sample_customers.csv'):
         print("\n1. Importing customers from sample_customers.csv...")
-        db.import_from_csv('sample_customers.csv', 'customers')
-        print("   Customers imported!")
+        summary = db.import_from_csv('sample_customers.csv', 'customers')
+        print(f"   Customers imported: {summary['imported']} (skipped {len(summary['errors'])})")
     
     # Import locations
     if os.path.exists('sample_locations.csv'):
         print("\n2. Importing locations from sample_locations.csv...")
-        db.import_from_csv('sample_locations.csv', 'locations')
-        print("   Locations imported!")
+        summary = db.import_from_csv('sample_locations.csv', 'locations')
+        print(f"   Locations imported: {summary['imported']} (skipped {len(summary['errors'])})")
     
     # Show results
     customers = db.get_all_customers()
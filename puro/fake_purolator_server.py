@@ -0,0 +1,172 @@
+"""
+Fake Purolator SOAP Server
+Local stand-in for the CreateShipment and GetDocuments services, for offline
+throughput benchmarks and smoke tests
+
+Every CreateShipment gets a fresh PIN; every GetDocuments returns a small
+base64 PDF per requested PIN. Malformed envelopes get a SOAP fault with
+HTTP 500, like the real service.
+
+Usage:
+    python fake_purolator_server.py [--port 8099] [--latency-ms 100]
+
+Then point the clients at it:
+    PUROLATOR_SHIPMENT_URL=http://127.0.0.1:8099/Shipping
+    PUROLATOR_DOCUMENTS_URL=http://127.0.0.1:8099/ShippingDocuments
+"""
+
+import re
+import time
+import base64
+import argparse
+import itertools
+import threading
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+FAKE_PDF = base64.b64encode(b"%PDF-1.4\n% fake label\n%%EOF\n").decode('ascii')
+
+CREATE_RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <CreateShipmentResponse xmlns="http://purolator.com/pws/datatypes/v2">
+      <ResponseInformation><Errors/><InformationalMessages/></ResponseInformation>
+      <ShipmentPIN><Value>{pin}</Value></ShipmentPIN>
+    </CreateShipmentResponse>
+  </s:Body>
+</s:Envelope>"""
+
+DOCUMENTS_RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <GetDocumentsResponse xmlns="http://purolator.com/pws/datatypes/v1">
+      <ResponseInformation><Errors/><InformationalMessages/></ResponseInformation>
+      <Documents>{documents}</Documents>
+    </GetDocumentsResponse>
+  </s:Body>
+</s:Envelope>"""
+
+DOCUMENT = """
+        <Document>
+          <PIN><Value>{pin}</Value></PIN>
+          <DocumentDetails>
+            <DocumentDetail>
+              <DocumentType>DomesticBillOfLading</DocumentType>
+              <DocumentStatus>Completed</DocumentStatus>
+              <Data>{data}</Data>
+            </DocumentDetail>
+          </DocumentDetails>
+        </Document>"""
+
+FAULT_RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <s:Fault>
+      <faultcode>s:Client</faultcode>
+      <s:faultstring>{message}</s:faultstring>
+    </s:Fault>
+  </s:Body>
+</s:Envelope>"""
+
+PIN_VALUE = re.compile(r'<v1:PIN>\s*<v1:Value>([^<]*)</v1:Value>')
+
+
+class FakePurolatorServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog deep enough for hundreds of clients"""
+    
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakePurolatorHandler(BaseHTTPRequestHandler):
+    """Answers CreateShipment and GetDocuments after the configured latency"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    # Headers and body are written separately; without this, Nagle + delayed
+    # ACK adds ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        # test_connection probes the endpoint with a GET
+        self._reply(200, 'text/plain', b'OK')
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        
+        with self.server.stats_lock:
+            self.server.requests += 1
+        
+        try:
+            ET.fromstring(body)
+        except ET.ParseError as e:
+            fault = FAULT_RESPONSE.format(message=f"Invalid request XML: {e}")
+            self._reply(500, 'text/xml; charset=utf-8', fault.encode('utf-8'))
+            return
+        
+        action = self.headers.get('SOAPAction', '')
+        if action.endswith('GetDocuments'):
+            pins = PIN_VALUE.findall(body.decode('utf-8'))
+            documents = ''.join(DOCUMENT.format(pin=pin, data=FAKE_PDF) for pin in pins)
+            response = DOCUMENTS_RESPONSE.format(documents=documents)
+        else:
+            response = CREATE_RESPONSE.format(pin=next(self.server.pins))
+        
+        self._reply(200, 'text/xml; charset=utf-8', response.encode('utf-8'))
+    
+    def _reply(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_fake_server(port: int = 0, latency_ms: float = 0) -> Tuple[FakePurolatorServer, str]:
+    """
+    Start the fake server on a background thread
+    
+    Args:
+        port: Port to listen on (0 picks a free port)
+        latency_ms: Delay added to every SOAP response
+    
+    Returns:
+        Tuple of (server, base URL); call server.shutdown() when done
+    """
+    server = FakePurolatorServer(('127.0.0.1', port), FakePurolatorHandler)
+    server.latency = latency_ms / 1000
+    server.pins = itertools.count(329000000001)
+    server.requests = 0
+    server.stats_lock = threading.Lock()
+    
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    """Run the fake server in the foreground"""
+    parser = argparse.ArgumentParser(description='Fake Purolator SOAP server')
+    parser.add_argument('--port', type=int, default=8099, help='Port (default: 8099)')
+    parser.add_argument('--latency-ms', type=float, default=100.0,
+                        help='Delay added to every SOAP response (default: 100)')
+    args = parser.parse_args()
+    
+    server, base_url = start_fake_server(args.port, args.latency_ms)
+    print(f"Fake Purolator server on {base_url} ({args.latency_ms:.0f} ms latency)")
+    print(f"  PUROLATOR_SHIPMENT_URL={base_url}/Shipping")
+    print(f"  PUROLATOR_DOCUMENTS_URL={base_url}/ShippingDocuments")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
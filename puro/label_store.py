@@ -0,0 +1,413 @@
+"""
+Label Store
+Content-addressed cache of label PDFs, indexed by shipment PIN
+
+Each PDF is stored once under labels/objects/ by its SHA-256 and hard-linked
+into labels/ under the usual label_<reference>_<pin>.pdf name, so emails and
+the GUI keep their familiar filenames. A small SQLite manifest
+(labels/manifest.db) maps each PIN to its PDF and records when it was saved
+and last used. Reprints are served from disk instead of a new GetDocuments
+call; least recently used labels are evicted once the store grows past its
+size cap, and labels older than the TTL are treated as stale and downloaded
+again. SQLite keeps the manifest safe to share between the API server's
+worker processes.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager, closing
+from typing import Dict, Iterable, List, Optional, Union
+
+from label_io import copy_base64, copy_chunks
+
+# Size cap for stored labels and age after which a label is re-downloaded
+LABEL_CACHE_MB = float(os.getenv("PUROLATOR_LABEL_CACHE_MB", "500"))
+LABEL_TTL_DAYS = float(os.getenv("PUROLATOR_LABEL_TTL_DAYS", "30"))
+
+
+class _HashingWriter:
+    """Binary file wrapper that hashes and counts everything written through it"""
+    
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.path: Optional[str] = None
+    
+    def write(self, chunk: bytes) -> int:
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return self.f.write(chunk)
+
+
+class LabelStore:
+    """
+    PIN-indexed, content-addressed label PDF store with LRU eviction and a TTL
+    """
+    
+    def __init__(self, root: Union[str, Path] = "labels", max_bytes: int = None,
+                 ttl_seconds: float = None):
+        """
+        Configure the store (files and manifest are created on first use)
+        
+        Args:
+            root: Labels directory
+            max_bytes: Size cap for stored PDFs
+                (default: PUROLATOR_LABEL_CACHE_MB from environment, or 500 MB)
+            ttl_seconds: Age after which a label is stale; 0 disables the TTL
+                (default: PUROLATOR_LABEL_TTL_DAYS from environment, or 30 days)
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifest_path = self.root / "manifest.db"
+        self.max_bytes = int(LABEL_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.ttl_seconds = LABEL_TTL_DAYS * 86400 if ttl_seconds is None else ttl_seconds
+        
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _initialize(self):
+        """Create the directories and manifest table"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            self.objects_dir.mkdir(parents=True, exist_ok=True)
+            with closing(sqlite3.connect(str(self.manifest_path), timeout=30)) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript('''
+                    CREATE TABLE IF NOT EXISTS labels (
+                        pin TEXT PRIMARY KEY,
+                        digest TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        reference TEXT,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_labels_digest ON labels(digest);
+                    CREATE INDEX IF NOT EXISTS idx_labels_accessed ON labels(accessed_at);
+                    CREATE INDEX IF NOT EXISTS idx_labels_created ON labels(created_at);
+                    
+                    -- Running size of the distinct stored PDFs, kept in step with labels
+                    CREATE TABLE IF NOT EXISTS usage (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        total_bytes INTEGER NOT NULL
+                    );
+                    INSERT OR IGNORE INTO usage (id, total_bytes) VALUES (1, 0);
+                ''')
+            self._initialized = True
+    
+    @contextmanager
+    def _connection(self, write: bool = False):
+        """
+        Manifest connection for one operation
+        
+        Args:
+            write: Hold the write lock for the whole block (BEGIN IMMEDIATE)
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if not self._initialized:
+                self._initialize()
+            # One connection per thread (and process); opening and closing
+            # per call costs more than the queries themselves
+            conn = sqlite3.connect(str(self.manifest_path), timeout=30, isolation_level=None)
+            # The manifest is a cache: WAL without an fsync per commit is enough
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        
+        try:
+            if write:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            if write:
+                conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    
+    def object_path(self, digest: str) -> Path:
+        """Path of the stored PDF with the given SHA-256"""
+        return self.objects_dir / digest[:2] / f"{digest}.pdf"
+    
+    def label_path(self, shipment_pin: str, reference: str) -> Path:
+        """Human-readable path of a shipment's label"""
+        return self.root / f"label_{reference}_{shipment_pin}.pdf"
+    
+    def _is_stale(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - created_at > self.ttl_seconds
+    
+    def get(self, shipment_pin: str) -> Optional[str]:
+        """
+        Saved label for a PIN, if it is still fresh
+        
+        Args:
+            shipment_pin: Shipment PIN
+        
+        Returns:
+            Path of the label PDF, or None if it is missing or stale
+        """
+        return self.get_many([shipment_pin]).get(shipment_pin)
+    
+    def get_many(self, shipment_pins: Iterable[str]) -> Dict[str, str]:
+        """
+        Saved labels for several PINs (marks them as recently used)
+        
+        Args:
+            shipment_pins: Shipment PINs
+        
+        Returns:
+            Dictionary of {pin: label path} for the PINs with a fresh label
+        """
+        pins = [pin for pin in dict.fromkeys(shipment_pins) if pin]
+        if not pins:
+            return {}
+        
+        now = time.time()
+        found = {}
+        with self._connection() as conn:
+            rows = []
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(pins), 500):
+                chunk = pins[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows.extend(conn.execute(
+                    f'SELECT pin, digest, size, reference, created_at FROM labels WHERE pin IN ({placeholders})',
+                    chunk
+                ))
+            
+            for pin, digest, size, reference, created_at in rows:
+                if self._is_stale(created_at, now):
+                    continue
+                blob = self.object_path(digest)
+                if not blob.exists():
+                    # Removed behind our back; forget it
+                    self._add_bytes(conn, -self._drop(conn, pin, digest, size))
+                    continue
+                path = self.label_path(pin, reference)
+                if not path.exists():
+                    self._link(blob, path)
+                found[pin] = str(path)
+            
+            if found:
+                conn.executemany('UPDATE labels SET accessed_at = ? WHERE pin = ?',
+                                 [(now, pin) for pin in found])
+        return found
+    
+    def reference(self, shipment_pin: str) -> Optional[str]:
+        """Reference a PIN's label was saved under (even if stale), or None"""
+        with self._connection() as conn:
+            row = conn.execute('SELECT reference FROM labels WHERE pin = ?',
+                               (shipment_pin,)).fetchone()
+        return row[0] if row else None
+    
+    @contextmanager
+    def writer(self, shipment_pin: str, reference: str):
+        """
+        Write a label PDF into the store
+        
+        The PDF goes to a temporary file while it is hashed, then is moved to
+        its content address, linked under its label name and recorded in the
+        manifest. Nothing is stored if the block raises.
+        
+        Args:
+            shipment_pin: Shipment PIN
+            reference: Shipment reference (used in the filename)
+        
+        Yields:
+            Writer with write(bytes); its .path is the label path afterwards
+        """
+        if not self._initialized:
+            self._initialize()
+        fd, tmp_name = tempfile.mkstemp(prefix='.incoming.', suffix='.tmp', dir=str(self.objects_dir))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = _HashingWriter(f)
+                yield writer
+            
+            digest = writer.sha256.hexdigest()
+            blob = self.object_path(digest)
+            blob.parent.mkdir(exist_ok=True)
+            if blob.exists():
+                os.unlink(tmp_name)
+            else:
+                os.replace(tmp_name, blob)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        
+        writer.path = self._commit(shipment_pin, reference, digest, writer.size)
+    
+    def put_base64(self, shipment_pin: str, reference: str, data: str) -> str:
+        """
+        Store a label from base64 data (decoded chunk by chunk)
+        
+        Returns:
+            Path of the label PDF
+        """
+        with self.writer(shipment_pin, reference) as writer:
+            copy_base64(writer, data)
+        return writer.path
+    
+    def put_chunks(self, shipment_pin: str, reference: str, chunks: Iterable[bytes]) -> str:
+        """
+        Store a label from byte chunks (e.g. response.iter_content)
+        
+        Returns:
+            Path of the label PDF
+        """
+        with self.writer(shipment_pin, reference) as writer:
+            copy_chunks(writer, chunks)
+        return writer.path
+    
+    def _commit(self, shipment_pin: str, reference: str, digest: str, size: int) -> str:
+        """Link a stored PDF under its label name, record it and evict if over the cap"""
+        path = self.label_path(shipment_pin, reference)
+        self._link(self.object_path(digest), path)
+        
+        now = time.time()
+        with self._connection(write=True) as conn:
+            old = conn.execute('SELECT digest, size, reference FROM labels WHERE pin = ?',
+                               (shipment_pin,)).fetchone()
+            added = 0 if self._referenced(conn, digest) else size
+            conn.execute('''
+                INSERT OR REPLACE INTO labels (pin, digest, size, reference, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (shipment_pin, digest, size, reference, now, now))
+            
+            doomed = []
+            if old:
+                old_digest, old_size, old_reference = old
+                if old_reference != reference:
+                    doomed.append(self.label_path(shipment_pin, old_reference))
+                if old_digest != digest and not self._referenced(conn, old_digest):
+                    doomed.append(self.object_path(old_digest))
+                    added -= old_size
+            self._add_bytes(conn, added)
+            doomed.extend(self._evict(conn, keep=shipment_pin))
+        
+        self._unlink(doomed)
+        return str(path)
+    
+    def _referenced(self, conn: sqlite3.Connection, digest: str) -> bool:
+        return conn.execute('SELECT 1 FROM labels WHERE digest = ? LIMIT 1',
+                            (digest,)).fetchone() is not None
+    
+    def _total_bytes(self, conn: sqlite3.Connection) -> int:
+        """Bytes of distinct stored PDFs (shared content counts once)"""
+        return conn.execute('SELECT total_bytes FROM usage WHERE id = 1').fetchone()[0]
+    
+    def _add_bytes(self, conn: sqlite3.Connection, delta: int):
+        if delta:
+            conn.execute('UPDATE usage SET total_bytes = total_bytes + ? WHERE id = 1', (delta,))
+    
+    def _drop(self, conn: sqlite3.Connection, pin: str, digest: str, size: int) -> int:
+        """
+        Remove a PIN from the manifest
+        
+        Returns:
+            Bytes freed (size if no other PIN shares the PDF, otherwise 0)
+        """
+        conn.execute('DELETE FROM labels WHERE pin = ?', (pin,))
+        return 0 if self._referenced(conn, digest) else size
+    
+    def _evict(self, conn: sqlite3.Connection, keep: str = None) -> List[Path]:
+        """
+        Drop labels until the store fits its cap, stale ones first, then least recently used
+        
+        Returns:
+            Files to delete once the transaction has committed
+        """
+        total = start_total = self._total_bytes(conn)
+        if total <= self.max_bytes:
+            return []
+        
+        candidates = [('''
+            SELECT pin, digest, size, reference FROM labels
+            WHERE pin != ? ORDER BY accessed_at LIMIT 32
+        ''', (keep or '',))]
+        if self.ttl_seconds:
+            candidates.insert(0, ('''
+                SELECT pin, digest, size, reference FROM labels
+                WHERE pin != ? AND created_at < ? ORDER BY created_at LIMIT 32
+            ''', (keep or '', time.time() - self.ttl_seconds)))
+        
+        doomed = []
+        for sql, params in candidates:
+            # Small pages over an index, so a full store does not sort every row per save
+            while total > self.max_bytes:
+                rows = conn.execute(sql, params).fetchall()
+                if not rows:
+                    break
+                for pin, digest, size, reference in rows:
+                    freed = self._drop(conn, pin, digest, size)
+                    doomed.append(self.label_path(pin, reference))
+                    if freed:
+                        doomed.append(self.object_path(digest))
+                        total -= freed
+                    if total <= self.max_bytes:
+                        break
+        
+        self._add_bytes(conn, total - start_total)
+        return doomed
+    
+    def evict(self) -> int:
+        """
+        Enforce the size cap now
+        
+        Returns:
+            Number of files removed
+        """
+        with self._connection(write=True) as conn:
+            doomed = self._evict(conn)
+        self._unlink(doomed)
+        return len(doomed)
+    
+    def stats(self) -> Dict:
+        """Label count, stored bytes and limits"""
+        with self._connection() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+            total = self._total_bytes(conn)
+        return {
+            'labels': count,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds
+        }
+    
+    def _link(self, blob: Path, path: Path):
+        """Atomically point path at blob (hard link, or a copy where links are unsupported)"""
+        try:
+            if os.path.samefile(blob, path):
+                return
+        except OSError:
+            pass
+        
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self._unlink([tmp])
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, path)
+        # rename() is a no-op when both names already point at the same file
+        self._unlink([tmp])
+    
+    @staticmethod
+    def _unlink(paths: Iterable[Path]):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
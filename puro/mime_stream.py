@@ -0,0 +1,227 @@
+"""
+Streaming MIME Messages
+Label emails written straight onto the SMTP DATA stream
+
+Attachments are read and base64-encoded one chunk at a time while the
+message is being sent, so sending a batch of labels costs one chunk of
+memory instead of the PDFs, their base64 copies and the flattened message
+string. The encoded size of a message is known up front, which lets a batch
+be split into several messages under a size cap.
+"""
+
+import os
+import base64
+import smtplib
+from email import policy
+from email.message import EmailMessage, Message
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from pathlib import Path
+from typing import Iterator, List, Sequence, Union
+
+# Largest message to build, encoded (many providers reject more than 25 MB)
+MAX_MESSAGE_BYTES = int(float(os.getenv('EMAIL_MAX_MESSAGE_MB', '20')) * 1024 * 1024)
+
+# Attachment bytes encoded per chunk: a multiple of 57, so chunks end on whole 76-char lines
+CHUNK_SIZE = 57 * 1024
+
+# Allowance for the headers and text part when splitting a batch
+MESSAGE_OVERHEAD = 8 * 1024
+ATTACHMENT_OVERHEAD = 512
+
+
+def encoded_size(size: int) -> int:
+    """
+    Size of data once base64-encoded into CRLF-terminated 76-character lines
+    
+    Args:
+        size: Raw byte count
+    
+    Returns:
+        Encoded byte count
+    """
+    encoded = 4 * ((size + 2) // 3)
+    lines = (encoded + 75) // 76
+    return encoded + 2 * lines
+
+
+def dot_stuff(data: bytes) -> bytes:
+    """Escape lines starting with '.' for the SMTP DATA stream (RFC 5321 4.5.2)"""
+    if data.startswith(b'.'):
+        data = b'.' + data
+    return data.replace(b'\r\n.', b'\r\n..')
+
+
+class StreamingMessage:
+    """multipart/mixed message with a text body and file attachments, encoded on demand"""
+    
+    def __init__(self, sender: str, recipient: str, subject: str, body: str,
+                 attachments: Sequence[Union[str, Path]] = ()):
+        """
+        Args:
+            sender: From address
+            recipient: To address
+            subject: Subject line
+            body: Plain-text body
+            attachments: Files to attach (missing files are skipped)
+        """
+        self.sender = sender
+        self.recipient = recipient
+        self.attachments = [Path(path) for path in attachments if Path(path).exists()]
+        self.boundary = f"=_label_{make_msgid().strip('<>').replace('@', '_')}"
+        
+        self._head = self._headers(subject)
+        self._text = self._text_part(body)
+    
+    def _headers(self, subject: str) -> bytes:
+        msg = EmailMessage(policy=policy.SMTP)
+        msg['From'] = self.sender
+        msg['To'] = self.recipient
+        msg['Subject'] = subject
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = make_msgid()
+        msg['MIME-Version'] = '1.0'
+        msg['Content-Type'] = f'multipart/mixed; boundary="{self.boundary}"'
+        return self._fold(msg)
+    
+    @staticmethod
+    def _fold(msg: Message) -> bytes:
+        """Header block of msg, CRLF-terminated, followed by the blank line"""
+        return b''.join(policy.SMTP.fold_binary(name, value) for name, value in msg.items()) + b'\r\n'
+    
+    @staticmethod
+    def _text_part(body: str) -> bytes:
+        part = MIMEText(body, 'plain', 'utf-8')
+        del part['MIME-Version']
+        return part.as_bytes(policy=policy.SMTP)
+    
+    def _attachment_headers(self, path: Path) -> bytes:
+        part = Message()
+        part['Content-Type'] = 'application/octet-stream'
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=path.name)
+        return self._fold(part)
+    
+    def _delimiter(self, close: bool = False) -> bytes:
+        return f"--{self.boundary}{'--' if close else ''}\r\n".encode('ascii')
+    
+    def size(self) -> int:
+        """Exact size of the encoded message in bytes (before dot-stuffing)"""
+        total = len(self._head) + len(self._delimiter()) + len(self._text) + len(self._delimiter(True))
+        for path in self.attachments:
+            total += len(self._delimiter()) + len(self._attachment_headers(path))
+            total += encoded_size(path.stat().st_size)
+        return total
+    
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Generate the encoded message piece by piece
+        
+        Args:
+            chunk_size: Attachment bytes read per chunk (rounded down to a multiple of 57)
+        
+        Yields:
+            Message bytes with CRLF line endings, not yet dot-stuffed
+        """
+        chunk_size = max(57, chunk_size - chunk_size % 57)
+        
+        yield self._head
+        yield self._delimiter() + self._text
+        for path in self.attachments:
+            yield self._delimiter() + self._attachment_headers(path)
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    # Whole 57-byte groups, so each chunk ends on a line boundary
+                    yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+        yield self._delimiter(True)
+
+
+def attachment_cost(path: Union[str, Path]) -> int:
+    """Approximate bytes a file adds to a message (encoded data plus part headers)"""
+    return encoded_size(Path(path).stat().st_size) + ATTACHMENT_OVERHEAD
+
+
+def split_attachments(paths: Sequence[Union[str, Path]], max_bytes: int = None) -> List[List[int]]:
+    """
+    Group attachments into messages that stay under a size cap
+    
+    Args:
+        paths: Files to send, in order (missing files are left out)
+        max_bytes: Largest encoded message (default: EMAIL_MAX_MESSAGE_MB)
+    
+    Returns:
+        Lists of indexes into paths, one list per message; a file larger
+        than the cap on its own gets a message to itself
+    """
+    max_bytes = max_bytes or MAX_MESSAGE_BYTES
+    groups: List[List[int]] = []
+    current: List[int] = []
+    current_size = MESSAGE_OVERHEAD
+    
+    for index, path in enumerate(paths):
+        if not Path(path).exists():
+            continue
+        cost = attachment_cost(path)
+        if current and current_size + cost > max_bytes:
+            groups.append(current)
+            current = []
+            current_size = MESSAGE_OVERHEAD
+        current.append(index)
+        current_size += cost
+    
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _reset(server: smtplib.SMTP):
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def send_message(server: smtplib.SMTP, message: StreamingMessage, chunk_size: int = CHUNK_SIZE):
+    """
+    Send a message over a logged-in SMTP session, streaming it into DATA
+    
+    Args:
+        server: Connected smtplib.SMTP
+        message: Message to send
+        chunk_size: Attachment bytes encoded per write
+    
+    Raises:
+        smtplib.SMTPSenderRefused, SMTPRecipientsRefused or SMTPDataError
+        when the server rejects the message
+    """
+    server.ehlo_or_helo_if_needed()
+    options = [f'SIZE={message.size()}'] if server.has_extn('size') else []
+    
+    code, response = server.mail(message.sender, options)
+    if code != 250:
+        _reset(server)
+        raise smtplib.SMTPSenderRefused(code, response, message.sender)
+    
+    code, response = server.rcpt(message.recipient)
+    if code not in (250, 251):
+        _reset(server)
+        raise smtplib.SMTPRecipientsRefused({message.recipient: (code, response)})
+    
+    server.putcmd('data')
+    code, response = server.getreply()
+    if code != 354:
+        _reset(server)
+        raise smtplib.SMTPDataError(code, response)
+    
+    # Every chunk ends with CRLF, so a '.' can only follow a chunk boundary
+    # at the start of a line: dot-stuffing each chunk on its own is enough
+    for chunk in message.iter_chunks(chunk_size):
+        server.send(dot_stuff(chunk))
+    server.send(b'.\r\n')
+    
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
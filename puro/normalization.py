@@ -0,0 +1,189 @@
+"""
+Address Normalization
+Precompiled patterns and memoized parsing of phone numbers, streets and postal codes
+
+A batch repeats the same sender address on every row, and receivers repeat
+across orders, so parsed results are immutable records cached in an LRU and
+shared between rows instead of being re-parsed for each shipment.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Tuple
+
+# Distinct inputs remembered by each normalizer
+CACHE_SIZE = int(os.getenv('ADDRESS_NORMALIZE_CACHE_SIZE', '4096'))
+
+NON_DIGITS = re.compile(r'\D')
+NUMBERED_STREET = re.compile(r'^(\d+[A-Za-z]?)(?:\s*[-–]\s*\d+[A-Za-z]?)?\s+(.+)$')
+LEADING_DIGITS = re.compile(r'^(\d+)\s*(.+)$')
+CA_POSTAL_CODE = re.compile(r'^[A-Z]\d[A-Z]\d[A-Z]\d$')
+US_ZIP_CODE = re.compile(r'^\d{5}(-\d{4})?$')
+
+DEFAULT_AREA_CODE = "416"
+DEFAULT_PHONE = "1234567"
+DEFAULT_STREET = ("123", "Main St")
+
+
+class PhoneNumber(NamedTuple):
+    """North American phone number split the way Purolator expects it"""
+    country_code: str
+    area_code: str
+    phone: str
+    
+    def as_dict(self) -> Dict[str, str]:
+        """Dictionary with CountryCode, AreaCode and Phone"""
+        return {"CountryCode": self.country_code, "AreaCode": self.area_code, "Phone": self.phone}
+
+
+class NormalizedAddress(NamedTuple):
+    """Parsed, formatted address ready for a CreateShipment envelope"""
+    street_number: str
+    street_name: str
+    city: str
+    province: str
+    postal_code: str
+    country: str
+    phone: PhoneNumber
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_phone(phone_str: str) -> PhoneNumber:
+    """
+    Parse a phone number in any common format ("416-123-4567", "(416) 123-4567", ...)
+    
+    Args:
+        phone_str: Phone number string
+    
+    Returns:
+        PhoneNumber (defaults when the number cannot be parsed)
+    """
+    if not phone_str:
+        return PhoneNumber("1", DEFAULT_AREA_CODE, DEFAULT_PHONE)
+    
+    digits = NON_DIGITS.sub('', phone_str)
+    
+    # 10 digits: North American format
+    if len(digits) == 10:
+        return PhoneNumber("1", digits[0:3], digits[3:])
+    
+    # 11 digits starting with 1: drop the country code
+    if len(digits) == 11 and digits[0] == '1':
+        return PhoneNumber("1", digits[1:4], digits[4:])
+    
+    # 7 digits: just the phone part, default area code
+    if len(digits) == 7:
+        return PhoneNumber("1", DEFAULT_AREA_CODE, digits)
+    
+    return PhoneNumber("1", DEFAULT_AREA_CODE, DEFAULT_PHONE)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_street(street_str: str) -> Tuple[str, str]:
+    """
+    Split a street address into number and name ("123 Main St", "123-125 Main St", "123A Main St")
+    
+    Args:
+        street_str: Street address string
+    
+    Returns:
+        Tuple of (StreetNumber, StreetName)
+    """
+    if not street_str:
+        return DEFAULT_STREET
+    
+    street_str = street_str.strip()
+    
+    match = NUMBERED_STREET.match(street_str)
+    if match:
+        return (match.group(1), match.group(2).strip())
+    
+    # Leading digits run into the name ("123Main St")
+    match = LEADING_DIGITS.match(street_str)
+    if match:
+        return (match.group(1), match.group(2).strip())
+    
+    # Fallback: first word is the number, the rest is the name
+    parts = street_str.split(None, 1)
+    if len(parts) == 2:
+        return (parts[0], parts[1])
+    
+    return ("123", street_str)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_postal(postal_code: str) -> str:
+    """
+    Uppercase a postal code without spaces, then format Canadian codes as "A1A 1A1"
+    
+    Args:
+        postal_code: Postal code
+    
+    Returns:
+        Formatted postal code ("" when empty)
+    """
+    if not postal_code:
+        return ""
+    
+    formatted = postal_code.replace(" ", "").upper()
+    if len(formatted) == 6 and CA_POSTAL_CODE.match(formatted):
+        return f"{formatted[0:3]} {formatted[3:6]}"
+    return formatted
+
+
+def is_valid_postal(postal_code: str, country: str = "CA") -> bool:
+    """
+    Check a postal code's format for its country
+    
+    Args:
+        postal_code: Postal code
+        country: Country code (CA, US; anything else only needs a value)
+    
+    Returns:
+        True if the format looks valid
+    """
+    if not postal_code:
+        return False
+    
+    postal_code = postal_code.replace(" ", "").upper()
+    if country == "CA":
+        return CA_POSTAL_CODE.match(postal_code) is not None
+    if country == "US":
+        return US_ZIP_CODE.match(postal_code) is not None
+    return True
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_address(street: str, city: str, province: str, postal_code: str,
+                      country: str = "CA", phone: str = "") -> NormalizedAddress:
+    """
+    Parse and format every part of an address at once
+    
+    Args:
+        street: Street address ("123 Main St")
+        city: City
+        province: Province or state code
+        postal_code: Postal code
+        country: Country code
+        phone: Phone number
+    
+    Returns:
+        NormalizedAddress (cached; equal inputs return the same record)
+    """
+    street_number, street_name = normalize_street(street)
+    return NormalizedAddress(
+        street_number=street_number,
+        street_name=street_name,
+        city=(city or "").strip(),
+        province=(province or "").strip().upper(),
+        postal_code=normalize_postal(postal_code),
+        country=(country or "").strip().upper(),
+        phone=normalize_phone(phone)
+    )
+
+
+def clear_caches():
+    """Forget every memoized result"""
+    for cached in (normalize_phone, normalize_street, normalize_postal, normalize_address):
+        cached.cache_clear()
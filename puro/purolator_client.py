@@ -0,0 +1,583 @@
+"""
+Purolator API Client
+SOAP calls for creating shipments and downloading labels, without any GUI dependency
+"""
+
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import NewConnectionError
+from dotenv import load_dotenv
+from purolator_utils import response_error_message
+from normalization import normalize_address
+from soap_templates import SHIPMENT_REQUEST, render_documents_request
+from soap_responses import parse_response
+from label_io import CHUNK_SIZE as LABEL_CHUNK_SIZE
+from label_store import LabelStore
+
+# Try to import email utilities (optional feature)
+try:
+    from email_utils import EmailSender
+    EMAIL_AVAILABLE = True
+except ImportError:
+    EMAIL_AVAILABLE = False
+    EmailSender = None
+
+# Load environment variables
+load_dotenv()
+
+# API endpoints - PRODUCTION (override to point at fake_purolator_server.py for offline runs)
+SHIPMENT_URL = os.getenv(
+    "PUROLATOR_SHIPMENT_URL",
+    "https://webservices.purolator.com/EWS/V2/Shipping/ShippingService.asmx"
+)
+DOCUMENTS_URL = os.getenv(
+    "PUROLATOR_DOCUMENTS_URL",
+    "https://webservices.purolator.com/EWS/V1/ShippingDocuments/ShippingDocumentsService.asmx"
+)
+
+# HTTP connection pool tuning
+HTTP_POOL_SIZE = int(os.getenv("PUROLATOR_HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = int(os.getenv("PUROLATOR_HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("PUROLATOR_HTTP_BACKOFF", "0.5"))
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Shipment PINs per GetDocuments call when fetching labels in bulk
+LABEL_BATCH_SIZE = int(os.getenv("PUROLATOR_LABEL_BATCH_SIZE", "20"))
+
+# Result status of a CreateShipment that was sent but got no answer: the
+# shipment may exist, so it must not be sent again until someone has checked
+IN_DOUBT = "In Doubt"
+
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES,
+                        backoff: float = HTTP_BACKOFF) -> requests.Session:
+    """
+    Create a keep-alive session for the Purolator web services
+    
+    Connection failures are retried for every request, since nothing reached
+    the server. Server errors and read failures are only retried for GET;
+    SOAP POSTs decide for themselves (see PurolatorClient._post_soap), because
+    replaying a CreateShipment that the server may have processed would
+    create a duplicate shipment.
+    
+    Args:
+        pool_size: Keep-alive connections kept per host (should cover the
+            number of shipments in flight)
+        retries: Maximum retries per request
+        backoff: Exponential backoff factor in seconds
+        
+    Returns:
+        Configured requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def request_never_sent(error: requests.RequestException) -> bool:
+    """
+    Check whether a request failed before a connection was made
+    
+    Args:
+        error: Exception raised by the session
+        
+    Returns:
+        True if nothing can have reached the server (connect timeout or refused)
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class PurolatorClient:
+    """
+    Purolator E-Ship web service client (shipment creation and label retrieval)
+    """
+    
+    def __init__(self):
+        self.username = os.getenv("PUROLATOR_API_USERNAME")
+        self.password = os.getenv("PUROLATOR_API_PASSWORD")
+        self.account = os.getenv("PUROLATOR_API_ACCOUNT")
+        
+        self.shipment_url = SHIPMENT_URL
+        self.documents_url = DOCUMENTS_URL
+        
+        # One keep-alive session per client, so shipments and labels reuse TLS connections
+        self.session = create_http_session()
+        
+        # Download the label right after each successful shipment
+        self.fetch_labels = True
+        
+        # Saved labels, so reprints are served from disk
+        self.label_store = LabelStore()
+        
+        # Initialize email sender if available
+        self.email_sender = None
+        if EMAIL_AVAILABLE:
+            try:
+                self.email_sender = EmailSender()
+                if not self.email_sender.is_configured:
+                    print("Note: Email not configured. Set EMAIL_FROM and EMAIL_PASSWORD in .env to enable email labels")
+            except Exception as e:
+                print(f"Warning: Could not initialize email sender: {e}")
+    
+    def _post_soap(self, url, soap_action, soap_body, retry_server_errors=False):
+        """
+        POST a SOAP envelope over the shared session
+        
+        Args:
+            url: Service endpoint
+            soap_action: SOAPAction header value
+            soap_body: SOAP envelope
+            retry_server_errors: Also retry 5xx responses and dropped connections
+                (only safe for read-only calls such as GetDocuments)
+            
+        Returns:
+            requests.Response
+        """
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": soap_action
+        }
+        
+        attempts = 1 + (HTTP_RETRIES if retry_server_errors else 0)
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.post(
+                    url,
+                    data=soap_body,
+                    headers=headers,
+                    auth=(self.username, self.password),
+                    timeout=30
+                )
+            except requests.ConnectionError:
+                if last_attempt:
+                    raise
+            else:
+                if last_attempt or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            time.sleep(HTTP_BACKOFF * (2 ** attempt))
+    
+    def connection_stats(self):
+        """
+        Get keep-alive connection reuse counters for the shared session
+        
+        Returns:
+            Dictionary with requests sent, connections opened and reuse ratio
+        """
+        requests_sent = 0
+        connections_opened = 0
+        hosts = []
+        
+        adapters = {id(a): a for a in self.session.adapters.values()}.values()
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+                hosts.append({
+                    'host': pool.host,
+                    'requests': pool.num_requests,
+                    'connections_opened': pool.num_connections
+                })
+        
+        reused = max(0, requests_sent - connections_opened)
+        return {
+            'requests': requests_sent,
+            'connections_opened': connections_opened,
+            'connections_reused': reused,
+            'reuse_ratio': round(reused / requests_sent, 3) if requests_sent else 0.0,
+            'hosts': hosts
+        }
+    
+    def close(self):
+        """Close the keep-alive connections"""
+        self.session.close()
+    
+    def should_fetch_label(self) -> bool:
+        """Whether to download the label right after a shipment is created"""
+        return self.fetch_labels
+    
+    def create_shipment_from_data(self, data):
+        """Create shipment from CSV data"""
+        result = self.create_shipment(data)
+        
+        # Get label if successful
+        if result['shipment_pin'] and self.should_fetch_label():
+            self.get_and_save_label(result['shipment_pin'], data.get('reference', 'Unknown'))
+            
+        return result
+    
+    def create_shipment(self, data):
+        """
+        Create a shipment without fetching its label
+        
+        Args:
+            data: Shipment fields (same columns as the batch CSV)
+            
+        Returns:
+            Result dictionary with reference, status, http_status, shipment_pin and message;
+            status is IN_DOUBT when the request was sent but no response came back
+            
+        Raises:
+            Exception when the request could not be built or no connection was made
+            (nothing reached Purolator)
+        """
+        # Build SOAP request
+        soap_body = self.build_shipment_request_from_data(data)
+        
+        # Never replay a CreateShipment that may have reached the server
+        try:
+            response = self._post_soap(
+                self.shipment_url,
+                "http://purolator.com/pws/service/v2/CreateShipment",
+                soap_body
+            )
+        except requests.RequestException as e:
+            if request_never_sent(e):
+                raise
+            # Timed out or dropped after sending: Purolator may have created it
+            return self.in_doubt_result(data, e)
+        
+        return self.shipment_result(data, response.status_code, response.content)
+    
+    def shipment_result(self, data, http_status, response_body):
+        """
+        Turn a CreateShipment response into a result dictionary
+        
+        Args:
+            data: Shipment fields that were sent
+            http_status: HTTP status code of the response
+            response_body: Response XML (bytes or str)
+            
+        Returns:
+            Result dictionary with reference, status, http_status, shipment_pin and message
+        """
+        # Parse response once for both the PIN and any errors (errors precede the PIN)
+        parsed = parse_response(response_body, stop_at_pin=True)
+        shipment_pin = parsed.shipment_pin
+        
+        # Extract error message if failed
+        error_message = None
+        if http_status != 200 or not shipment_pin:
+            error_message = response_error_message(parsed)
+        
+        return {
+            'reference': data.get('reference', 'Unknown'),
+            'status': 'Success' if (http_status == 200 and shipment_pin) else 'Error',
+            'http_status': http_status,
+            'shipment_pin': shipment_pin,
+            'message': 'Shipment created successfully' if shipment_pin else (error_message or 'Failed to create shipment')
+        }
+        
+    def in_doubt_result(self, data, error):
+        """
+        Result for a CreateShipment that was sent but got no response
+        
+        Args:
+            data: Shipment fields that were sent
+            error: Exception the request failed with
+            
+        Returns:
+            Result dictionary with status IN_DOUBT and no PIN
+        """
+        return {
+            'reference': data.get('reference', 'Unknown'),
+            'status': IN_DOUBT,
+            'http_status': None,
+            'shipment_pin': None,
+            'message': f"No response from Purolator ({error}); check whether the shipment was created before retrying"
+        }
+        
+    def build_shipment_request_from_data(self, data):
+        """Build SOAP request from CSV data with proper parsing (UTF-8 bytes, XML-escaped)"""
+        return SHIPMENT_REQUEST.render(self.shipment_fields(data))
+    
+    def shipment_fields(self, data):
+        """
+        Parse and default the CSV fields used by the CreateShipment envelope
+        
+        Args:
+            data: Shipment fields (same columns as the batch CSV)
+            
+        Returns:
+            Dictionary with a value for every SHIPMENT_REQUEST placeholder
+        """
+        # Parsed addresses are memoized; the sender is the same on every row of a batch
+        sender = normalize_address(
+            data.get('sender_street', 'Main St'),
+            data.get('sender_city', 'Toronto') or 'Toronto',
+            data.get('sender_province', 'ON') or 'ON',
+            data.get('sender_postal', 'L5L5X5'),
+            'CA',
+            data.get('sender_phone', '')
+        )
+        receiver = normalize_address(
+            data.get('receiver_street', 'Elm St'),
+            data.get('receiver_city', 'Montreal') or 'Montreal',
+            data.get('receiver_province', 'QC') or 'QC',
+            data.get('receiver_postal', 'H4T1K5'),
+            data.get('receiver_country', 'CA') or 'CA',
+            data.get('receiver_phone', '')
+        )
+        
+        # Get default values with fallbacks
+        return {
+            'reference': data.get('reference', 'BatchShipment') or 'BatchShipment',
+            'sender_name': data.get('sender_name', 'Test Sender') or 'Test Sender',
+            'sender_street_num': sender.street_number,
+            'sender_street_name': sender.street_name,
+            'sender_city': sender.city,
+            'sender_province': sender.province,
+            'sender_postal': sender.postal_code,
+            'sender_phone_country': sender.phone.country_code,
+            'sender_phone_area': sender.phone.area_code,
+            'sender_phone_number': sender.phone.phone,
+            'receiver_name': data.get('receiver_name', 'Test Receiver') or 'Test Receiver',
+            'receiver_street_num': receiver.street_number,
+            'receiver_street_name': receiver.street_name,
+            'receiver_city': receiver.city,
+            'receiver_province': receiver.province,
+            'receiver_country': receiver.country,
+            'receiver_postal': receiver.postal_code,
+            'receiver_phone_country': receiver.phone.country_code,
+            'receiver_phone_area': receiver.phone.area_code,
+            'receiver_phone_number': receiver.phone.phone,
+            'service_id': data.get('service_id', 'PurolatorExpress') or 'PurolatorExpress',
+            'weight': data.get('weight', '2.5') or '2.5',
+            'length': data.get('length', '30') or '30',
+            'width': data.get('width', '20') or '20',
+            'height': data.get('height', '10') or '10',
+            'payment_type': data.get('payment_type', 'Sender') or 'Sender',
+            'account': self.account
+        }
+        
+    def extract_shipment_pin(self, response_text):
+        """Extract shipment PIN from response"""
+        parsed = parse_response(response_text, stop_at_pin=True)
+        if parsed.parse_error:
+            print(f"Error extracting PIN: {parsed.parse_error}")
+        return parsed.shipment_pin
+            
+    def get_and_save_label(self, shipment_pin, reference):
+        """Get and save shipping label - handles both base64 and URL methods"""
+        try:
+            filepath = self.label_store.get(shipment_pin)
+            if not filepath:
+                document = self.fetch_label_document(shipment_pin)
+                if not document:
+                    return None
+                filepath = self.write_label(shipment_pin, reference, document)
+            
+            if filepath:
+                self.email_label(filepath, shipment_pin, reference)
+            return filepath
+
+        except Exception as e:
+            print(f"Error getting label: {e}")
+            return None
+    
+    def reprint_label(self, shipment_pin, reference=None):
+        """
+        Label for an existing shipment, from the label store when it has a fresh copy
+        
+        Args:
+            shipment_pin: Shipment PIN
+            reference: Reference for the filename if the label has to be downloaded
+                (default: the reference it was last saved under, or the PIN)
+            
+        Returns:
+            Tuple of (label path or None, served_from_cache)
+        """
+        filepath = self.label_store.get(shipment_pin)
+        if filepath:
+            return (filepath, True)
+        
+        document = self.fetch_label_document(shipment_pin)
+        if not document:
+            return (None, False)
+        
+        reference = reference or self.label_store.reference(shipment_pin) or shipment_pin
+        return (self.write_label(shipment_pin, reference, document), False)
+    
+    def fetch_label_document(self, shipment_pin):
+        """
+        Request the bill of lading for a shipment from the documents service
+        
+        Args:
+            shipment_pin: Shipment PIN
+            
+        Returns:
+            Dictionary with 'data' (base64 PDF) or 'url' (download link), or None
+        """
+        return self.fetch_label_documents([shipment_pin]).get(shipment_pin)
+    
+    def fetch_label_documents(self, shipment_pins):
+        """
+        Request the bills of lading for several shipments in one GetDocuments call
+        
+        Args:
+            shipment_pins: Shipment PINs (at most LABEL_BATCH_SIZE per call is recommended)
+            
+        Returns:
+            Dictionary of {pin: {'data': base64 PDF} or {'url': download link}};
+            PINs without a document are left out
+        """
+        pins = list(dict.fromkeys(pin for pin in shipment_pins if pin))
+        if not pins:
+            return {}
+        
+        response = self._post_soap(
+            self.documents_url,
+            "http://purolator.com/pws/service/v1/GetDocuments",
+            self.build_documents_request(pins),
+            retry_server_errors=True
+        )
+        
+        if response.status_code != 200:
+            return {}
+        
+        return self.parse_label_documents(response.content, pins)
+    
+    def build_documents_request(self, shipment_pins):
+        """Build a GetDocuments SOAP request for the bills of lading of several PINs"""
+        return render_documents_request(shipment_pins)
+    
+    def parse_label_documents(self, response_body, shipment_pins):
+        """
+        Match the Document elements of a GetDocuments response to their PINs
+        
+        Args:
+            response_body: GetDocuments response XML (bytes or str)
+            shipment_pins: PINs that were requested
+            
+        Returns:
+            Dictionary of {pin: {'data': base64 PDF} or {'url': download link}}
+        """
+        parsed = parse_response(response_body, document_pins=shipment_pins)
+        if parsed.parse_error:
+            raise ValueError(f"Invalid GetDocuments response: {parsed.parse_error}")
+        return parsed.documents
+    
+    def get_and_save_labels(self, shipments, batch_size=None):
+        """
+        Fetch and save labels for many shipments with batched GetDocuments calls
+        
+        Args:
+            shipments: List of (shipment_pin, reference) tuples
+            batch_size: PINs per GetDocuments call (default: LABEL_BATCH_SIZE)
+            
+        Returns:
+            Dictionary of {pin: saved label path} for the labels that were saved
+        """
+        batch_size = max(1, batch_size or LABEL_BATCH_SIZE)
+        references = dict(shipments)
+        
+        # Labels already on disk skip the GetDocuments call
+        saved = self.label_store.get_many(references)
+        for pin, filepath in saved.items():
+            self.email_label(filepath, pin, references[pin])
+        pins = [pin for pin in references if pin not in saved]
+        
+        for start in range(0, len(pins), batch_size):
+            chunk = pins[start:start + batch_size]
+            try:
+                documents = self.fetch_label_documents(chunk)
+            except Exception as e:
+                print(f"Error getting labels: {e}")
+                continue
+            
+            for pin, document in documents.items():
+                reference = references.get(pin, 'Unknown')
+                try:
+                    filepath = self.write_label(pin, reference, document)
+                    if filepath:
+                        saved[pin] = filepath
+                        self.email_label(filepath, pin, reference)
+                except Exception as e:
+                    print(f"Error saving label for {pin}: {e}")
+        
+        return saved
+    
+    def write_label(self, shipment_pin, reference, document):
+        """
+        Save a label PDF in the label store under labels/
+        
+        Args:
+            shipment_pin: Shipment PIN
+            reference: Shipment reference (used in the filename)
+            document: Result of fetch_label_document
+            
+        Returns:
+            Path of the saved PDF, or None if it could not be downloaded
+        """
+        # Save PDF from base64 data, decoded chunk by chunk
+        if document.get('data'):
+            return self.label_store.put_base64(shipment_pin, reference, document['data'])
+        
+        # Download PDF from URL without buffering the whole body
+        if document.get('url'):
+            with self.session.get(document['url'], timeout=30, stream=True) as label_response:
+                if label_response.status_code == 200:
+                    return self.label_store.put_chunks(
+                        shipment_pin, reference, label_response.iter_content(LABEL_CHUNK_SIZE)
+                    )
+        
+        return None
+    
+    def label_path(self, shipment_pin, reference):
+        """Path of the saved label PDF for a shipment"""
+        return self.label_store.label_path(shipment_pin, reference)
+    
+    def email_label(self, filepath, shipment_pin, reference):
+        """
+        Queue a saved label for the next digest email if email is configured
+        
+        Returns immediately; the email sender's background thread batches
+        queued labels and sends them over pooled SMTP sessions.
+        
+        Returns:
+            True if the label was queued
+        """
+        if self.email_sender and self.email_sender.is_configured:
+            return self.email_sender.queue_label_email(
+                str(filepath), 
+                shipment_pin, 
+                reference
+            )
+        return False
+            
+    def test_connection(self):
+        """
+        Check that the shipping service endpoint is reachable
+        
+        Returns:
+            Tuple of (is_ok, message)
+        """
+        try:
+            response = self.session.get(self.shipment_url, timeout=10)
+            if response.status_code == 200:
+                return (True, "API connection successful!")
+            return (False, f"API responded with status: {response.status_code}")
+        except Exception as e:
+            return (False, f"Connection failed: {str(e)}")
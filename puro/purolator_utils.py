@@ -3,9 +3,11 @@ Utility functions for Purolator batch shipping
 Handles parsing and formatting of addresses, phone numbers, and other data
 """
 
-import re
 from typing import Dict, Optional, Tuple
 
+# Parsing lives in normalization (precompiled patterns, memoized results)
+from normalization import is_valid_postal, normalize_phone, normalize_postal, normalize_street
+
 
 def parse_phone_number(phone_str: str) -> Dict[str, str]:
     """
@@ -18,30 +20,7 @@ def parse_phone_number(phone_str: str) -> Dict[str, str]:
     Returns:
         Dictionary with CountryCode, AreaCode, and Phone
     """
-    if not phone_str:
-        return {"CountryCode": "1", "AreaCode": "416", "Phone": "1234567"}
-    
-    # Remove all non-digit characters
-    digits = re.sub(r'\D', '', phone_str)
-    
-    # If it's 10 digits, assume North American format
-    if len(digits) == 10:
-        area_code = digits[0:3]
-        phone = digits[3:]
-        return {"CountryCode": "1", "AreaCode": area_code, "Phone": phone}
-    
-    # If it's 11 digits and starts with 1, remove the leading 1
-    elif len(digits) == 11 and digits[0] == '1':
-        area_code = digits[1:4]
-        phone = digits[4:]
-        return {"CountryCode": "1", "AreaCode": area_code, "Phone": phone}
-    
-    # If it's 7 digits, assume it's just the phone part (use default area code)
-    elif len(digits) == 7:
-        return {"CountryCode": "1", "AreaCode": "416", "Phone": digits}
-    
-    # Default fallback
-    return {"CountryCode": "1", "AreaCode": "416", "Phone": "1234567"}
+    return normalize_phone(phone_str).as_dict()
 
 
 def parse_street_address(street_str: str) -> Tuple[str, str]:
@@ -55,31 +34,7 @@ def parse_street_address(street_str: str) -> Tuple[str, str]:
     Returns:
         Tuple of (StreetNumber, StreetName)
     """
-    if not street_str:
-        return ("123", "Main St")
-    
-    street_str = street_str.strip()
-    
-    # Try to match number at the start
-    match = re.match(r'^(\d+[A-Za-z]?)(?:\s*[-–]\s*\d+[A-Za-z]?)?\s+(.+)$', street_str)
-    if match:
-        street_number = match.group(1)
-        street_name = match.group(2).strip()
-        return (street_number, street_name)
-    
-    # If no number found, assume it's all street name
-    # Extract any leading numbers as street number
-    match = re.match(r'^(\d+)\s*(.+)$', street_str)
-    if match:
-        return (match.group(1), match.group(2).strip())
-    
-    # Fallback: assume first word is number, rest is street name
-    parts = street_str.split(None, 1)
-    if len(parts) == 2:
-        return (parts[0], parts[1])
-    
-    # Last resort: use as street name with default number
-    return ("123", street_str)
+    return normalize_street(street_str)
 
 
 def validate_postal_code(postal_code: str, country: str = "CA") -> bool:
@@ -93,19 +48,7 @@ def validate_postal_code(postal_code: str, country: str = "CA") -> bool:
     Returns:
         True if format looks valid
     """
-    if not postal_code:
-        return False
-    
-    postal_code = postal_code.replace(" ", "").upper()
-    
-    if country == "CA":
-        # Canadian postal code: A1A1A1
-        return bool(re.match(r'^[A-Z]\d[A-Z]\d[A-Z]\d$', postal_code))
-    elif country == "US":
-        # US ZIP code: 12345 or 12345-6789
-        return bool(re.match(r'^\d{5}(-\d{4})?$', postal_code))
-    
-    return True  # For other countries, just check it's not empty
+    return is_valid_postal(postal_code, country)
 
 
 def format_postal_code(postal_code: str) -> str:
@@ -118,17 +61,7 @@ def format_postal_code(postal_code: str) -> str:
     Returns:
         Formatted postal code
     """
-    if not postal_code:
-        return ""
-    
-    # Remove spaces and convert to uppercase
-    formatted = postal_code.replace(" ", "").upper()
-    
-    # For Canadian postal codes, add space: A1A1A1 -> A1A 1A1
-    if len(formatted) == 6 and re.match(r'^[A-Z]\d[A-Z]\d[A-Z]\d$', formatted):
-        return f"{formatted[0:3]} {formatted[3:6]}"
-    
-    return formatted
+    return normalize_postal(postal_code)
 
 
 def extract_error_message(response_text: str) -> str:
@@ -141,45 +74,64 @@ def extract_error_message(response_text: str) -> str:
     Returns:
         Error message string
     """
-    try:
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(response_text)
-        
-        # Look for common error elements
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            'v2': 'http://purolator.com/pws/datatypes/v2'
-        }
-        
-        # Check for SOAP fault
-        fault = root.find('.//soap:Fault', namespaces)
-        if fault is not None:
-            fault_string = fault.find('soap:faultstring', namespaces)
-            if fault_string is not None:
-                return fault_string.text or "Unknown error"
-        
-        # Check for error messages in response
-        error = root.find('.//v2:Error', namespaces)
-        if error is not None:
-            description = error.find('v2:Description', namespaces)
-            if description is not None:
-                return description.text or "Unknown error"
-        
-        # Check for response errors
-        errors = root.findall('.//v2:Error', namespaces)
-        if errors:
-            error_messages = []
-            for err in errors:
-                code = err.find('v2:Code', namespaces)
-                desc = err.find('v2:Description', namespaces)
-                if code is not None and desc is not None:
-                    error_messages.append(f"{code.text}: {desc.text}")
-            return "; ".join(error_messages)
-        
-    except Exception as e:
-        return f"Error parsing response: {str(e)}"
+    from soap_responses import parse_response
+    return response_error_message(parse_response(response_text))
+
+
+def response_error_message(parsed) -> str:
+    """
+    Error message for an already parsed Purolator SOAP response.
     
-    return "Unknown error occurred"
+    Args:
+        parsed: SoapResponse from soap_responses.parse_response
+        
+    Returns:
+        Error message string
+    """
+    if parsed.parse_error:
+        return f"Error parsing response: {parsed.parse_error}"
+    return parsed.error_message or "Unknown error occurred"
+
+
+# Shipment validation rules, shared by validate_shipment_data and the
+# column-at-a-time CSV validator (csv_validation.py)
+REQUIRED_SHIPMENT_FIELDS = [
+    'receiver_name', 'receiver_street', 'receiver_city', 
+    'receiver_province', 'receiver_postal', 'receiver_country'
+]
+DIMENSION_FIELDS = ['length', 'width', 'height']
+MAX_WEIGHT_KG = 75
+
+
+def postal_code_error(postal_code: str, country: str) -> Optional[str]:
+    """Error message if the receiver postal code does not fit its country, else None"""
+    if not validate_postal_code(postal_code, country):
+        return f"Invalid postal code format: {postal_code}"
+    return None
+
+
+def weight_error(weight) -> Optional[str]:
+    """Error message for an invalid package weight (kg), else None"""
+    try:
+        value = float(weight)
+    except (TypeError, ValueError):
+        return f"Invalid weight value: {weight}"
+    if value <= 0:
+        return "Weight must be greater than 0"
+    if value > MAX_WEIGHT_KG:
+        return f"Weight exceeds maximum ({MAX_WEIGHT_KG} kg)"
+    return None
+
+
+def dimension_error(dim: str, value) -> Optional[str]:
+    """Error message for an invalid package dimension (cm), else None"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return f"Invalid {dim} value: {value}"
+    if number <= 0:
+        return f"{dim.capitalize()} must be greater than 0"
+    return None
 
 
 def validate_shipment_data(data: Dict) -> Tuple[bool, Optional[str]]:
@@ -192,39 +144,24 @@ def validate_shipment_data(data: Dict) -> Tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_valid, error_message)
     """
-    required_fields = [
-        'receiver_name', 'receiver_street', 'receiver_city', 
-        'receiver_province', 'receiver_postal', 'receiver_country'
-    ]
-    
-    for field in required_fields:
+    for field in REQUIRED_SHIPMENT_FIELDS:
         if not data.get(field):
             return (False, f"Missing required field: {field}")
     
     # Validate postal code
-    postal_code = data.get('receiver_postal', '')
-    country = data.get('receiver_country', 'CA')
-    if not validate_postal_code(postal_code, country):
-        return (False, f"Invalid postal code format: {postal_code}")
+    error = postal_code_error(data.get('receiver_postal', ''), data.get('receiver_country', 'CA'))
+    if error:
+        return (False, error)
     
     # Validate weight
-    try:
-        weight = float(data.get('weight', 0))
-        if weight <= 0:
-            return (False, "Weight must be greater than 0")
-        if weight > 75:
-            return (False, "Weight exceeds maximum (75 kg)")
-    except ValueError:
-        return (False, f"Invalid weight value: {data.get('weight')}")
+    error = weight_error(data.get('weight', 0))
+    if error:
+        return (False, error)
     
     # Validate dimensions
-    for dim in ['length', 'width', 'height']:
-        try:
-            value = float(data.get(dim, 0))
-            if value <= 0:
-                return (False, f"{dim.capitalize()} must be greater than 0")
-        except ValueError:
-            return (False, f"Invalid {dim} value: {data.get(dim)}")
+    for dim in DIMENSION_FIELDS:
+        error = dimension_error(dim, data.get(dim, 0))
+        if error:
+            return (False, error)
     
     return (True, None)
-
@@ -0,0 +1,259 @@
+"""
+Shipment Pipeline
+Overlaps shipment creation with label retrieval for batch runs
+
+Each shipment moves through four stages connected by bounded queues:
+
+    create shipment -> fetch label document -> write PDF -> email label
+
+Every stage has its own worker threads, so the label for shipment N is being
+downloaded while shipment N+1 is being created, and a slow SMTP server never
+holds up the SOAP calls. The bounded queues keep a fast stage from running
+arbitrarily far ahead of a slow one.
+
+The fetch stage groups up to fetch_batch_size PINs into a single GetDocuments
+call, waiting at most fetch_linger seconds for a batch to fill.
+"""
+
+import os
+import time
+import queue
+import threading
+from typing import Dict, List, Callable, Optional
+
+# Marks the end of the work for one downstream worker
+_DONE = object()
+
+
+class _Job:
+    """One shipment travelling through the pipeline"""
+    
+    def __init__(self, index: int, data: Dict):
+        self.index = index
+        self.data = data
+        self.reference = data.get('reference', f'Row {index + 1}')
+        self.result: Optional[Dict] = None
+        self.document: Optional[Dict] = None
+        self.label_path: Optional[str] = None
+
+
+class ShipmentPipeline:
+    """Staged create -> fetch -> write -> email pipeline over a PurolatorClient"""
+    
+    def __init__(self, client, create_workers: int = None, fetch_workers: int = 2,
+                 write_workers: int = 1, email_workers: int = 1, queue_size: int = 32,
+                 fetch_batch_size: int = None, fetch_linger: float = 0.2):
+        """
+        Configure the pipeline
+        
+        Args:
+            client: PurolatorClient (or BatchShippingApp) used for every stage
+            create_workers: Concurrent CreateShipment calls
+                (default: SHIPPING_MAX_IN_FLIGHT from environment, or 1)
+            fetch_workers: Concurrent GetDocuments calls
+            write_workers: Threads decoding / downloading and writing PDFs
+            email_workers: Threads queueing label emails for the digest sender
+            queue_size: Maximum jobs waiting between two stages
+            fetch_batch_size: PINs per GetDocuments call
+                (default: PUROLATOR_LABEL_BATCH_SIZE from environment, or 20)
+            fetch_linger: Seconds the fetch stage waits for more PINs before
+                sending a partial batch
+        """
+        if create_workers is None:
+            create_workers = int(os.getenv('SHIPPING_MAX_IN_FLIGHT', '1'))
+        if fetch_batch_size is None:
+            fetch_batch_size = int(os.getenv('PUROLATOR_LABEL_BATCH_SIZE', '20'))
+        
+        self.client = client
+        self.create_workers = max(1, create_workers)
+        self.fetch_workers = max(1, fetch_workers)
+        self.write_workers = max(1, write_workers)
+        self.email_workers = max(1, email_workers)
+        self.queue_size = max(1, queue_size)
+        self.fetch_batch_size = max(1, fetch_batch_size)
+        self.fetch_linger = max(0.0, fetch_linger)
+    
+    def run(self, shipments: List[Dict], on_result: Callable[[int, Dict], None] = None,
+            should_stop: Callable[[], bool] = None,
+            on_started: Callable[[int], None] = None,
+            on_created: Callable[[int, Dict], None] = None) -> List[Dict]:
+        """
+        Process shipments through all stages
+        
+        Args:
+            shipments: Shipment dictionaries (batch CSV rows)
+            on_result: Called with (index, result) as soon as a shipment has
+                finished every stage that applies to it (from a worker thread)
+            should_stop: Polled before each shipment is created; once it
+                returns True no further shipments are started (shipments
+                already created still get their labels)
+            on_started: Called with index just before CreateShipment is sent
+                (e.g. to journal the request ahead of time)
+            on_created: Called with (index, result) as soon as CreateShipment
+                has answered, before the label stages
+        
+        Returns:
+            Results for the shipments that were started, in input order
+        """
+        fetch_labels = self.client.should_fetch_label()
+        email_sender = getattr(self.client, 'email_sender', None)
+        send_email = bool(email_sender and email_sender.is_configured)
+        
+        finished: Dict[int, Dict] = {}
+        finished_lock = threading.Lock()
+        
+        def finish(job: _Job):
+            if job.result is None:
+                # Stopped before it was created
+                return
+            with finished_lock:
+                finished[job.index] = job.result
+            if on_result:
+                on_result(job.index, job.result)
+        
+        def create(job: _Job):
+            if should_stop and should_stop():
+                return None
+            if on_started:
+                on_started(job.index)
+            try:
+                # Unanswered requests come back as IN_DOUBT results, not exceptions
+                job.result = self.client.create_shipment(job.data)
+            except Exception as e:
+                # Nothing reached Purolator (no connection, bad envelope), so a re-run may resend it
+                job.result = {
+                    'reference': job.reference,
+                    'status': 'Error',
+                    'message': str(e)
+                }
+            if on_created:
+                on_created(job.index, job.result)
+            if job.result.get('status') != 'Success':
+                return None
+            if fetch_labels and job.result.get('shipment_pin'):
+                return job
+            return None
+        
+        def fetch(jobs: List[_Job]):
+            # One GetDocuments call for the whole batch, then hand each job its document
+            documents = self.client.fetch_label_documents(
+                [job.result['shipment_pin'] for job in jobs]
+            )
+            for job in jobs:
+                job.document = documents.get(job.result['shipment_pin'])
+            return [job for job in jobs if job.document]
+        
+        def write(job: _Job):
+            job.label_path = self.client.write_label(
+                job.result['shipment_pin'], job.reference, job.document
+            )
+            # The decoded PDF is on disk; don't keep the base64 copy alive
+            job.document = None
+            return job if (job.label_path and send_email) else None
+        
+        def email(job: _Job):
+            self.client.email_label(job.label_path, job.result['shipment_pin'], job.reference)
+            return None
+        
+        def one_at_a_time(func):
+            return lambda jobs: [job for job in jobs if func(job)]
+        
+        # (name, function over a list of jobs, workers, batch size, linger)
+        stages = [
+            ('create', one_at_a_time(create), self.create_workers, 1, 0.0),
+            ('fetch', fetch, self.fetch_workers, self.fetch_batch_size, self.fetch_linger),
+            ('write', one_at_a_time(write), self.write_workers, 1, 0.0),
+            ('email', one_at_a_time(email), self.email_workers, 1, 0.0),
+        ]
+        
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        threads = []
+        for position, (name, func, workers, batch_size, linger) in enumerate(stages):
+            in_q = queues[position]
+            out_q = queues[position + 1] if position + 1 < len(stages) else None
+            next_workers = stages[position + 1][2] if out_q else 0
+            remaining = [workers]
+            remaining_lock = threading.Lock()
+            
+            for n in range(workers):
+                thread = threading.Thread(
+                    target=self._stage_worker,
+                    args=(name, func, batch_size, linger, in_q, out_q, next_workers,
+                          remaining, remaining_lock, finish),
+                    name=f'pipeline-{name}-{n}',
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+        
+        # Feed the first stage; blocks while it is full
+        for index, data in enumerate(shipments):
+            if should_stop and should_stop():
+                break
+            queues[0].put(_Job(index, data))
+        for _ in range(self.create_workers):
+            queues[0].put(_DONE)
+        
+        for thread in threads:
+            thread.join()
+        
+        if send_email:
+            # Send the last partial digest now instead of after its window
+            email_sender.flush(timeout=0)
+        
+        return [finished[index] for index in sorted(finished)]
+    
+    @staticmethod
+    def _stage_worker(name: str, func: Callable, batch_size: int, linger: float,
+                      in_q: queue.Queue, out_q: Optional[queue.Queue], next_workers: int,
+                      remaining: List[int], remaining_lock: threading.Lock,
+                      finish: Callable):
+        """
+        Run one stage until it receives its end marker
+        
+        func takes a list of up to batch_size jobs and returns the ones to hand
+        to the next stage; every other job is complete and is reported through
+        finish.
+        """
+        done = False
+        while not done:
+            job = in_q.get()
+            if job is _DONE:
+                break
+            
+            # Collect a batch: whatever arrives within the linger window
+            jobs = [job]
+            deadline = time.monotonic() + linger
+            while len(jobs) < batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    job = in_q.get(timeout=timeout) if timeout > 0 else in_q.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _DONE:
+                    done = True
+                    break
+                jobs.append(job)
+            
+            try:
+                forward = func(jobs)
+            except Exception as e:
+                # Label problems never fail a shipment that was created
+                references = ', '.join(str(job.reference) for job in jobs)
+                print(f"Error in {name} stage for {references}: {e}")
+                forward = []
+            
+            forwarded = {id(job) for job in forward}
+            for job in jobs:
+                if out_q is not None and id(job) in forwarded:
+                    out_q.put(job)
+                else:
+                    finish(job)
+        
+        # The last worker out tells every downstream worker to stop
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and out_q is not None:
+            for _ in range(next_workers):
+                out_q.put(_DONE)
@@ -1,21 +1,35 @@
 """
 Shipping API Server for Node.js Integration
 Accepts JSON commands via stdin and returns JSON responses via stdout
+
+Modes:
+    python shipping_api_server.py                     one command per process
+    python shipping_api_server.py --serve             long-lived, newline-delimited JSON on stdin/stdout
+    python shipping_api_server.py --socket PATH       long-lived, newline-delimited JSON on a Unix socket
+
+Batches: send a JSON array of commands, or {"action": "batch", "commands": [...]},
+to get every response back from a single invocation.
+
+Add --workers N to either long-lived mode to dispatch commands across N
+pre-warmed worker processes (see shipping_worker_pool.py).
 """
 
 import sys
 import json
 import os
-from typing import Dict, Any
+import argparse
+import threading
+import socketserver
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Add current directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
+# Only the sqlite-backed lookup stack is imported here; the Purolator SOAP
+# client is loaded on the first shipping action (see ShippingIntegration)
 from address_book_api import get_api
-from shipping_integration import get_integration
-from batch_shipping_app import BatchShippingApp
 
 # Load environment
 load_dotenv()
@@ -33,7 +47,16 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
     action = command.get('action')
     
     try:
-        if action == 'search_customers':
+        if action == 'batch':
+            commands = command.get('commands')
+            if not isinstance(commands, list):
+                return {'status': 'error', 'message': 'commands array required'}
+            return {
+                'status': 'success',
+                'data': handle_batch(commands)
+            }
+        
+        elif action == 'search_customers':
             api = get_api()
             search_term = command.get('search_term', '')
             results = api.search_customers(search_term)
@@ -104,7 +127,8 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
                 return {'status': 'error', 'message': 'location_id required'}
             
             package_data = command.get('package_data', {})
-            result = api.ship_to_location(location_id, package_data)
+            result = api.ship_to_location(location_id, package_data,
+                                          command.get('idempotency_key'))
             return result
         
         elif action == 'ship_to_customer':
@@ -115,7 +139,8 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
             
             location_id = command.get('location_id')  # Optional
             package_data = command.get('package_data', {})
-            result = api.ship_to_customer(customer_id, package_data, location_id)
+            result = api.ship_to_customer(customer_id, package_data, location_id,
+                                          command.get('idempotency_key'))
             return result
         
         elif action == 'batch_ship_orders':
@@ -124,7 +149,11 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
             if not order_ids:
                 return {'status': 'error', 'message': 'order_ids required'}
             
-            results = api.batch_ship_orders(order_ids)
+            results = api.batch_ship_orders(
+                order_ids,
+                command.get('max_in_flight'),
+                command.get('use_async')
+            )
             return {
                 'status': 'success',
                 'data': results
@@ -158,18 +187,43 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
             if not shipment_data:
                 return {'status': 'error', 'message': 'shipment_data required'}
             
-            # Initialize shipping app
-            app = BatchShippingApp.__new__(BatchShippingApp)
-            app.username = os.getenv("PUROLATOR_API_USERNAME")
-            app.password = os.getenv("PUROLATOR_API_PASSWORD")
-            app.account = os.getenv("PUROLATOR_API_ACCOUNT")
-            app.shipment_url = "https://webservices.purolator.com/EWS/V2/Shipping/ShippingService.asmx"
-            app.documents_url = "https://webservices.purolator.com/EWS/V1/ShippingDocuments/ShippingDocumentsService.asmx"
+            # With an idempotency key, retries return the first shipment
+            idempotency_key = command.get('idempotency_key')
+            if idempotency_key:
+                return get_api().integration.create_shipment_once(idempotency_key, shipment_data)
             
-            # Create shipment
+            # Create shipment with the shared Purolator client
+            app = get_api().integration.shipping_app
             result = app.create_shipment_from_data(shipment_data)
             return result
         
+        elif action == 'reprint_label':
+            # Label for an existing shipment, served from the label store when fresh
+            shipment_pin = command.get('pin') or command.get('shipment_pin')
+            if not shipment_pin:
+                return {'status': 'error', 'message': 'pin required'}
+            
+            app = get_api().integration.shipping_app
+            label_file, cached = app.reprint_label(shipment_pin, command.get('reference'))
+            if not label_file:
+                return {'status': 'error', 'message': f'No label available for {shipment_pin}'}
+            return {
+                'status': 'success',
+                'data': {
+                    'shipment_pin': shipment_pin,
+                    'label_file': label_file,
+                    'cached': cached
+                }
+            }
+        
+        elif action == 'connection_stats':
+            # Keep-alive reuse for this process's Purolator client
+            app = get_api().integration.shipping_app
+            return {
+                'status': 'success',
+                'data': app.connection_stats()
+            }
+        
         else:
             return {
                 'status': 'error',
@@ -184,8 +238,230 @@ def handle_command(command: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
-def main():
-    """Main entry point - read JSON from stdin, process, write JSON to stdout"""
+def handle_batch(commands: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Handle several commands in one invocation
+    
+    Args:
+        commands: List of command dictionaries
+        
+    Returns:
+        List of response dictionaries, in the same order as the commands
+    """
+    responses = []
+    for command in commands:
+        if not isinstance(command, dict):
+            responses.append({'status': 'error', 'message': 'Command must be a JSON object'})
+        elif command.get('action') == 'batch':
+            responses.append({'status': 'error', 'message': 'Nested batch commands are not supported'})
+        else:
+            responses.append(handle_command(command))
+    return responses
+
+
+def parse_request(line: str) -> Tuple[Any, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Parse one newline-delimited JSON request
+    
+    Args:
+        line: JSON object with 'action', parameters and an optional 'id'
+        
+    Returns:
+        Tuple of (request_id, command, error_response); error_response is None on success
+    """
+    try:
+        command = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, None, {
+            'id': None,
+            'status': 'error',
+            'message': f'Invalid JSON: {str(e)}'
+        }
+    
+    if not isinstance(command, dict):
+        return None, None, {
+            'id': None,
+            'status': 'error',
+            'message': 'Command must be a JSON object'
+        }
+    
+    request_id = command.pop('id', None)
+    return request_id, command, None
+
+
+def handle_line(line: str) -> Dict[str, Any]:
+    """
+    Handle one newline-delimited JSON request in serve mode
+    
+    Args:
+        line: JSON object with 'action', parameters and an optional 'id'
+        
+    Returns:
+        Response dictionary with the request 'id' echoed back
+    """
+    request_id, command, error = parse_request(line)
+    if error:
+        return error
+    
+    response = handle_command(command)
+    return {'id': request_id, **response}
+
+
+def warm_up():
+    """Initialize the API (database, shipping integration, Purolator client) before serving requests"""
+    try:
+        # Long-lived processes pay for the SOAP stack once, up front
+        get_api().integration.shipping_app
+    except Exception as e:
+        print(f"Warning: Could not pre-initialize API: {e}", file=sys.stderr)
+
+
+def start_worker_pool(num_workers: int):
+    """
+    Start a pool of pre-warmed worker processes
+    
+    Args:
+        num_workers: Number of worker processes
+        
+    Returns:
+        ShippingWorkerPool instance
+    """
+    from shipping_worker_pool import ShippingWorkerPool
+    return ShippingWorkerPool(handle_command, warm_up, num_workers)
+
+
+def pool_status_response(pool) -> Dict[str, Any]:
+    """Build the response for the supervisor-level 'pool_status' action"""
+    return {
+        'status': 'success',
+        'data': pool.stats()
+    }
+
+
+def serve_stdio(num_workers: int = 0):
+    """
+    Keep one process alive, reading one JSON command per line from stdin
+    and writing one JSON response per line to stdout
+    
+    Args:
+        num_workers: Number of worker processes to dispatch to (0 = handle in this process)
+    """
+    out = sys.stdout
+    # Anything printed by the shipping stack goes to stderr so it can't corrupt the protocol
+    sys.stdout = sys.stderr
+    
+    write_lock = threading.Lock()
+    
+    def write_response(response: Dict[str, Any]):
+        with write_lock:
+            out.write(json.dumps(response, default=str) + '\n')
+            out.flush()
+    
+    if num_workers <= 0:
+        warm_up()
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                write_response(handle_line(line))
+        return
+    
+    # Responses arrive out of order from the workers; clients match them by id
+    pool = start_worker_pool(num_workers)
+    outstanding = [0]
+    idle = threading.Condition()
+    
+    def on_response(request_id):
+        def deliver(response):
+            write_response({'id': request_id, **response})
+            with idle:
+                outstanding[0] -= 1
+                idle.notify_all()
+        return deliver
+    
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            
+            request_id, command, error = parse_request(line)
+            if error:
+                write_response(error)
+            elif command.get('action') == 'pool_status':
+                write_response({'id': request_id, **pool_status_response(pool)})
+            else:
+                with idle:
+                    outstanding[0] += 1
+                pool.submit(command, on_response(request_id))
+        
+        # stdin closed - let in-flight commands finish before exiting
+        with idle:
+            idle.wait_for(lambda: outstanding[0] == 0)
+    finally:
+        pool.close()
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """Reads newline-delimited JSON commands from one socket client"""
+    
+    def handle(self):
+        pool = self.server.worker_pool
+        
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8').strip()
+            if not line:
+                continue
+            
+            if pool is None:
+                response = handle_line(line)
+            else:
+                request_id, command, error = parse_request(line)
+                if error:
+                    response = error
+                elif command.get('action') == 'pool_status':
+                    response = {'id': request_id, **pool_status_response(pool)}
+                else:
+                    response = {'id': request_id, **pool.call(command)}
+            
+            self.wfile.write((json.dumps(response, default=str) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+def serve_socket(socket_path: str, num_workers: int = 0):
+    """
+    Keep one process alive, serving newline-delimited JSON commands on a Unix socket
+    
+    Args:
+        socket_path: Filesystem path of the Unix socket to listen on
+        num_workers: Number of worker processes to dispatch to (0 = handle in this process)
+    """
+    sys.stdout = sys.stderr
+    
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    
+    pool = None
+    if num_workers > 0:
+        pool = start_worker_pool(num_workers)
+    else:
+        warm_up()
+    
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _CommandHandler)
+    server.daemon_threads = True
+    server.worker_pool = pool
+    print(f"Shipping API listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if pool:
+            pool.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def run_once():
+    """Read a single JSON command from stdin, process, write JSON to stdout"""
     try:
         # Read JSON from stdin
         input_data = sys.stdin.read()
@@ -198,8 +474,11 @@ def main():
         
         command = json.loads(input_data)
         
-        # Process command
-        response = handle_command(command)
+        # Process command (a JSON array is handled as a batch of commands)
+        if isinstance(command, list):
+            response = handle_batch(command)
+        else:
+            response = handle_command(command)
         
         # Write JSON to stdout
         print(json.dumps(response))
@@ -217,6 +496,26 @@ def main():
         }))
 
 
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='Purolator shipping command server')
+    parser.add_argument('--serve', action='store_true',
+                        help='Stay alive and process newline-delimited JSON commands from stdin')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='Stay alive and process newline-delimited JSON commands on a Unix socket')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('SHIPPING_API_WORKERS', '0')),
+                        help='Number of pre-warmed worker processes for --serve/--socket (0 = single process)')
+    args = parser.parse_args()
+    
+    if args.socket:
+        serve_socket(args.socket, args.workers)
+    elif args.serve:
+        serve_stdio(args.workers)
+    else:
+        run_once()
+
+
 if __name__ == '__main__':
     main()
 
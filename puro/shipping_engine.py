@@ -0,0 +1,210 @@
+"""
+Shipping Engine
+Headless CSV batch shipping: validate, journal, ship and save results
+
+The batch machinery behind BatchShippingApp, with no display dependency.
+Progress is reported through an on_event(event, data) callback, so the same
+engine drives the desktop app, the batch.py command line (JSON events on
+stdout) or any other front end.
+
+Events:
+    loaded    rows, valid, errors (validation messages for skipped rows)
+    started   total, already_done, in_doubt (rows done by an earlier run)
+    result    done, total, result (one per row as it finishes)
+    finished  processed, succeeded, failed, in_doubt, stopped, results_file
+"""
+
+import csv
+import datetime
+import itertools
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+
+from csv_validation import load_shipments_csv
+from shipment_pipeline import ShipmentPipeline
+from batch_journal import BatchJournal
+
+RESULT_FIELDS = ['reference', 'status', 'http_status', 'shipment_pin', 'message']
+
+
+def summarize(results: List[Dict]) -> Dict[str, int]:
+    """
+    Count batch results by outcome
+    
+    Args:
+        results: Result dictionaries
+    
+    Returns:
+        Dictionary with processed, succeeded, failed and in_doubt counts
+    """
+    succeeded = sum(1 for result in results if result.get('status') == 'Success')
+    in_doubt = sum(1 for result in results if result.get('status') == 'In Doubt')
+    return {
+        'processed': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded - in_doubt,
+        'in_doubt': in_doubt
+    }
+
+
+class ShippingEngine:
+    """Runs CSV shipment batches through a PurolatorClient"""
+    
+    def __init__(self, client=None, max_in_flight: int = None,
+                 on_event: Callable[[str, Dict], None] = None,
+                 journal_dir: Union[str, Path] = None, results_dir: Union[str, Path] = None):
+        """
+        Args:
+            client: PurolatorClient (or subclass) used for every shipment
+                (default: a new PurolatorClient)
+            max_in_flight: Concurrent CreateShipment calls
+                (default: SHIPPING_MAX_IN_FLIGHT from environment, or 1)
+            on_event: Called with (event, data) as the batch progresses;
+                may be called from worker threads
+            journal_dir: Batch journal directory (default: BATCH_JOURNAL_DIR)
+            results_dir: Where results CSVs are saved (default: current directory)
+        """
+        if client is None:
+            from purolator_client import PurolatorClient
+            client = PurolatorClient()
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.on_event = on_event
+        self.journal_dir = journal_dir
+        self.results_dir = Path(results_dir) if results_dir else Path('.')
+        self._stop = threading.Event()
+    
+    def _emit(self, event: str, **data):
+        if self.on_event:
+            self.on_event(event, data)
+    
+    def stop(self):
+        """Stop sending new shipments; rows already in flight finish"""
+        self._stop.set()
+    
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+    
+    def load_csv(self, csv_path: Union[str, Path]) -> List[Dict]:
+        """
+        Load and validate a batch CSV (invalid rows are reported and skipped)
+        
+        Args:
+            csv_path: CSV in the batch template format
+        
+        Returns:
+            Valid rows, in file order
+        """
+        shipments, report = load_shipments_csv(csv_path)
+        self._emit('loaded', csv=str(csv_path), rows=report.row_count,
+                   valid=len(shipments), errors=report.messages())
+        return shipments
+    
+    def run(self, csv_path: Union[str, Path], resume: bool = True,
+            retry_in_doubt: bool = False, save_results: bool = True) -> List[Dict]:
+        """
+        Ship every valid row of a CSV
+        
+        Args:
+            csv_path: CSV in the batch template format
+            resume: Continue this CSV's journal (False starts over)
+            retry_in_doubt: Re-send rows interrupted mid-request by an
+                earlier run (they may already exist at Purolator)
+            save_results: Write a batch_results_*.csv
+        
+        Returns:
+            Result dictionaries in CSV order
+        """
+        self._stop.clear()
+        shipments = self.load_csv(csv_path)
+        
+        # Every row is journaled before it is sent, so a re-run picks up where this one stops
+        with BatchJournal.for_csv(csv_path, shipments, directory=self.journal_dir, resume=resume) as journal:
+            results = self.run_journaled(shipments, journal, retry_in_doubt)
+        
+        results_file = self.save_results(results) if (save_results and results) else None
+        self._emit('finished', stopped=self.stopped,
+                   results_file=str(results_file) if results_file else None,
+                   **summarize(results))
+        return results
+    
+    def run_journaled(self, shipments: List[Dict], journal: BatchJournal,
+                      retry_in_doubt: bool = False) -> List[Dict]:
+        """
+        Process the rows the journal still needs and return every row's result
+        
+        Args:
+            shipments: All batch rows
+            journal: BatchJournal for this batch
+            retry_in_doubt: Re-send rows interrupted mid-request
+        
+        Returns:
+            Result dictionaries in CSV order
+        """
+        # Rows cut off mid-request may already exist at Purolator; report them, don't re-send
+        interrupted = [index for index in journal.in_doubt() if journal.result(index) is None]
+        journal.mark_in_doubt(interrupted)
+        
+        pending = journal.pending(retry_in_doubt)
+        unlabeled = journal.unlabeled()
+        already_done = len(shipments) - len(pending) - len(unlabeled)
+        self._emit('started', total=len(shipments), already_done=already_done,
+                   in_doubt=len(journal.in_doubt()))
+        
+        completed = itertools.count(already_done + 1)
+        
+        def report(result):
+            self._emit('result', done=next(completed), total=len(shipments), result=result)
+        
+        # Shipments created before the interruption only need their labels
+        if unlabeled:
+            if self.client.should_fetch_label():
+                self.client.get_and_save_labels([
+                    (journal.result(index)['shipment_pin'], journal.result(index)['reference'])
+                    for index in unlabeled
+                ])
+            for index in unlabeled:
+                journal.finished(index, journal.result(index))
+                report(journal.result(index))
+        
+        def on_result(position, result):
+            # Called from pipeline worker threads as each shipment finishes
+            journal.finished(pending[position], result)
+            report(result)
+        
+        # Label downloads and emails overlap with creation of the next shipments
+        pipeline = ShipmentPipeline(self.client, create_workers=self.max_in_flight)
+        pipeline.run(
+            [shipments[index] for index in pending],
+            on_result=on_result,
+            should_stop=self._stop.is_set,
+            on_started=lambda position: journal.started(pending[position]),
+            on_created=lambda position, result: journal.created(pending[position], result)
+        )
+        
+        return journal.results()
+    
+    def save_results(self, results: List[Dict], filename: Union[str, Path] = None) -> Path:
+        """
+        Save batch results as CSV
+        
+        Args:
+            results: Result dictionaries
+            filename: Output file (default: batch_results_<timestamp>.csv in results_dir)
+        
+        Returns:
+            Path of the saved file
+        """
+        if filename is None:
+            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = self.results_dir / f"batch_results_{timestamp}.csv"
+        path = Path(filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+        return path
@@ -4,12 +4,31 @@ Connects address book database with Purolator shipping API
 """
 
 import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from address_book_db import AddressBookDB, get_db
-from batch_shipping_app import BatchShippingApp
 from purolator_utils import validate_shipment_data
 
+# How long an in-flight shipment request blocks duplicates before it is
+# presumed dead, and how long a duplicate waits for the original to finish
+IDEMPOTENCY_LEASE = float(os.getenv('SHIPPING_IDEMPOTENCY_LEASE', '300'))
+IDEMPOTENCY_WAIT = float(os.getenv('SHIPPING_IDEMPOTENCY_WAIT', '60'))
+
+
+def payload_hash(shipment_data: Dict) -> str:
+    """Stable hash of shipment data, to tell a retry from a different request"""
+    canonical = json.dumps(shipment_data, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def order_request_key(order_id: str) -> str:
+    """Idempotency key for shipping a sales order (one shipment per order)"""
+    return f'sales_order:{order_id}'
+
 
 class ShippingIntegration:
     """
@@ -28,13 +47,17 @@ class ShippingIntegration:
         # Initialize database
         self.db = get_db(db_path)
         
-        # Initialize Purolator shipping app
-        self.shipping_app = BatchShippingApp.__new__(BatchShippingApp)
-        self.shipping_app.username = os.getenv("PUROLATOR_API_USERNAME")
-        self.shipping_app.password = os.getenv("PUROLATOR_API_PASSWORD")
-        self.shipping_app.account = os.getenv("PUROLATOR_API_ACCOUNT")
-        self.shipping_app.shipment_url = "https://webservices.purolator.com/EWS/V2/Shipping/ShippingService.asmx"
-        self.shipping_app.documents_url = "https://webservices.purolator.com/EWS/V1/ShippingDocuments/ShippingDocumentsService.asmx"
+        # Purolator client is created on first shipping action so lookups
+        # never load the SOAP/label stack (requests, XML, email)
+        self._shipping_app = None
+    
+    @property
+    def shipping_app(self):
+        """Purolator API client, created on first use"""
+        if self._shipping_app is None:
+            from purolator_client import PurolatorClient
+            self._shipping_app = PurolatorClient()
+        return self._shipping_app
     
     def convert_location_to_shipment_data(self, location: Dict, 
                                          sender_data: Dict,
@@ -81,7 +104,7 @@ class ShippingIntegration:
         return shipment_data
     
     def ship_to_location(self, location_id: int, sender_data: Dict, 
-                        package_data: Dict) -> Dict:
+                        package_data: Dict, idempotency_key: str = None) -> Dict:
         """
         Create shipment to a specific location
         
@@ -89,14 +112,42 @@ class ShippingIntegration:
             location_id: ID of the shipping location
             sender_data: Sender information
             package_data: Package details
+            idempotency_key: Optional key; repeated requests with the same key
+                return the first shipment instead of creating another
             
         Returns:
             Result dictionary with shipment_pin and status
         """
+        shipment_data, error = self.prepare_location_shipment(
+            location_id, sender_data, package_data
+        )
+        if error:
+            return error
+        
+        # Create shipment
+        if idempotency_key:
+            return self.create_shipment_once(idempotency_key, shipment_data)
+        result = self.shipping_app.create_shipment_from_data(shipment_data)
+        
+        return result
+    
+    def prepare_location_shipment(self, location_id: int, sender_data: Dict,
+                                  package_data: Dict):
+        """
+        Build and validate the shipment data for a location without sending it
+        
+        Args:
+            location_id: ID of the shipping location
+            sender_data: Sender information
+            package_data: Package details
+            
+        Returns:
+            Tuple of (shipment_data, None), or (None, error result dictionary)
+        """
         # Get location from database
         location = self.db.get_shipping_location(location_id)
         if not location:
-            return {
+            return None, {
                 'status': 'Error',
                 'message': f'Location {location_id} not found'
             }
@@ -114,21 +165,22 @@ class ShippingIntegration:
         # Validate data
         is_valid, error_msg = validate_shipment_data(shipment_data)
         if not is_valid:
-            return {
+            return None, {
                 'status': 'Error',
                 'message': f'Validation failed: {error_msg}'
             }
         
-        # Create shipment
-        result = self.shipping_app.create_shipment_from_data(shipment_data)
-        
-        return result
+        return shipment_data, None
     
     def ship_sales_order(self, order_id: str, sender_data: Dict, 
                         package_data: Dict = None) -> Dict:
         """
         Create shipment for a sales order
         
+        Safe to retry and to call concurrently: each order is shipped at most
+        once, and repeated requests get the original result back (with
+        'duplicate': True).
+        
         Args:
             order_id: Sales order ID
             sender_data: Sender information
@@ -137,17 +189,136 @@ class ShippingIntegration:
         Returns:
             Result dictionary with shipment_pin and status
         """
+        key = order_request_key(order_id)
+        
+        # A retry after success gets the shipment back rather than "already shipped"
+        request = self.db.get_shipment_request(key)
+        if request and request['status'] == 'succeeded':
+            return {**request['result'], 'duplicate': True}
+        
+        shipment_data, error = self.prepare_sales_order(order_id, sender_data, package_data)
+        if error:
+            return error
+        
+        # Create shipment
+        return self.create_shipment_once(key, shipment_data, order_id)
+    
+    def create_shipment_once(self, idempotency_key: str, shipment_data: Dict,
+                             order_id: str = None, wait: float = None) -> Dict:
+        """
+        Create a shipment at most once per idempotency key
+        
+        The key is claimed in the database before the SOAP call. A concurrent
+        request with the same key waits for the first one to finish and
+        returns its result. An attempt Purolator rejected may be retried, also
+        with corrected shipment data; one that got no answer stays in doubt
+        until the key is released.
+        
+        Args:
+            idempotency_key: Request key
+            shipment_data: Validated shipment data
+            order_id: Sales order to mark shipped on success (optional)
+            wait: Seconds to wait for an in-flight duplicate
+                (default: SHIPPING_IDEMPOTENCY_WAIT from environment, or 60)
+            
+        Returns:
+            Result dictionary with shipment_pin and status
+        """
+        digest = payload_hash(shipment_data)
+        deadline = time.monotonic() + (IDEMPOTENCY_WAIT if wait is None else wait)
+        
+        while True:
+            claimed, request = self.db.claim_shipment_request(
+                idempotency_key, digest, order_id, IDEMPOTENCY_LEASE
+            )
+            if claimed:
+                break
+            
+            replay = self.replay_shipment_request(request, digest)
+            if replay is not None:
+                return replay
+            if time.monotonic() >= deadline:
+                return {
+                    'status': 'Error',
+                    'message': f'Shipment request {idempotency_key} is already in progress'
+                }
+            time.sleep(0.25)
+        
+        try:
+            result = self.shipping_app.create_shipment_from_data(shipment_data)
+        except Exception as e:
+            # Raised before anything reached Purolator; unanswered requests come back in doubt
+            result = {'status': 'Error', 'message': str(e)}
+        
+        self.finish_shipment_request(idempotency_key, result, order_id)
+        return result
+    
+    def replay_shipment_request(self, request: Dict, digest: str) -> Optional[Dict]:
+        """
+        Result to return for a request that could not be claimed
+        
+        Args:
+            request: Existing shipment request
+            digest: Payload hash of the new request
+            
+        Returns:
+            The original result, an error if the key was used for different
+            shipment data, an in-doubt result if the original got no answer,
+            or None while the original is still in flight
+        """
+        if request['payload_hash'] != digest:
+            return {
+                'status': 'Error',
+                'message': f'Idempotency key {request["idempotency_key"]} was already used for a different shipment'
+            }
+        if request['status'] == 'succeeded':
+            return {**request['result'], 'duplicate': True}
+        if request['status'] == 'in_doubt':
+            return {
+                **(request['result'] or {}),
+                'status': 'In Doubt',
+                'duplicate': True,
+                'message': (f'Shipment request {request["idempotency_key"]} got no response from Purolator; '
+                            'check whether the shipment was created, then release the key to retry')
+            }
+        return None
+    
+    def finish_shipment_request(self, idempotency_key: str, result: Dict,
+                                order_id: str = None):
+        """Record a shipment request's outcome and mark its order shipped, in one transaction"""
+        try:
+            with self.db.get_connection():
+                self.db.complete_shipment_request(idempotency_key, result)
+                if order_id:
+                    self.record_order_shipment(order_id, result)
+        except Exception as e:
+            # The shipment exists either way; leave the claim to expire rather than fail the caller
+            print(f"Warning: Could not record shipment request {idempotency_key}: {e}")
+    
+    def prepare_sales_order(self, order_id: str, sender_data: Dict,
+                            package_data: Dict = None):
+        """
+        Build and validate the shipment data for a sales order without sending it
+        
+        Args:
+            order_id: Sales order ID
+            sender_data: Sender information
+            package_data: Optional package details (uses order data if not provided)
+            
+        Returns:
+            Tuple of (shipment_data, None), or (None, error result dictionary)
+        """
         # Get order with full details
         order = self.db.get_order_with_details(order_id)
         if not order:
-            return {
+            return None, {
                 'status': 'Error',
                 'message': f'Order {order_id} not found'
             }
         
         # Check if already shipped
         if order['status'] == 'shipped':
-            return {
+            return None, {
                 'status': 'Error',
                 'message': f'Order {order_id} already shipped (PIN: {order.get("shipment_pin")})'
             }
@@ -157,7 +328,7 @@ class ShippingIntegration:
             package_data = {
                 'weight': order.get('weight', '2.5'),
                 'service_id': order.get('service_id', 'PurolatorExpress'),
-                'reference': order.get('reference', order_id),
+                'reference': order.get('reference') or order_id,
                 'length': '30',
                 'width': '20',
                 'height': '10',
@@ -169,12 +340,14 @@ class ShippingIntegration:
                 package_data['reference'] = order_id
         
         # Ship to the order's location
-        result = self.ship_to_location(
+        return self.prepare_location_shipment(
             order['location_id'], 
             sender_data, 
             package_data
         )
-        
+    
+    def record_order_shipment(self, order_id: str, result: Dict):
+        """Mark an order shipped if its shipment was created"""
         # Update order status if successful
         if result['status'] == 'Success':
             self.db.update_order_status(
@@ -182,30 +355,161 @@ class ShippingIntegration:
                 'shipped', 
                 result.get('shipment_pin')
             )
-        
-        return result
     
-    def batch_ship_orders(self, order_ids: List[str], sender_data: Dict) -> List[Dict]:
+    def batch_ship_orders(self, order_ids: List[str], sender_data: Dict,
+                          max_in_flight: int = None, use_async: bool = None) -> List[Dict]:
         """
         Create shipments for multiple sales orders
         
+        With max_in_flight > 1, orders are shipped concurrently on a bounded
+        thread pool (never more than max_in_flight SOAP calls at once, to stay
+        within Purolator rate limits). Results keep the order of order_ids and
+        each order's status is updated as soon as its shipment succeeds.
+        
+        With use_async, the shipments are driven from one event loop by
+        AsyncPurolatorClient instead (requires aiohttp).
+        
         Args:
             order_ids: List of order IDs to ship
             sender_data: Sender information
+            max_in_flight: Maximum concurrent shipments
+                (default: SHIPPING_MAX_IN_FLIGHT from environment, or 1 = sequential)
+            use_async: Use the asyncio client
+                (default: SHIPPING_ASYNC from environment, or false)
             
         Returns:
             List of result dictionaries
         """
-        results = []
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('SHIPPING_MAX_IN_FLIGHT', '1'))
+        if use_async is None:
+            use_async = os.getenv('SHIPPING_ASYNC', 'false').lower() == 'true'
         
-        for order_id in order_ids:
-            result = self.ship_sales_order(order_id, sender_data)
-            results.append({
+        if use_async:
+            import asyncio
+            return asyncio.run(
+                self.batch_ship_orders_async(order_ids, sender_data, max_in_flight)
+            )
+        
+        def ship(order_id: str) -> Dict:
+            try:
+                result = self.ship_sales_order(order_id, sender_data)
+            except Exception as e:
+                result = {'status': 'Error', 'message': str(e)}
+            return {
                 'order_id': order_id,
                 **result
-            })
+            }
+        
+        # Ship each order once, even if it is listed twice
+        unique_ids = list(dict.fromkeys(order_ids))
+        
+        if max_in_flight <= 1 or len(unique_ids) <= 1:
+            shipped = {order_id: ship(order_id) for order_id in unique_ids}
+        else:
+            # Create the client up front so worker threads share one instance
+            self.shipping_app
+            workers = min(max_in_flight, len(unique_ids))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                shipped = dict(zip(unique_ids, executor.map(ship, unique_ids)))
         
-        return results
+        return [shipped[order_id] for order_id in order_ids]
+    
+    async def batch_ship_orders_async(self, order_ids: List[str], sender_data: Dict,
+                                      max_in_flight: int = None) -> List[Dict]:
+        """
+        Create shipments for multiple sales orders from one event loop
+        
+        Orders are read and validated up front, then every shipment is sent
+        through AsyncPurolatorClient (at most max_in_flight requests at once)
+        and each order is marked shipped as its shipment is created. Labels
+        are fetched afterwards with batched GetDocuments calls.
+        
+        Args:
+            order_ids: List of order IDs to ship
+            sender_data: Sender information
+            max_in_flight: Maximum concurrent requests
+                (default: PUROLATOR_ASYNC_MAX_IN_FLIGHT from environment)
+            
+        Returns:
+            List of result dictionaries, in the order of order_ids
+        """
+        from async_purolator_client import AsyncPurolatorClient
+        
+        # Built before any order is claimed: without aiohttp this raises and
+        # leaves nothing in flight
+        client = AsyncPurolatorClient(self.shipping_app, max_in_flight)
+        
+        # Ship each order once, even if it is listed twice
+        unique_ids = list(dict.fromkeys(order_ids))
+        
+        shipped = {}
+        to_send = []
+        for order_id in unique_ids:
+            try:
+                shipment_data, outcome = self.claim_sales_order(order_id, sender_data)
+            except Exception as e:
+                shipment_data, outcome = None, {'status': 'Error', 'message': str(e)}
+            if outcome:
+                shipped[order_id] = {'order_id': order_id, **outcome}
+            else:
+                to_send.append((order_id, shipment_data))
+        
+        def on_result(index: int, result: Dict):
+            order_id = to_send[index][0]
+            self.finish_shipment_request(order_request_key(order_id), result, order_id)
+        
+        if to_send:
+            sending = False
+            try:
+                async with client:
+                    sending = True
+                    results = await client.create_shipments(
+                        [shipment_data for _, shipment_data in to_send],
+                        on_result=on_result
+                    )
+            except BaseException:
+                # Nothing reached Purolator: free the claims so the orders can
+                # be shipped again now rather than after the lease runs out
+                if not sending:
+                    for order_id, _ in to_send:
+                        self.db.release_shipment_request(order_request_key(order_id), in_flight=True)
+                raise
+            for (order_id, _), result in zip(to_send, results):
+                shipped[order_id] = {'order_id': order_id, **result}
+        
+        return [shipped[order_id] for order_id in order_ids]
+    
+    def claim_sales_order(self, order_id: str, sender_data: Dict):
+        """
+        Prepare a sales order and claim its shipment request without waiting
+        
+        Args:
+            order_id: Sales order ID
+            sender_data: Sender information
+            
+        Returns:
+            Tuple of (shipment_data, None) when claimed (send it, then call
+            finish_shipment_request), or (None, result) when the order is
+            invalid, already shipped or being shipped by another request
+        """
+        key = order_request_key(order_id)
+        request = self.db.get_shipment_request(key)
+        if request and request['status'] == 'succeeded':
+            return None, {**request['result'], 'duplicate': True}
+        
+        shipment_data, error = self.prepare_sales_order(order_id, sender_data)
+        if error:
+            return None, error
+        
+        digest = payload_hash(shipment_data)
+        claimed, request = self.db.claim_shipment_request(key, digest, order_id, IDEMPOTENCY_LEASE)
+        if claimed:
+            return shipment_data, None
+        return None, self.replay_shipment_request(request, digest) or {
+            'status': 'Error',
+            'message': f'Shipment request {key} is already in progress'
+        }
     
     def get_pending_shipments(self) -> List[Dict]:
         """
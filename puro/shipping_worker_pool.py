@@ -0,0 +1,251 @@
+"""
+Shipping Worker Pool
+Pre-forked worker processes for the shipping command server
+
+Each worker initializes its own AddressBookAPI (database + Purolator client)
+once at startup, then handles commands sent by the supervisor. Commands are
+routed to the worker with the fewest requests in flight, so a slow shipment
+creation never blocks address lookups queued behind it.
+"""
+
+import os
+import sys
+import threading
+import itertools
+import multiprocessing
+from typing import Dict, Any, Callable, List, Optional
+
+# Seconds call() waits for a worker's response before giving up on it
+CALL_TIMEOUT = float(os.getenv('SHIPPING_WORKER_CALL_TIMEOUT', '600'))
+
+
+def _worker_main(conn, handler: Callable, warm_up: Optional[Callable]):
+    """
+    Worker process loop
+    
+    Args:
+        conn: Pipe connection to the supervisor
+        handler: Function that turns a command dict into a response dict
+        warm_up: Optional function called once before accepting commands
+    """
+    # Anything printed by the shipping stack goes to stderr so it can't corrupt the protocol
+    sys.stdout = sys.stderr
+    
+    if warm_up:
+        warm_up()
+    
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        
+        if message is None:
+            break
+        
+        seq, command = message
+        try:
+            response = handler(command)
+        except Exception as e:
+            response = {
+                'status': 'error',
+                'message': str(e),
+                'error_type': type(e).__name__
+            }
+        
+        try:
+            conn.send((seq, response))
+        except (BrokenPipeError, OSError):
+            break
+
+
+class _Worker:
+    """Supervisor-side bookkeeping for one worker process"""
+    
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Callable] = {}
+        self.completed = 0
+        self.exited = False
+    
+    @property
+    def depth(self) -> int:
+        """Number of requests currently queued on this worker"""
+        return len(self.pending)
+
+
+class ShippingWorkerPool:
+    """Pool of pre-warmed worker processes with least-queue-depth dispatch"""
+    
+    def __init__(self, handler: Callable, warm_up: Callable = None,
+                 num_workers: int = None):
+        """
+        Start the worker processes
+        
+        Args:
+            handler: Function that turns a command dict into a response dict
+            warm_up: Optional function each worker calls once at startup
+            num_workers: Number of worker processes (default: CPU count)
+        """
+        self.handler = handler
+        self.warm_up = warm_up
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._closing = False
+        self._workers: List[_Worker] = []
+        
+        for index in range(self.num_workers):
+            self._workers.append(self._start_worker(index))
+    
+    def _start_worker(self, index: int) -> _Worker:
+        """Start one worker process and its response reader thread"""
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_conn, self.handler, self.warm_up),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        
+        worker = _Worker(index, process, parent_conn)
+        reader = threading.Thread(target=self._read_responses, args=(worker,), daemon=True)
+        reader.start()
+        return worker
+    
+    def _read_responses(self, worker: _Worker):
+        """Deliver responses from one worker; restart it if it dies"""
+        while True:
+            try:
+                seq, response = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            
+            with self._lock:
+                callback = worker.pending.pop(seq, None)
+                worker.completed += 1
+            
+            if callback:
+                callback(response)
+        
+        replacement = None
+        if not self._closing:
+            print(f"Warning: Shipping worker {worker.index} exited, restarting", file=sys.stderr)
+            replacement = self._start_worker(worker.index)
+        
+        # Swap under the lock so no new request can land on the dead worker
+        with self._lock:
+            if replacement:
+                self._workers[worker.index] = replacement
+            worker.exited = True
+            orphaned = list(worker.pending.values())
+            worker.pending.clear()
+        
+        for callback in orphaned:
+            callback({
+                'status': 'error',
+                'message': f'Worker {worker.index} exited while handling request'
+            })
+    
+    def submit(self, command: Dict[str, Any], callback: Callable[[Dict[str, Any]], None]):
+        """
+        Dispatch a command to the least busy worker
+        
+        Args:
+            command: Command dictionary with 'action' and parameters
+            callback: Called with the response dictionary (from a reader thread)
+        """
+        seq = next(self._seq)
+        with self._lock:
+            # Fewest in flight wins; ties go to the worker that has done the least work
+            worker = min(self._workers, key=lambda w: (w.depth, w.completed))
+            worker.pending[seq] = callback
+        
+        try:
+            with worker.send_lock:
+                worker.conn.send((seq, command))
+        except (BrokenPipeError, OSError) as e:
+            with self._lock:
+                callback = worker.pending.pop(seq, None)
+            if callback:
+                callback({'status': 'error', 'message': f'Worker unavailable: {e}'})
+            return
+        
+        # The worker may have died after it was picked; if its reader has
+        # already failed the orphans, nothing else will answer this request
+        with self._lock:
+            callback = worker.pending.pop(seq, None) if worker.exited else None
+        if callback:
+            callback({'status': 'error', 'message': f'Worker {worker.index} exited before handling request'})
+    
+    def call(self, command: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        """
+        Dispatch a command and wait for its response
+        
+        Args:
+            command: Command dictionary with 'action' and parameters
+            timeout: Seconds to wait for the response
+                (default: SHIPPING_WORKER_CALL_TIMEOUT from environment, or 600)
+        
+        Returns:
+            Response dictionary (an error response if the wait timed out)
+        """
+        if timeout is None:
+            timeout = CALL_TIMEOUT
+        
+        done = threading.Event()
+        result = {}
+        
+        def on_response(response):
+            result['response'] = response
+            done.set()
+        
+        self.submit(command, on_response)
+        if not done.wait(timeout):
+            return {
+                'status': 'error',
+                'message': f'No response from shipping worker after {timeout:g}s'
+            }
+        return result['response']
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Get per-worker queue depth and throughput
+        
+        Returns:
+            List of dictionaries with worker index, pid, in_flight and completed counts
+        """
+        with self._lock:
+            return [
+                {
+                    'worker': w.index,
+                    'pid': w.process.pid,
+                    'alive': w.process.is_alive(),
+                    'in_flight': w.depth,
+                    'completed': w.completed
+                }
+                for w in self._workers
+            ]
+    
+    def close(self, timeout: float = 5.0):
+        """Ask workers to exit after finishing queued commands"""
+        with self._lock:
+            self._closing = True
+            workers = list(self._workers)
+        
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
@@ -0,0 +1,166 @@
+"""
+SOAP Response Parsing
+Single-pass parser for Purolator CreateShipment and GetDocuments responses
+
+The response is fed to an incremental (pull) XML parser in chunks and read
+element by element, so the PIN, errors and label documents all come out of
+one pass. Parsing stops as soon as everything that was asked for has been
+seen, and finished elements are cleared as we go, so a GetDocuments reply
+full of base64 PDFs is never held as a complete element tree.
+"""
+
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Iterable, Union
+
+# Bytes fed to the parser at a time; lets us stop before reading the rest
+CHUNK_SIZE = 64 * 1024
+
+
+class SoapResponse:
+    """What a Purolator response carried: shipment PIN, errors, fault and documents"""
+    
+    def __init__(self):
+        self.shipment_pin: Optional[str] = None
+        self.errors: List[Dict[str, str]] = []
+        self.fault: Optional[str] = None
+        self.documents: Dict[str, Dict[str, str]] = {}
+        self.parse_error: Optional[str] = None
+    
+    @property
+    def error_message(self) -> Optional[str]:
+        """Human readable error (SOAP fault first, then response errors), or None"""
+        if self.fault:
+            return self.fault
+        for error in self.errors:
+            if error.get('description'):
+                return error['description']
+        if self.errors:
+            return "; ".join(
+                f"{error.get('code', '')}: {error.get('description', '')}" for error in self.errors
+            )
+        return None
+    
+    def __repr__(self):
+        return (f"SoapResponse(shipment_pin={self.shipment_pin!r}, errors={self.errors!r}, "
+                f"fault={self.fault!r}, documents={sorted(self.documents)!r})")
+
+
+def _local(tag: str) -> str:
+    """Tag name without its {namespace}"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(elem, name: str) -> Optional[str]:
+    """Text of the first direct child with the given local name"""
+    for child in elem:
+        if _local(child.tag) == name:
+            return child.text
+    return None
+
+
+def parse_response(response: Union[str, bytes], document_pins: Iterable[str] = None,
+                   stop_at_pin: bool = False,
+                   document_type: str = 'DomesticBillOfLading') -> SoapResponse:
+    """
+    Parse a Purolator SOAP response in one pass
+    
+    Args:
+        response: Response body (bytes preferred; str is encoded)
+        document_pins: PINs requested from GetDocuments; parsing stops once each
+            has its base64 data. A Document without a PIN is assigned to the
+            only requested PIN.
+        stop_at_pin: Stop as soon as the ShipmentPIN has been read
+            (errors precede it in CreateShipment responses)
+        document_type: Document type to pick from each Document
+    
+    Returns:
+        SoapResponse (parse_error is set if the XML was malformed)
+    """
+    result = SoapResponse()
+    wanted = list(document_pins or [])
+    pending = set(wanted)
+    
+    if isinstance(response, str):
+        response = response.encode('utf-8')
+    data = memoryview(response)
+    
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    path: List[str] = []
+    
+    # State for the Document being read
+    doc_pin = None
+    doc_data = None
+    doc_url = None
+    
+    try:
+        for offset in range(0, max(len(data), 1), CHUNK_SIZE):
+            parser.feed(data[offset:offset + CHUNK_SIZE])
+            
+            for event, elem in parser.read_events():
+                name = _local(elem.tag)
+                
+                if event == 'start':
+                    path.append(name)
+                    if name == 'Document':
+                        doc_pin = doc_data = doc_url = None
+                    continue
+                
+                path.pop()
+                parent = path[-1] if path else None
+                
+                if name == 'Value' and parent == 'ShipmentPIN':
+                    result.shipment_pin = (elem.text or '').strip() or None
+                    if stop_at_pin and result.shipment_pin:
+                        return result
+                
+                elif name == 'Value' and parent == 'PIN' and 'Document' in path:
+                    doc_pin = (elem.text or '').strip() or None
+                
+                elif name == 'Error':
+                    error = {}
+                    for child in elem:
+                        if child.text:
+                            error[_local(child.tag).lower()] = child.text
+                    result.errors.append({
+                        'code': error.get('code', ''),
+                        'description': error.get('description', ''),
+                        'additional_information': error.get('additionalinformation', '')
+                    })
+                    elem.clear()
+                
+                elif name == 'faultstring':
+                    result.fault = elem.text or "Unknown error"
+                
+                elif name == 'Data' and parent == 'Document':
+                    if elem.text and doc_data is None:
+                        doc_data = elem.text
+                    elem.clear()
+                
+                elif name == 'DocumentDetail':
+                    if _child_text(elem, 'DocumentType') == document_type:
+                        detail_data = _child_text(elem, 'Data')
+                        detail_url = _child_text(elem, 'URL')
+                        if detail_data and doc_data is None:
+                            doc_data = detail_data
+                        if detail_url and doc_url is None:
+                            doc_url = detail_url
+                    elem.clear()
+                
+                elif name == 'Document':
+                    pin = doc_pin or (wanted[0] if len(wanted) == 1 else None)
+                    if pin and 'data' not in result.documents.get(pin, {}):
+                        if doc_data:
+                            result.documents[pin] = {'data': doc_data}
+                            pending.discard(pin)
+                        elif doc_url:
+                            result.documents[pin] = {'url': doc_url}
+                    elem.clear()
+                    
+                    if wanted and not pending:
+                        return result
+        
+        parser.close()
+    except ET.ParseError as e:
+        result.parse_error = str(e)
+    
+    return result
@@ -0,0 +1,226 @@
+"""
+SOAP Envelope Templates
+Precompiled Purolator request envelopes with XML escaping
+
+Each template is split into its static segments once, at import time.
+Rendering checks all dynamic fields for characters that need escaping in a
+single pass (escaping only when one is found), then joins segments and
+fields and encodes the envelope once. A receiver name like "A&B Ltd" can no
+longer produce an invalid envelope.
+"""
+
+import re
+from operator import itemgetter
+from typing import Dict, Iterable, List
+
+# {field} placeholders in template text
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+# Characters that are not allowed anywhere in an XML 1.0 document
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_ESCAPE_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def _needs_escaping(text: str) -> bool:
+    """Quick check for markup or non-printable characters (C-speed substring tests)"""
+    return '&' in text or '<' in text or '>' in text or not text.isprintable()
+
+
+def xml_escape(value) -> str:
+    """
+    Escape a value for use as XML element text
+    
+    Args:
+        value: Any value (None becomes an empty string)
+    
+    Returns:
+        Escaped text with characters that XML cannot carry removed
+    """
+    if value is None:
+        return ''
+    text = value if isinstance(value, str) else str(value)
+    if not _needs_escaping(text):
+        return text
+    text = text.translate(_ESCAPE_TABLE)
+    if _INVALID_XML_CHARS.search(text):
+        text = _INVALID_XML_CHARS.sub('', text)
+    return text
+
+
+class SoapTemplate:
+    """Envelope pre-split into static segments around {field} placeholders"""
+    
+    def __init__(self, text: str):
+        """
+        Compile a template
+        
+        Args:
+            text: Envelope text with {field} placeholders
+        """
+        self.text = text
+        pieces = _PLACEHOLDER.split(text)
+        # split() alternates static text and field names: s0, f0, s1, f1, ..., sN
+        self.segments: List[str] = pieces[0::2]
+        self.fields: List[str] = pieces[1::2]
+        
+        # Parts list with the static segments already in place. Segments stay str:
+        # one encode of the joined envelope beats encoding every field to join
+        # bytes segments (see benchmark_soap_templates.py)
+        self._parts = [''] * len(pieces)
+        self._parts[0::2] = self.segments
+        
+        if len(self.fields) > 1:
+            self._values = itemgetter(*self.fields)
+        else:
+            self._values = lambda values: tuple(values[field] for field in self.fields)
+    
+    def render(self, values: Dict) -> bytes:
+        """
+        Fill the placeholders with escaped values
+        
+        Args:
+            values: Dictionary with a value for every field
+        
+        Returns:
+            UTF-8 encoded envelope
+        """
+        fields = self._values(values)
+        try:
+            joined = ''.join(fields)
+        except TypeError:
+            # Numbers or None among the values
+            fields = [xml_escape(value) for value in fields]
+            joined = ''
+        
+        # One scan over all values; escape field by field only if something needs it
+        if _needs_escaping(joined):
+            fields = [xml_escape(value) for value in fields]
+        
+        parts = self._parts.copy()
+        parts[1::2] = fields
+        return ''.join(parts).encode('utf-8')
+
+
+SHIPMENT_REQUEST = SoapTemplate("""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:v2="http://purolator.com/pws/datatypes/v2">
+  <soapenv:Header>
+    <v2:RequestContext>
+      <v2:Version>2.0</v2:Version>
+      <v2:Language>en</v2:Language>
+      <v2:GroupID>111</v2:GroupID>
+      <v2:RequestReference>{reference}</v2:RequestReference>
+      <v2:UserToken></v2:UserToken>
+    </v2:RequestContext>
+  </soapenv:Header>
+  <soapenv:Body>
+    <v2:CreateShipmentRequest>
+      <v2:Shipment>
+        <v2:SenderInformation>
+          <v2:Address>
+            <v2:Name>{sender_name}</v2:Name>
+            <v2:StreetNumber>{sender_street_num}</v2:StreetNumber>
+            <v2:StreetName>{sender_street_name}</v2:StreetName>
+            <v2:City>{sender_city}</v2:City>
+            <v2:Province>{sender_province}</v2:Province>
+            <v2:Country>CA</v2:Country>
+            <v2:PostalCode>{sender_postal}</v2:PostalCode>
+            <v2:PhoneNumber>
+              <v2:CountryCode>{sender_phone_country}</v2:CountryCode>
+              <v2:AreaCode>{sender_phone_area}</v2:AreaCode>
+              <v2:Phone>{sender_phone_number}</v2:Phone>
+            </v2:PhoneNumber>
+          </v2:Address>
+        </v2:SenderInformation>
+        <v2:ReceiverInformation>
+          <v2:Address>
+            <v2:Name>{receiver_name}</v2:Name>
+            <v2:StreetNumber>{receiver_street_num}</v2:StreetNumber>
+            <v2:StreetName>{receiver_street_name}</v2:StreetName>
+            <v2:City>{receiver_city}</v2:City>
+            <v2:Province>{receiver_province}</v2:Province>
+            <v2:Country>{receiver_country}</v2:Country>
+            <v2:PostalCode>{receiver_postal}</v2:PostalCode>
+            <v2:PhoneNumber>
+              <v2:CountryCode>{receiver_phone_country}</v2:CountryCode>
+              <v2:AreaCode>{receiver_phone_area}</v2:AreaCode>
+              <v2:Phone>{receiver_phone_number}</v2:Phone>
+            </v2:PhoneNumber>
+          </v2:Address>
+        </v2:ReceiverInformation>
+        <v2:PackageInformation>
+          <v2:ServiceID>{service_id}</v2:ServiceID>
+          <v2:TotalWeight>
+            <v2:Value>{weight}</v2:Value>
+            <v2:WeightUnit>kg</v2:WeightUnit>
+          </v2:TotalWeight>
+          <v2:Dimensions>
+            <v2:Length>{length}</v2:Length>
+            <v2:Width>{width}</v2:Width>
+            <v2:Height>{height}</v2:Height>
+            <v2:DimensionUnit>cm</v2:DimensionUnit>
+          </v2:Dimensions>
+          <v2:TotalPieces>1</v2:TotalPieces>
+        </v2:PackageInformation>
+        <v2:PaymentInformation>
+          <v2:PaymentType>{payment_type}</v2:PaymentType>
+          <v2:RegisteredAccountNumber>{account}</v2:RegisteredAccountNumber>
+        </v2:PaymentInformation>
+        <v2:PickupInformation>
+          <v2:PickupType>DropOff</v2:PickupType>
+        </v2:PickupInformation>
+      </v2:Shipment>
+      <v2:PrinterType>Regular</v2:PrinterType>
+    </v2:CreateShipmentRequest>
+  </soapenv:Body>
+</soapenv:Envelope>""")
+
+_DOCUMENTS_HEAD = b"""<?xml version='1.0' encoding='UTF-8'?>
+<soapenv:Envelope xmlns:soapenv='http://schemas.xmlsoap.org/soap/envelope/' xmlns:v1='http://purolator.com/pws/datatypes/v1'>
+  <soapenv:Header>
+    <v1:RequestContext>
+      <v1:Version>1.2</v1:Version>
+      <v1:Language>en</v1:Language>
+      <v1:GroupID>11</v1:GroupID>
+      <v1:RequestReference>GetLabel</v1:RequestReference>
+      <v1:UserToken></v1:UserToken>
+    </v1:RequestContext>
+  </soapenv:Header>
+  <soapenv:Body>
+    <v1:GetDocumentsRequest>
+      <v1:DocumentCriterium>"""
+
+DOCUMENT_CRITERIA = SoapTemplate("""
+        <v1:DocumentCriteria>
+          <v1:PIN>
+            <v1:Value>{pin}</v1:Value>
+          </v1:PIN>
+          <v1:DocumentTypes>
+            <v1:DocumentType>{document_type}</v1:DocumentType>
+          </v1:DocumentTypes>
+        </v1:DocumentCriteria>""")
+
+_DOCUMENTS_TAIL = b"""
+      </v1:DocumentCriterium>
+    </v1:GetDocumentsRequest>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+def render_documents_request(shipment_pins: Iterable[str],
+                             document_type: str = 'DomesticBillOfLading') -> bytes:
+    """
+    Render a GetDocuments envelope with one DocumentCriteria per PIN
+    
+    Args:
+        shipment_pins: Shipment PINs
+        document_type: Purolator document type to request
+    
+    Returns:
+        UTF-8 encoded envelope
+    """
+    criteria = [
+        DOCUMENT_CRITERIA.render({'pin': pin, 'document_type': document_type})
+        for pin in shipment_pins
+    ]
+    return b''.join([_DOCUMENTS_HEAD, *criteria, _DOCUMENTS_TAIL])
@@ -5,8 +5,7 @@ Test Production API - Creates ONE real label (auto-run)
 
 import os
 from dotenv import load_dotenv
-from batch_shipping_app import BatchShippingApp
-import tkinter as tk
+from purolator_client import PurolatorClient
 
 # Load environment variables
 load_dotenv()
@@ -71,19 +70,9 @@ def test_production():
     print(f"   Reference: {test_data['reference']}")
     print()
     
-    # Initialize app (without GUI)
-    root = tk.Tk()
-    root.withdraw()
-    
+    # Initialize API client (no GUI needed)
     try:
-        app = BatchShippingApp.__new__(BatchShippingApp)
-        app.username = username
-        app.password = password
-        app.account = account
-        app.shipment_url = "https://webservices.purolator.com/EWS/V2/Shipping/ShippingService.asmx"
-        app.documents_url = "https://webservices.purolator.com/EWS/V1/ShippingDocuments/ShippingDocumentsService.asmx"
-        app.root = root
-        app.auto_print_var = type('obj', (object,), {'get': lambda self: True})()
+        app = PurolatorClient()
         
         print("Sending request to production API...")
         result = app.create_shipment_from_data(test_data)
@@ -140,8 +129,6 @@ def test_production():
         import traceback
         traceback.print_exc()
         return False
-    finally:
-        root.destroy()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""
+Test Shipment Request Idempotency (offline)
+Claims, replays and retries of idempotency keys against a temporary address book
+
+Run with: python test_shipment_requests.py (or pytest)
+"""
+
+import os
+import asyncio
+import tempfile
+
+import async_purolator_client
+from shipping_integration import ShippingIntegration, order_request_key
+
+
+class StubShippingApp:
+    """Stands in for PurolatorClient: rejects shipments weighing 0, creates the rest"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def create_shipment_from_data(self, data):
+        self.calls += 1
+        if data['weight'] == '0':
+            return {'reference': data['reference'], 'status': 'Error', 'http_status': 200,
+                    'shipment_pin': None, 'message': 'Weight must be greater than 0'}
+        return {'reference': data['reference'], 'status': 'Success', 'http_status': 200,
+                'shipment_pin': f'PIN{self.calls}', 'message': 'Shipment created successfully'}
+
+
+def make_integration():
+    """ShippingIntegration on a fresh database, with the stub client"""
+    db_path = os.path.join(tempfile.mkdtemp(), 'address_book.db')
+    integration = ShippingIntegration(db_path)
+    integration._shipping_app = StubShippingApp()
+    return integration
+
+
+def shipment(weight):
+    return {'reference': 'SO-1001', 'receiver_name': 'A&B Ltd', 'receiver_postal': 'H4T 1K5',
+            'weight': weight}
+
+
+def test_failed_request_can_be_reclaimed_with_new_payload():
+    """A rejected claim can be taken again with corrected shipment data"""
+    db = make_integration().db
+    
+    claimed, _ = db.claim_shipment_request('k', 'h1')
+    assert claimed
+    db.complete_shipment_request('k', {'status': 'Error', 'message': 'rejected'})
+    
+    claimed, existing = db.claim_shipment_request('k', 'h2')
+    assert claimed
+    assert existing['status'] == 'failed'
+    
+    request = db.get_shipment_request('k')
+    assert request['status'] == 'in_flight'
+    assert request['payload_hash'] == 'h2'
+    assert request['attempts'] == 2
+
+
+def test_rejected_order_then_corrected_retry():
+    """Purolator rejects an order; the corrected order ships once under the same key"""
+    integration = make_integration()
+    app = integration.shipping_app
+    
+    rejected = integration.create_shipment_once('sales_order:SO-1001', shipment('0'), wait=0)
+    assert rejected['status'] == 'Error'
+    assert integration.db.get_shipment_request('sales_order:SO-1001')['status'] == 'failed'
+    
+    corrected = integration.create_shipment_once('sales_order:SO-1001', shipment('2.5'), wait=0)
+    assert corrected['status'] == 'Success'
+    assert app.calls == 2
+    
+    # The corrected order is now the one the key stands for
+    replay = integration.create_shipment_once('sales_order:SO-1001', shipment('2.5'), wait=0)
+    assert replay['duplicate'] and replay['shipment_pin'] == corrected['shipment_pin']
+    stale = integration.create_shipment_once('sales_order:SO-1001', shipment('0'), wait=0)
+    assert stale['status'] == 'Error' and 'different shipment' in stale['message']
+    assert app.calls == 2
+
+
+def test_in_flight_and_in_doubt_requests_are_not_reclaimed():
+    """Only failed requests take a new payload; in-flight and in-doubt ones stay put"""
+    db = make_integration().db
+    
+    db.claim_shipment_request('busy', 'h1')
+    claimed, existing = db.claim_shipment_request('busy', 'h2', lease_seconds=0)
+    assert not claimed and existing['payload_hash'] == 'h1'
+    
+    db.claim_shipment_request('doubt', 'h1')
+    db.complete_shipment_request('doubt', {'status': 'In Doubt', 'message': 'no response'})
+    for digest in ('h1', 'h2'):
+        claimed, existing = db.claim_shipment_request('doubt', digest)
+        assert not claimed and existing['status'] == 'in_doubt'
+    
+    assert db.release_shipment_request('doubt')
+    claimed, _ = db.claim_shipment_request('doubt', 'h2')
+    assert claimed
+
+
+def add_order(db, order_id):
+    """Sales order for a customer with one default location"""
+    customer_id = db.add_customer('A&B Ltd')
+    location_id = db.add_shipping_location(customer_id, 'Head office', '1 Main St', 'Montreal',
+                                           'QC', 'H4T 1K5', '514-555-0100', is_default=True)
+    db.add_sales_order(order_id, customer_id, location_id, weight='2.5',
+                       service_id='PurolatorExpress')
+
+
+def test_async_batch_without_aiohttp_claims_nothing():
+    """The missing-aiohttp error comes before any order is claimed"""
+    integration = make_integration()
+    add_order(integration.db, 'SO-2001')
+    
+    available = async_purolator_client.AIOHTTP_AVAILABLE
+    async_purolator_client.AIOHTTP_AVAILABLE = False
+    try:
+        asyncio.run(integration.batch_ship_orders_async(['SO-2001'], {}))
+        assert False, 'expected ImportError'
+    except ImportError:
+        pass
+    finally:
+        async_purolator_client.AIOHTTP_AVAILABLE = available
+    
+    assert integration.db.get_shipment_request(order_request_key('SO-2001')) is None
+
+
+def test_async_batch_releases_claims_when_client_fails_to_open():
+    """Orders claimed for a session that never opened can be shipped again at once"""
+    if not async_purolator_client.AIOHTTP_AVAILABLE:
+        return
+    integration = make_integration()
+    add_order(integration.db, 'SO-2002')
+    
+    async def fail_open(self):
+        raise OSError('no event loop resources')
+    
+    original = async_purolator_client.AsyncPurolatorClient.open
+    async_purolator_client.AsyncPurolatorClient.open = fail_open
+    try:
+        asyncio.run(integration.batch_ship_orders_async(['SO-2002'], {}))
+        assert False, 'expected OSError'
+    except OSError:
+        pass
+    finally:
+        async_purolator_client.AsyncPurolatorClient.open = original
+    
+    key = order_request_key('SO-2002')
+    assert integration.db.get_shipment_request(key)['status'] == 'failed'
+    claimed, _ = integration.db.claim_shipment_request(key, 'h')
+    assert claimed
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"PASS: {name}")
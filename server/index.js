@@ -5,8 +5,9 @@ import path from 'path';
 import { fileURLToPath } from 'url';
 import bcrypt from 'bcryptjs';
 import jwt from 'jsonwebtoken';
-import { exec } from 'child_process';
+import { exec, spawn } from 'child_process';
 import { promisify } from 'util';
+import readline from 'readline';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -21,6 +22,14 @@ const execAsync = promisify(exec);
 // Get path to Python shipping API script
 const PURO_DIR = path.join(__dirname, '..', 'puro');
 const PYTHON_API_SCRIPT = path.join(PURO_DIR, 'shipping_api_server.py');
+const PYTHON_BIN = process.platform === 'win32' ? 'python' : 'python3';
+// Keep one long-lived Python process (shipping_api_server.py --serve) instead of spawning per request
+const PYTHON_API_PERSISTENT = process.env.PYTHON_API_PERSISTENT !== 'false';
+const PYTHON_API_TIMEOUT_MS = parseInt(process.env.PYTHON_API_TIMEOUT_MS || '120000');
+// Batch shipments go to Python in chunks so other requests are served in between;
+// no single call waits longer than PYTHON_API_BATCH_TIMEOUT_MS
+const PYTHON_API_BATCH_SIZE = Math.max(1, parseInt(process.env.PYTHON_API_BATCH_SIZE || '10'));
+const PYTHON_API_BATCH_TIMEOUT_MS = parseInt(process.env.PYTHON_API_BATCH_TIMEOUT_MS || '600000');
 
 // Middleware
 app.use(cors());
@@ -76,18 +85,117 @@ async function writeJSONFile(filePath, data) {
   await fs.writeFile(filePath, JSON.stringify(data, null, 2), 'utf8');
 }
 
+// Long-lived Python shipping API worker state
+let pythonWorker = null;
+let nextPythonRequestId = 1;
+const pendingPythonRequests = new Map();
+
+function rejectPendingPythonRequests(error) {
+  for (const pending of pendingPythonRequests.values()) {
+    clearTimeout(pending.timer);
+    pending.reject(error);
+  }
+  pendingPythonRequests.clear();
+}
+
+// Start (or reuse) the persistent Python worker
+function getPythonWorker() {
+  if (pythonWorker) {
+    return pythonWorker;
+  }
+  
+  const child = spawn(PYTHON_BIN, [PYTHON_API_SCRIPT, '--serve'], {
+    cwd: PURO_DIR,
+    stdio: ['pipe', 'pipe', 'pipe']
+  });
+  
+  // One JSON response per line, matched to its request by id
+  const lines = readline.createInterface({ input: child.stdout });
+  lines.on('line', (line) => {
+    let response;
+    try {
+      response = JSON.parse(line);
+    } catch (e) {
+      console.error('Invalid response from Python API worker:', line);
+      return;
+    }
+    
+    const { id, ...payload } = response;
+    const pending = pendingPythonRequests.get(id);
+    if (!pending) {
+      return;
+    }
+    pendingPythonRequests.delete(id);
+    clearTimeout(pending.timer);
+    pending.resolve(payload);
+  });
+  
+  child.stderr.on('data', (data) => {
+    const text = data.toString();
+    if (!text.includes('Warning') && !text.includes('Note')) {
+      console.error('Python API stderr:', text);
+    }
+  });
+  
+  child.stdin.on('error', (error) => {
+    console.error('Python API worker stdin error:', error.message);
+  });
+  
+  const handleExit = (reason) => {
+    if (pythonWorker === child) {
+      pythonWorker = null;
+    }
+    rejectPendingPythonRequests(new Error(`Python API worker ${reason}`));
+  };
+  child.on('error', (error) => handleExit(`failed: ${error.message}`));
+  child.on('exit', (code, signal) => handleExit(`exited (code ${code}, signal ${signal})`));
+  
+  pythonWorker = child;
+  return child;
+}
+
+// Send a command to the persistent Python worker
+function callPersistentPythonAPI(command, timeoutMs = PYTHON_API_TIMEOUT_MS) {
+  return new Promise((resolve, reject) => {
+    const worker = getPythonWorker();
+    const id = nextPythonRequestId++;
+    
+    const timer = setTimeout(() => {
+      pendingPythonRequests.delete(id);
+      reject(new Error(`Python API request timed out after ${timeoutMs}ms`));
+    }, timeoutMs);
+    
+    pendingPythonRequests.set(id, { resolve, reject, timer });
+    worker.stdin.write(JSON.stringify({ ...command, id }) + '\n');
+  });
+}
+
 // Helper function to call Python shipping API
-async function callPythonAPI(command) {
+// Pass { action: 'batch', commands: [...] } to run several commands in one round trip
+async function callPythonAPI(command, { timeoutMs } = {}) {
+  if (PYTHON_API_PERSISTENT) {
+    try {
+      return await callPersistentPythonAPI(command, timeoutMs);
+    } catch (error) {
+      console.error('Error calling Python API:', error);
+      throw new Error(`Python API call failed: ${error.message}`);
+    }
+  }
+  
+  return callPythonAPIOnce(command, timeoutMs);
+}
+
+// Spawn a one-shot Python process for a single command
+async function callPythonAPIOnce(command, timeoutMs = PYTHON_API_TIMEOUT_MS) {
   try {
     const commandJson = JSON.stringify(command);
-    const pythonCmd = process.platform === 'win32' 
-      ? `python "${PYTHON_API_SCRIPT}"`
-      : `python3 "${PYTHON_API_SCRIPT}"`;
+    const pythonCmd = `${PYTHON_BIN} "${PYTHON_API_SCRIPT}"`;
     
     const { stdout, stderr } = await execAsync(pythonCmd, {
       input: commandJson,
       maxBuffer: 10 * 1024 * 1024, // 10MB buffer
-      cwd: PURO_DIR
+      cwd: PURO_DIR,
+      timeout: timeoutMs
     });
     
     if (stderr && !stderr.includes('Warning') && !stderr.includes('Note')) {
@@ -655,11 +763,15 @@ app.post('/api/shipping/shipments/create', authenticateToken, async (req, res) =
     
     let shipmentResult;
     
+    // Retries of the same order (client or proxy) coalesce onto one Purolator shipment
+    const idempotencyKey = req.get('Idempotency-Key') || `rf-order:${orderId}`;
+    
     // Priority 1: If full shipment data is provided (direct shipping with address)
     if (shipmentData) {
       shipmentResult = await callPythonAPI({
         action: 'create_shipment_direct',
-        shipment_data: shipmentData
+        shipment_data: shipmentData,
+        idempotency_key: idempotencyKey
       });
     }
     // Priority 2: If locationId is provided, ship directly to that location
@@ -667,7 +779,8 @@ app.post('/api/shipping/shipments/create', authenticateToken, async (req, res) =
       shipmentResult = await callPythonAPI({
         action: 'ship_to_location',
         location_id: parseInt(locationId),
-        package_data: packageData || {}
+        package_data: packageData || {},
+        idempotency_key: idempotencyKey
       });
     }
     // Priority 3: If customerId is provided, ship to that customer's default location
@@ -675,7 +788,8 @@ app.post('/api/shipping/shipments/create', authenticateToken, async (req, res) =
       shipmentResult = await callPythonAPI({
         action: 'ship_to_customer',
         customer_id: parseInt(customerId),
-        package_data: packageData || {}
+        package_data: packageData || {},
+        idempotency_key: idempotencyKey
       });
     }
     // Priority 4: Try to find customer by name
@@ -691,7 +805,8 @@ app.post('/api/shipping/shipments/create', authenticateToken, async (req, res) =
           shipmentResult = await callPythonAPI({
             action: 'ship_to_customer',
             customer_id: customer.customer_id,
-            package_data: packageData || {}
+            package_data: packageData || {},
+            idempotency_key: idempotencyKey
           });
         } else {
           return res.status(404).json({
@@ -763,53 +878,85 @@ app.post('/api/shipping/shipments/batch', authenticateToken, async (req, res) =>
     // Get order details from storage
     const salesOrders = await readJSONFile(path.join(DATA_DIR, 'rf_sales_orders.json')) || [];
     
-    // Process each order individually
-    const results = [];
-    for (const orderId of orderIds) {
+    // Resolve orders locally, then look up all customers in one batched Python call
+    const results = new Array(orderIds.length);
+    const lookups = [];
+    orderIds.forEach((orderId, index) => {
       const order = salesOrders.find(so => so.id === orderId || so.soNumber === orderId);
-      if (!order) {
-        results.push({
+      if (order) {
+        lookups.push({ index, orderId, order });
+      } else {
+        results[index] = {
           order_id: orderId,
           status: 'Error',
           message: 'Order not found'
-        });
-        continue;
+        };
       }
-      
+    });
+    
+    if (lookups.length > 0) {
       try {
-        // Try to find customer by name
-        const searchResult = await callPythonAPI({
-          action: 'search_customers',
-          search_term: order.customer
+        const searchBatch = await callPythonAPI({
+          action: 'batch',
+          commands: lookups.map(({ order }) => ({
+            action: 'search_customers',
+            search_term: order.customer
+          }))
         });
+        const searchResults = searchBatch.status === 'success' ? searchBatch.data : [];
         
-        if (searchResult.status === 'success' && searchResult.data.length > 0) {
-          const customer = searchResult.data[0];
-          const shipmentResult = await callPythonAPI({
-            action: 'ship_to_customer',
-            customer_id: customer.customer_id,
-            package_data: {
-              ...packageData,
-              reference: order.soNumber
-            }
-          });
+        const shipments = [];
+        lookups.forEach((lookup, i) => {
+          const searchResult = searchResults[i];
+          if (searchResult && searchResult.status === 'success' && searchResult.data.length > 0) {
+            shipments.push({ ...lookup, customer: searchResult.data[0] });
+          } else {
+            results[lookup.index] = {
+              order_id: lookup.orderId,
+              status: 'Error',
+              message: `Customer "${lookup.order.customer}" not found in address book`
+            };
+          }
+        });
+        
+        // Create the shipments in batched calls of PYTHON_API_BATCH_SIZE; if one
+        // times out, the rest are reported as failed (their idempotency keys
+        // make a retry safe)
+        for (let start = 0; start < shipments.length; start += PYTHON_API_BATCH_SIZE) {
+          const chunk = shipments.slice(start, start + PYTHON_API_BATCH_SIZE);
+          const shipBatch = await callPythonAPI({
+            action: 'batch',
+            commands: chunk.map(({ orderId, order, customer }) => ({
+              action: 'ship_to_customer',
+              customer_id: customer.customer_id,
+              package_data: {
+                ...packageData,
+                reference: order.soNumber
+              },
+              idempotency_key: `rf-order:${orderId}`
+            }))
+          }, { timeoutMs: Math.min(PYTHON_API_TIMEOUT_MS * chunk.length, PYTHON_API_BATCH_TIMEOUT_MS) });
+          const shipResults = shipBatch.status === 'success' ? shipBatch.data : [];
           
-          results.push({
-            order_id: orderId,
-            ...shipmentResult
-          });
-        } else {
-          results.push({
-            order_id: orderId,
-            status: 'Error',
-            message: `Customer "${order.customer}" not found in address book`
+          chunk.forEach((shipment, i) => {
+            results[shipment.index] = {
+              order_id: shipment.orderId,
+              ...(shipResults[i] || {
+                status: 'Error',
+                message: shipBatch.message || 'Failed to create shipment'
+              })
+            };
           });
         }
       } catch (e) {
-        results.push({
-          order_id: orderId,
-          status: 'Error',
-          message: e.message || 'Failed to create shipment'
+        lookups.forEach(({ index, orderId }) => {
+          if (!results[index]) {
+            results[index] = {
+              order_id: orderId,
+              status: 'Error',
+              message: e.message || 'Failed to create shipment'
+            };
+          }
         });
       }
     }